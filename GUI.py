@@ -1,19 +1,28 @@
+import os
 import random
+import traceback
 import types
 
 from PySide6 import QtCore, QtWidgets, QtGui
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.integrate import solve_ivp
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from matplotlib.figure import Figure
-import matplotlib.colors as mcolors
 import sys
 from enum import Enum
-import matplotlib
-from scipy.integrate import odeint
 
-matplotlib.use('Qt5Agg')
+from analysis import analyseParametric, analyseStandard
+from equations import bindEquation, compileEquation, defaultParameterValue, equationParameters
+from exports import exportData, exportFilters
+from fatemaps import computeFateMap
+from fieldtextures import arrowRenderer, computeFieldTexture, fieldRenderers
+from fields import (fieldColor, fieldTiles, parametricQuiverStyle, parametricTitle, quiverScale,
+                    sampleParametricField, sampleStandardField, standardQuiverStyle, standardTitle)
+from integrators import parametricSystem, standardSystem
+from orbits import findPeriodicOrbit
+from particles import particleRenderer
+from portraits import computePortrait, seedingModes
+from profiling import profiler
+from solvers import SolveCancelled, TrajectoryCache, clipToWindow, solveStandard, solveParametric, standardSegment
+from sweeps import computeFrame, sequenceFrames
+from workspaces import loadWorkspace, restoreResults, saveWorkspace, workspaceExtension, workspaceFilter
 
 
 class Variables(Enum):
@@ -62,8 +71,98 @@ class VariableRangeWidget(QtWidgets.QWidget):
         self.layout.addWidget(self.maxInputBox, alignment=QtCore.Qt.AlignmentFlag.AlignCenter)
 
 
+class ParameterSliderWidget(QtWidgets.QWidget):
+    valueChangedSignal = QtCore.Signal(str, float)
+    sweepSignal = QtCore.Signal(str, object)
+    steps = 100
+
+    def __init__(self, name, value=defaultParameterValue):
+        super().__init__()
+        self.name = name
+
+        self.variableLabel = QtWidgets.QLabel(name + ":")
+        self.minInputBox = QtWidgets.QDoubleSpinBox()
+        self.minInputBox.setRange(-1000000000, 1000000000)
+        self.minInputBox.setValue(min(-5, value))
+        self.maxInputBox = QtWidgets.QDoubleSpinBox()
+        self.maxInputBox.setRange(-1000000000, 1000000000)
+        self.maxInputBox.setValue(max(5, value))
+        for inputBox in (self.minInputBox, self.maxInputBox):
+            inputBox.setFixedWidth(70)
+            inputBox.setButtonSymbols(QtWidgets.QAbstractSpinBox.ButtonSymbols.NoButtons)
+        self.slider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal)
+        self.slider.setRange(0, self.steps)
+        self.slider.setValue(round((value - self.minimum()) / (self.maximum() - self.minimum()) * self.steps))
+        self.valueLabel = QtWidgets.QLabel()
+        self.valueLabel.setFixedWidth(50)
+        self.sweepButton = QtWidgets.QPushButton("Sweep")
+        self.sweepButton.setFixedWidth(60)
+        self.sweepButton.setCheckable(True)
+        self.sweepButton.setToolTip("Precompute every slider position in the background")
+
+        self.slider.valueChanged.connect(self.emitValue)
+        self.minInputBox.valueChanged.connect(self.rangeChanged)
+        self.maxInputBox.valueChanged.connect(self.rangeChanged)
+        self.sweepButton.toggled.connect(self.emitSweep)
+
+        self.setLayout(QtWidgets.QHBoxLayout())
+        self.layout = self.layout()
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.layout.addWidget(self.variableLabel)
+        self.layout.addWidget(self.minInputBox)
+        self.layout.addWidget(self.slider)
+        self.layout.addWidget(self.maxInputBox)
+        self.layout.addWidget(self.valueLabel)
+        self.layout.addWidget(self.sweepButton)
+        self.valueLabel.setText("{:.4g}".format(self.value()))
+
+    def minimum(self):
+        return self.minInputBox.value()
+
+    def maximum(self):
+        return self.maxInputBox.value()
+
+    def valueAt(self, position):
+        # Sweeps use the same positions, so their frames match slider values exactly
+        return self.minimum() + (self.maximum() - self.minimum()) * position / self.steps
+
+    def value(self):
+        return self.valueAt(self.slider.value())
+
+    def sweepValues(self):
+        return [self.valueAt(position) for position in range(self.steps + 1)]
+
+    def emitValue(self):
+        self.valueLabel.setText("{:.4g}".format(self.value()))
+        self.valueChangedSignal.emit(self.name, self.value())
+
+    def rangeChanged(self):
+        if self.minimum() >= self.maximum():
+            self.maxInputBox.setValue(self.minimum() + 1)
+            return
+        self.emitValue()
+        self.emitSweep()
+
+    def emitSweep(self):
+        self.sweepSignal.emit(self.name, self.sweepValues() if self.sweepButton.isChecked() else None)
+
+    def sliderState(self):
+        return {"minimum": self.minimum(), "maximum": self.maximum(), "position": self.slider.value(),
+                "value": self.value()}
+
+    def setSliderState(self, state):
+        for widget, value in ((self.minInputBox, state["minimum"]), (self.maxInputBox, state["maximum"]),
+                              (self.slider, state["position"])):
+            widget.blockSignals(True)
+            widget.setValue(value)
+            widget.blockSignals(False)
+        self.emitValue()
+
+
 class ParametersGroupBox(QtWidgets.QWidget):
     parametersSignal = QtCore.Signal(float, float, float, float, float, float, float)
+    parameterSignal = QtCore.Signal(str, float)
+    sweepSignal = QtCore.Signal(str, object)
 
     def __init__(self):
         super().__init__()
@@ -94,6 +193,73 @@ class ParametersGroupBox(QtWidgets.QWidget):
         self.tRange.inputBox.setValue(10)
         self.tRange.inputBox.setSingleStep(1)
 
+        # Sliders for free parameters, hidden rather than deleted so their values survive switching equations.
+        # They scroll inside a fixed height so the window layout does not change with the number of parameters
+        self.parameterWidgets = {}
+        self.parameterSliders = QtWidgets.QWidget()
+        self.parameterSliders.layout = QtWidgets.QVBoxLayout(self.parameterSliders)
+        self.parameterSliders.layout.setContentsMargins(0, 0, 0, 0)
+        self.parameterSliders.layout.addStretch()
+        self.parameterScroll = QtWidgets.QScrollArea()
+        self.parameterScroll.setWidget(self.parameterSliders)
+        self.parameterScroll.setWidgetResizable(True)
+        self.parameterScroll.setFrameShape(QtWidgets.QFrame.Shape.NoFrame)
+        self.parameterScroll.setFixedHeight(70)
+        self.parameterScroll.setSizePolicy(QtWidgets.QSizePolicy.Policy.Ignored, QtWidgets.QSizePolicy.Policy.Fixed)
+        self.parameterScroll.hide()
+        self.layout.addWidget(self.parameterScroll)
+
+    @QtCore.Slot(float, float, float, float)
+    def setWindow(self, xmin, xmax, ymin, ymax):
+        # Mouse pans and zooms land here, the boxes change together so the graphs only see the final window
+        boxes = (self.xRange.minInputBox, self.xRange.maxInputBox, self.yRange.minInputBox, self.yRange.maxInputBox)
+        self.setBoxValues(boxes, (xmin, xmax, ymin, ymax))
+
+    def setParameters(self, xmin, xmax, ymin, ymax, tmax, density, lineLength):
+        boxes = (self.xRange.minInputBox, self.xRange.maxInputBox, self.yRange.minInputBox, self.yRange.maxInputBox,
+                 self.tRange.inputBox, self.densityWidget.inputBox, self.lineLengthWidget.inputBox)
+        self.setBoxValues(boxes, (xmin, xmax, ymin, ymax, tmax, density, lineLength))
+
+    def setBoxValues(self, boxes, values):
+        for box, value in zip(boxes, values):
+            box.blockSignals(True)
+            box.setValue(value)
+            box.blockSignals(False)
+        self.updateParameters()
+
+    def sliderStates(self):
+        return {name: widget.sliderState() for name, widget in self.parameterWidgets.items()}
+
+    def setSliderStates(self, states):
+        for name, state in states.items():
+            if name in self.parameterWidgets:
+                self.parameterWidgets[name].setSliderState(state)
+
+    @QtCore.Slot(object)
+    def setParameterNames(self, names):
+        for name, widget in self.parameterWidgets.items():
+            if name not in names:
+                widget.sweepButton.setChecked(False)
+            widget.setVisible(name in names)
+        for name in names:
+            if name not in self.parameterWidgets:
+                widget = ParameterSliderWidget(name)
+                widget.valueChangedSignal.connect(self.parameterSignal)
+                widget.sweepSignal.connect(self.sweepOnly)
+                self.parameterWidgets[name] = widget
+                self.parameterSliders.layout.insertWidget(self.parameterSliders.layout.count() - 1, widget)
+        self.parameterScroll.setVisible(bool(names))
+
+    def sweepOnly(self, name, values):
+        # One sweep at a time, starting another one stops the previous
+        if values is not None:
+            for otherName, widget in self.parameterWidgets.items():
+                if otherName != name and widget.sweepButton.isChecked():
+                    widget.sweepButton.blockSignals(True)
+                    widget.sweepButton.setChecked(False)
+                    widget.sweepButton.blockSignals(False)
+        self.sweepSignal.emit(name, values)
+
     def updateParameters(self):
 
         if float(self.xRange.minInputBox.text()) >= float(self.xRange.maxInputBox.text()):
@@ -126,49 +292,230 @@ class ParametersGroupBox(QtWidgets.QWidget):
         self.parametersSignal.emit(xmin, xmax, ymin, ymax, tmax, density, lineLength)
 
 
-class MplCanvas(FigureCanvasQTAgg):
-    fig = None
-    graphClickedSignal = QtCore.Signal(float, float)
+class SolveJobSignals(QtCore.QObject):
+    finishedSignal = QtCore.Signal(object, object)
 
-    def __init__(self, parent=None, width=5, height=4, dpi=100):
-        self.fig = Figure(figsize=(width, height), dpi=dpi)
-        self.axes = self.fig.add_subplot(111)
-        super(MplCanvas, self).__init__(self.fig)
-        self.cid = self.fig.canvas.mpl_connect('button_press_event', self.onGraphPress)
 
-    def onGraphPress(self, event):
-        self.graphClickedSignal.emit(event.xdata, event.ydata)
+class SolveJob(QtCore.QRunnable):
+    def __init__(self, generation, request, solveFunction, args):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.generation = generation
+        self.request = request
+        self.solveFunction = solveFunction
+        self.args = args
+        self.cancelled = False
+        self.error = None
+        self.signals = SolveJobSignals()
+
+    def run(self):
+        result = None
+        if not self.cancelled:
+            try:
+                with profiler.span("job " + self.solveFunction.__name__):
+                    result = self.solveFunction(*self.args, isCancelled=lambda: self.cancelled)
+            except SolveCancelled:
+                pass
+            except Exception as err:
+                traceback.print_exc()
+                self.error = err
+        self.signals.finishedSignal.emit(self, result)
+
+
+class SolverService(QtCore.QObject):
+    solvedSignal = QtCore.Signal(object, object)
+    # Emitted with the request and the exception of a job that raised, cancelled jobs report nothing
+    failedSignal = QtCore.Signal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.threadPool = QtCore.QThreadPool(self)
+        self.generation = 0
+        self.jobs = set()
+
+    def submit(self, request, solveFunction, *args):
+        job = SolveJob(self.generation, request, solveFunction, args)
+        job.signals.finishedSignal.connect(self.jobFinished)
+        self.jobs.add(job)
+        self.threadPool.start(job)
+        return job
+
+    def cancel(self, job):
+        # Only this job, the others keep running and still report back
+        job.cancelled = True
+
+    def cancelAll(self):
+        # Jobs stay referenced until they report back, they just skip or abort their work
+        self.generation += 1
+        for job in self.jobs:
+            job.cancelled = True
+
+    @QtCore.Slot(object, object)
+    def jobFinished(self, job, result):
+        self.jobs.discard(job)
+        if job.cancelled or job.generation != self.generation:
+            return
+        if job.error is not None:
+            self.failedSignal.emit(job.request, job.error)
+        elif result is not None:
+            self.solvedSignal.emit(job.request, result)
+
+
+class RenderScheduler(QtCore.QObject):
+    def __init__(self, renderFunction, signatureFunction, debounceMs=40, maxDelayMs=120):
+        super().__init__()
+        self.renderFunction = renderFunction
+        self.signatureFunction = signatureFunction
+        self.debounceMs = debounceMs
+        self.maxDelayMs = maxDelayMs
+        self.lastSignature = None
+        self.burstTimer = QtCore.QElapsedTimer()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.run)
+
+    def setDebounce(self, debounceMs, maxDelayMs=None):
+        self.debounceMs = debounceMs
+        if maxDelayMs is not None:
+            self.maxDelayMs = maxDelayMs
+
+    def schedule(self):
+        # Restart the debounce window on every request, but never hold a burst back longer than maxDelayMs
+        if not self.timer.isActive():
+            self.burstTimer.start()
+            self.timer.start(self.debounceMs)
+        elif self.burstTimer.elapsed() + self.debounceMs <= self.maxDelayMs:
+            self.timer.start(self.debounceMs)
+
+    def invalidate(self):
+        self.lastSignature = None
+
+    def run(self):
+        self.timer.stop()
+        signature = self.signatureFunction()
+        if signature == self.lastSignature:
+            return
+        self.renderFunction()
+        self.lastSignature = signature
 
 
 class GraphsGroupBox(QtWidgets.QWidget):
+    parameterNamesSignal = QtCore.Signal(object)
+    windowSignal = QtCore.Signal(float, float, float, float)
+    sequenceProgressSignal = QtCore.Signal(int, int)
+
     def __init__(self):
         super().__init__()
         self.setLayout(QtWidgets.QGridLayout())
         self.layout = self.layout()
         self.solutionPoints = []
-
-        self.mainGraph = MplCanvas()
-        self.mainGraph.graphClickedSignal.connect(self.graphSolution)
+        self.solverService = SolverService()
+        self.trajectoryCache = TrajectoryCache()
+        self.solverService.solvedSignal.connect(self.drawSolution)
+
+        # Sweeps run on their own service so redraws cancelling solves leave precomputation alone
+        self.parameterValues = {}
+        self.parameterNames = ()
+        self.sweepService = SolverService()
+        self.sweepService.solvedSignal.connect(self.storeFrame)
+        self.sweepName = None
+        self.sweepValues = None
+        self.sweepFrames = {}
+        # Exports also outlive redraws, large seed sets can take a while to solve
+        self.exportService = SolverService()
+        self.exportService.solvedSignal.connect(self.exportFinished)
+        self.exportService.failedSignal.connect(self.exportFailed)
+        self.sequenceProgress = None
+        self.sequenceProgressSignal.connect(self.updateSequenceProgress)
+
+        # Placeholders keep the window layout until loadGraphs() swaps in the matplotlib canvases
+        self.graphsLoaded = False
+        self.mainGraph = QtWidgets.QLabel("Loading graphs...")
+        self.mainGraph.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
         self.mainGraph.setMinimumSize(600, 600)
         self.mainGraph.setMaximumSize(600, 600)
-        self.xParametricGraph = MplCanvas()
+        self.xParametricGraph = QtWidgets.QWidget()
         self.xParametricGraph.setMaximumSize(350, 295)
         self.xParametricGraph.setMinimumSize(350, 295)
-        self.yParametricGraph = MplCanvas()
+        self.yParametricGraph = QtWidgets.QWidget()
         self.yParametricGraph.setMaximumSize(350, 295)
         self.yParametricGraph.setMinimumSize(350, 295)
 
         self.clearSolutionsButton = QtWidgets.QPushButton("Clear Solutions")
-        self.clearSolutionsButton.setFixedWidth(150)
+        self.clearSolutionsButton.setFixedWidth(130)
         self.clearSolutionsButton.clicked.connect(self.clearSolutions)
 
+        self.fateMapButton = QtWidgets.QPushButton("Fate Map")
+        self.fateMapButton.setFixedWidth(130)
+        self.fateMapButton.setCheckable(True)
+        self.fateMapButton.setToolTip("Colour every point of the window by where its trajectory ends up")
+        self.fateMapButton.toggled.connect(self.setFateMapEnabled)
+        self.fateMapButton.hide()
+
+        self.orbitButton = QtWidgets.QPushButton("Periodic Orbits")
+        self.orbitButton.setFixedWidth(130)
+        self.orbitButton.setCheckable(True)
+        self.orbitButton.setToolTip("Find the cycle each clicked trajectory settles onto, its period and stability")
+        self.orbitButton.toggled.connect(self.setOrbitsEnabled)
+        self.orbitButton.hide()
+
+        self.analysisButton = QtWidgets.QPushButton("Nullclines")
+        self.analysisButton.setFixedWidth(130)
+        self.analysisButton.setCheckable(True)
+        self.analysisButton.setToolTip("Show nullclines, isoclines and classified equilibria")
+        self.analysisButton.toggled.connect(self.setAnalysisEnabled)
+
+        self.fieldRendererBox = QtWidgets.QComboBox()
+        self.fieldRendererBox.addItems(fieldRenderers + (particleRenderer,))
+        self.fieldRendererBox.setSizeAdjustPolicy(
+            QtWidgets.QComboBox.SizeAdjustPolicy.AdjustToMinimumContentsLengthWithIcon)
+        self.fieldRendererBox.setMinimumContentsLength(8)
+        self.fieldRendererBox.setToolTip("How the field is drawn, images stay fast at densities arrows cannot reach")
+        self.fieldRendererBox.currentTextChanged.connect(self.setFieldRenderer)
+
+        self.portraitSeedingBox = QtWidgets.QComboBox()
+        self.portraitSeedingBox.addItems(seedingModes)
+        self.portraitButton = QtWidgets.QPushButton("Auto Portrait")
+        self.portraitButton.setFixedWidth(130)
+        self.portraitButton.clicked.connect(self.autoPortrait)
+        self.buttonsWidget = QtWidgets.QWidget()
+        self.buttonsWidget.layout = QtWidgets.QHBoxLayout(self.buttonsWidget)
+        self.buttonsWidget.layout.addWidget(self.fieldRendererBox)
+        self.buttonsWidget.layout.addWidget(self.portraitSeedingBox)
+        self.buttonsWidget.layout.addWidget(self.portraitButton)
+        self.buttonsWidget.layout.addWidget(self.fateMapButton)
+        self.buttonsWidget.layout.addWidget(self.orbitButton)
+        self.buttonsWidget.layout.addWidget(self.analysisButton)
+        self.buttonsWidget.layout.addWidget(self.clearSolutionsButton)
+
         self.layout.addWidget(self.mainGraph, 0, 0, 2, 1)
         self.layout.addWidget(self.xParametricGraph, 0, 1, 1, 1)
         self.layout.addWidget(self.yParametricGraph, 1, 1, 1, 1)
-        self.layout.addWidget(self.clearSolutionsButton, 2, 0, 1, 2, alignment=QtCore.Qt.AlignmentFlag.AlignCenter)
+        self.layout.addWidget(self.buttonsWidget, 2, 0, 1, 2, alignment=QtCore.Qt.AlignmentFlag.AlignCenter)
         self.xParametricGraph.hide()
         self.yParametricGraph.hide()
 
+        self.solutionLines = {}
+        self.portraitLines = None
+        self.portraitSeeding = None
+        self.fieldQuiver = None
+        self.fieldQuiverKey = None
+        self.fateMapImage = None
+        self.fateMapEnabled = False
+        self.fateMap = None
+        self.fateMapKey = None
+        self.analysisOverlay = None
+        self.orbitsEnabled = False
+        # Orbits by (xEquation, yEquation, seed), the window only bounds how far their search follows a trajectory
+        self.periodicOrbits = {}
+        self.periodicOrbitOverlay = None
+        self.fieldRenderer = arrowRenderer
+        self.fieldTextureImage = None
+        self.fieldTexture = None
+        self.fieldTextureKey = None
+        self.particleImage = None
+        self.analysisEnabled = False
+
         self.xEquation = (None, None)
         self.yEquation = (None, None)
         self.isStandard = True
@@ -180,8 +527,44 @@ class GraphsGroupBox(QtWidgets.QWidget):
         self.tmax = 10
         self.density = 1
         self.lineLength = 1
+        self.mouseWindow = None
+
+        self.renderScheduler = RenderScheduler(self.graphField, self.renderSignature)
+
+    def loadGraphs(self):
+        from canvas import (AnalysisOverlay, FateMapImage, FieldTextureImage, MplCanvas, ParticleFlowImage,
+                            PeriodicOrbitOverlay, SolutionLines, lineColors)
+
+        self.lineColors = lineColors
+        canvases = []
+        for name, placeholder in (("mainGraph", self.mainGraph), ("xParametricGraph", self.xParametricGraph),
+                                  ("yParametricGraph", self.yParametricGraph)):
+            canvas = MplCanvas()
+            canvas.setObjectName(name)
+            canvas.setMinimumSize(placeholder.minimumSize())
+            canvas.setMaximumSize(placeholder.maximumSize())
+            canvas.setVisible(not placeholder.isHidden())
+            self.layout.replaceWidget(placeholder, canvas)
+            placeholder.deleteLater()
+            canvases.append(canvas)
+        self.mainGraph, self.xParametricGraph, self.yParametricGraph = canvases
+        self.mainGraph.graphClickedSignal.connect(self.graphSolution)
+        self.mainGraph.graphPanSignal.connect(self.panWindow)
+        self.mainGraph.graphZoomSignal.connect(self.zoomWindow)
+
+        self.solutionLines = {canvas: SolutionLines(canvas) for canvas in canvases}
+        self.portraitLines = SolutionLines(self.mainGraph, 0.8)
+        self.fateMapImage = FateMapImage(self.mainGraph)
+        self.analysisOverlay = AnalysisOverlay(self.mainGraph)
+        self.periodicOrbitOverlay = PeriodicOrbitOverlay(self.mainGraph)
+        self.fieldTextureImage = FieldTextureImage(self.mainGraph)
+        self.particleImage = ParticleFlowImage(self.mainGraph)
+        self.graphsLoaded = True
+        self.requestRender()
 
     def saveToFile(self):
+        if not self.graphsLoaded:
+            return
         self.saveDialog = QtWidgets.QFileDialog()
         self.saveDialog.setFileMode(QtWidgets.QFileDialog.FileMode.Directory)
         try:
@@ -189,20 +572,203 @@ class GraphsGroupBox(QtWidgets.QWidget):
         except:
             return
         if self.isStandard:
-            self.mainGraph.print_jpg(self.fileName[0])
+            self.mainGraph.printFigure(self.fileName[0])
         else:
-            self.mainGraph.print_jpg(self.fileName[0])
-            self.xParametricGraph.print_jpg(self.fileName[0].split(".")[0] + "_x_graph.jpg")
-            self.yParametricGraph.print_jpg(self.fileName[0].split(".")[0] + "_y_graph.jpg")
+            self.mainGraph.printFigure(self.fileName[0])
+            self.xParametricGraph.printFigure(self.fileName[0].split(".")[0] + "_x_graph.jpg")
+            self.yParametricGraph.printFigure(self.fileName[0].split(".")[0] + "_y_graph.jpg")
 
 
+    def exportToFile(self):
+        if self.yEquation[0] is None or (not self.isStandard and self.xEquation[0] is None):
+            return
+        fileName, selectedFilter = QtWidgets.QFileDialog.getSaveFileName(self, "Export Data", "export.npz",
+                                                                         filter=";;".join(exportFilters))
+        if not fileName:
+            return
+        if not fileName.endswith(tuple(exportFilters.values())):
+            fileName += exportFilters.get(selectedFilter, ".npz")
+        self.exportService.submit((self.isStandard, "export"), exportData, fileName, self.isStandard,
+                                  self.xEquation[1], self.yEquation[1], list(self.solutionPoints), self.xmin,
+                                  self.xmax, self.ymin, self.ymax, self.tmax, self.density, self.trajectoryCache)
+
+    def closeSequenceProgress(self):
+        if self.sequenceProgress is not None:
+            self.sequenceProgress.close()
+            self.sequenceProgress = None
+
+    @QtCore.Slot(object, object)
+    def exportFinished(self, request, result):
+        if request[1] != "sequence":
+            QtWidgets.QMessageBox.information(self, "Export Data", "Exported to:\n" + "\n".join(result))
+            return
+        self.closeSequenceProgress()
+        message = str(len(result.outputs)) + " files written"
+        if result.skipped:
+            message += ", " + str(result.skipped) + " frames already existed and were skipped"
+        if result.failures:
+            message += "\n" + str(len(result.failures)) + " frames failed:\n" + "\n".join(
+                output + ": " + error for output, error in result.failures[:10])
+            QtWidgets.QMessageBox.warning(self, "Export Sweep Frames", message)
+        else:
+            QtWidgets.QMessageBox.information(self, "Export Sweep Frames", message)
+
+    @QtCore.Slot(object, object)
+    def exportFailed(self, request, error):
+        if request[1] == "sequence":
+            self.closeSequenceProgress()
+            QtWidgets.QMessageBox.warning(self, "Export Sweep Frames", "The export failed: " + str(error))
+        else:
+            QtWidgets.QMessageBox.warning(self, "Export Data", "The export failed: " + str(error))
+
+    def sequenceDescription(self, output):
+        # The active slider sweep becomes the sequence, without one parametric fields sweep tmax instead
+        sequence = {"mode": "standard" if self.isStandard else "parametric",
+                    "window": [self.xmin, self.xmax, self.ymin, self.ymax], "tmax": self.tmax,
+                    "density": self.density, "lineLength": self.lineLength,
+                    "seeds": [list(point) for point in self.solutionPoints], "portrait": self.portraitSeeding,
+                    "parameters": dict(self.parameterValues), "output": output}
+        if self.isStandard:
+            sequence["equation"] = self.yEquation[0]
+        else:
+            sequence["xEquation"] = self.xEquation[0]
+            sequence["yEquation"] = self.yEquation[0]
+        if self.sweepName is not None:
+            sequence["frames"] = len(self.sweepValues)
+            sequence["sweep"] = {"parameters": {self.sweepName: [self.sweepValues[0], self.sweepValues[-1]]}}
+        elif not self.isStandard:
+            sequence["frames"] = sequenceFrames
+            sequence["sweep"] = {"tmax": [self.tmax / sequenceFrames, self.tmax]}
+        else:
+            return None
+        return sequence
+
+    def exportSweepFrames(self):
+        if self.yEquation[0] is None or (not self.isStandard and self.xEquation[0] is None):
+            return
+        if self.sequenceDescription("") is None:
+            QtWidgets.QMessageBox.information(self, "Export Sweep Frames",
+                                              "Slope fields need a parameter sweep to export frames. Turn on the "
+                                              "sweep of a parameter slider first.")
+            return
+        fileName, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Sweep Frames", "frame.png",
+                                                            filter="PNG images (*.png);;JPEG images (*.jpg)")
+        if not fileName:
+            return
+        root, extension = os.path.splitext(fileName)
+        sequence = self.sequenceDescription(root + "_{frame:04d}" + (extension or ".png"))
+        from render import exportSequence
+
+        self.sequenceProgress = QtWidgets.QProgressDialog("Rendering frames...", "Cancel", 0, sequence["frames"], self)
+        self.sequenceProgress.setWindowTitle("Export Sweep Frames")
+        self.sequenceProgress.show()
+        job = self.exportService.submit((self.isStandard, "sequence"), exportSequence, sequence, None,
+                                        self.sequenceProgressSignal.emit)
+        # A data export running alongside the frames is left alone
+        self.sequenceProgress.canceled.connect(lambda: self.exportService.cancel(job))
+        self.sequenceProgress.canceled.connect(self.closeSequenceProgress)
+
+    @QtCore.Slot(int, int)
+    def updateSequenceProgress(self, done, total):
+        if self.sequenceProgress is not None:
+            self.sequenceProgress.setValue(done)
+
     def clearSolutions(self):
         self.solutionPoints = []
+        self.periodicOrbits = {}
+        self.portraitSeeding = None
         self.clearGraphs()
-        self.graphField()
+        self.requestRender()
+
+    def requestRender(self):
+        names = self.activeParameters()
+        if names != self.parameterNames:
+            self.parameterNames = names
+            self.parameterNamesSignal.emit(names)
+        self.renderScheduler.schedule()
+
+    def activeParameters(self):
+        equationStrings = [self.yEquation[0]] if self.isStandard else [self.xEquation[0], self.yEquation[0]]
+        return tuple(sorted({name for equationString in equationStrings if equationString is not None
+                             for name in equationParameters(equationString)}))
+
+    def bindParameters(self, equation, parameterValues):
+        equationString, equationLambda = equation
+        if equationString is None or not equationParameters(equationString):
+            return equation
+        return equationString, bindEquation(equationString, parameterValues)
+
+    @QtCore.Slot(str, float)
+    def setParameter(self, name, value):
+        self.parameterValues[name] = value
+        self.xEquation = self.bindParameters(self.xEquation, self.parameterValues)
+        self.yEquation = self.bindParameters(self.yEquation, self.parameterValues)
+        self.requestRender()
+
+    def frameKey(self, xEquation, yEquation):
+        equations = (yEquation,) if self.isStandard else (xEquation, yEquation)
+        return (self.isStandard, tuple((equationString, getattr(equationLambda, "parameters", ()))
+                                       for equationString, equationLambda in equations),
+                self.xmin, self.xmax, self.ymin, self.ymax, self.tmax, self.density, tuple(self.solutionPoints))
+
+    @QtCore.Slot(str, object)
+    def sweepParameter(self, name, values):
+        if values is None and name != self.sweepName:
+            return
+        self.sweepService.cancelAll()
+        self.sweepFrames = {}
+        self.sweepName = None if values is None else name
+        self.sweepValues = values
+        if values is None:
+            return
+        if self.yEquation[0] is None or (not self.isStandard and self.xEquation[0] is None):
+            return
+        for value in values:
+            parameterValues = dict(self.parameterValues)
+            parameterValues[name] = value
+            xEquation = self.bindParameters(self.xEquation, parameterValues)
+            yEquation = self.bindParameters(self.yEquation, parameterValues)
+            self.sweepService.submit((self.isStandard, "frame", self.frameKey(xEquation, yEquation)), computeFrame,
+                                     self.isStandard, xEquation[1], yEquation[1], list(self.solutionPoints),
+                                     self.xmin, self.xmax, self.ymin, self.ymax, self.tmax, self.density,
+                                     self.trajectoryCache)
+
+    @QtCore.Slot(object, object)
+    def storeFrame(self, request, frame):
+        self.sweepFrames[request[2]] = frame
+
+    def drawFrame(self, frame):
+        field, solutions = frame
+        self.clearGraphs()
+        if self.isStandard:
+            self.graphStandardField(field)
+            for solution in solutions:
+                self.graphStandardSolution(solution)
+        else:
+            self.graphParametricField(field)
+            for solution in solutions:
+                self.graphParametricSolution(solution)
+        if self.portraitSeeding is not None:
+            self.graphPortrait()
+
+    def renderSignature(self):
+        if self.isStandard:
+            return (True, self.yEquation[1], self.xmin, self.xmax, self.ymin, self.ymax, self.density,
+                    self.lineLength, tuple(self.solutionPoints), self.portraitSeeding, self.analysisEnabled,
+                    self.fieldRenderer)
+        return (False, self.xEquation[1], self.yEquation[1], self.xmin, self.xmax, self.ymin, self.ymax, self.tmax,
+                self.density, self.lineLength, tuple(self.solutionPoints), self.portraitSeeding, self.fateMapEnabled,
+                self.analysisEnabled, self.orbitsEnabled, self.fieldRenderer)
 
     @QtCore.Slot(float, float, float, float, float, float, float)
     def updateParameters(self, xmin, xmax, ymin, ymax, tmax, density, lineLength):
+        # The boxes show the window to two decimals. While they still show the window the mouse last set, that exact
+        # window is kept, so long drags follow the cursor instead of drifting with every rounded step
+        if self.mouseWindow is not None and np.allclose(np.round(self.mouseWindow, 2), (xmin, xmax, ymin, ymax),
+                                                        rtol=0, atol=1e-9):
+            xmin, xmax, ymin, ymax = self.mouseWindow
+        else:
+            self.mouseWindow = None
         self.xmin = xmin
         self.xmax = xmax
         self.ymin = ymin
@@ -210,17 +776,33 @@ class GraphsGroupBox(QtWidgets.QWidget):
         self.tmax = tmax
         self.density = density
         self.lineLength = lineLength
-        self.graphField()
+        self.requestRender()
+
+    @QtCore.Slot(float, float)
+    def panWindow(self, dx, dy):
+        self.setMouseWindow(self.xmin + dx, self.xmax + dx, self.ymin + dy, self.ymax + dy)
+
+    def setMouseWindow(self, xmin, xmax, ymin, ymax):
+        self.mouseWindow = (xmin, xmax, ymin, ymax)
+        self.windowSignal.emit(xmin, xmax, ymin, ymax)
+
+    @QtCore.Slot(float, float, float)
+    def zoomWindow(self, x, y, factor):
+        # The spin boxes hold two decimals, so zooming in stops before the window collapses
+        if factor < 1 and min(self.xmax - self.xmin, self.ymax - self.ymin) * factor < 0.1:
+            return
+        self.setMouseWindow(x + (self.xmin - x) * factor, x + (self.xmax - x) * factor,
+                            y + (self.ymin - y) * factor, y + (self.ymax - y) * factor)
 
     @QtCore.Slot(Variables, str, types.LambdaType)
     def setEquation(self, variable, equationString, equationLambda):
         if variable == Variables.X:
-            self.xEquation = (equationString, equationLambda)
+            self.xEquation = self.bindParameters((equationString, equationLambda), self.parameterValues)
         elif variable == Variables.Y:
-            self.yEquation = (equationString, equationLambda)
+            self.yEquation = self.bindParameters((equationString, equationLambda), self.parameterValues)
         self.clearGraphs()
         self.solutionPoints = []
-        self.graphField()
+        self.requestRender()
 
     @QtCore.Slot(str)
     def removeEquation(self, equationString):
@@ -230,31 +812,43 @@ class GraphsGroupBox(QtWidgets.QWidget):
                 self.clearGraphs()
         elif self.yEquation[0] == equationString:
             self.yEquation = (None, None)
-        self.graphField()
+        self.requestRender()
 
     def graphField(self):
+        if not self.graphsLoaded:
+            return
+        frame = self.sweepFrames.get(self.frameKey(self.xEquation, self.yEquation)) if self.sweepFrames else None
+        if frame is not None:
+            self.drawFrame(frame)
+            return
         self.clearFields()
         if self.isStandard:
             if self.yEquation[0] is not None:
                 self.graphStandardField()
+                return
         else:
             if self.xEquation[0] is not None and self.yEquation[0] is not None:
                 self.graphParametricField()
+                return
+        self.fieldTextureImage.hide()
+        self.particleImage.stop()
 
     @QtCore.Slot(float, float)
     def graphSolution(self, xinit, yinit):
-        if xinit is not None and yinit is not None:
-            if xinit > self.xmax:
-                xinit = self.xmax
-            if xinit < self.xmin:
-                xinit = self.xmin
-            if yinit > self.ymax:
-                yinit = self.ymax
-            if yinit < self.ymin:
-                yinit = self.ymin
+        if xinit is None or yinit is None:
+            return
+        if xinit > self.xmax:
+            xinit = self.xmax
+        if xinit < self.xmin:
+            xinit = self.xmin
+        if yinit > self.ymax:
+            yinit = self.ymax
+        if yinit < self.ymin:
+            yinit = self.ymin
         if self.isStandard:
             if self.yEquation[0] is not None:
-                self.graphStandardSolution(xinit, yinit)
+                self.solverService.submit((True, "solution"), solveStandard, self.yEquation[1], xinit, yinit,
+                                          self.xmin, self.xmax, self.ymin, self.ymax, self.trajectoryCache)
                 if (xinit, yinit) not in self.solutionPoints:
                     self.solutionPoints.append((xinit, yinit))
                 #print(self.solutionPoints)
@@ -262,127 +856,255 @@ class GraphsGroupBox(QtWidgets.QWidget):
                 self.clearGraphs()
         else:
             if self.xEquation[0] is not None and self.yEquation[0] is not None:
-                self.graphParametricSolution(xinit, yinit)
+                self.solverService.submit((False, "solution"), solveParametric, self.xEquation[1],
+                                          self.yEquation[1], xinit, yinit, self.tmax, self.xmin, self.xmax, self.ymin,
+                                          self.ymax, self.trajectoryCache)
                 if (xinit, yinit) not in self.solutionPoints:
                     self.solutionPoints.append((xinit, yinit))
+                if self.orbitsEnabled:
+                    self.graphPeriodicOrbit(xinit, yinit)
             else:
                 self.clearGraphs()
 
+    @QtCore.Slot(object, object)
+    def drawSolution(self, request, solution):
+        isStandard, kind = request[:2]
+        if isStandard != self.isStandard:
+            return
+        if kind == "orbit":
+            self.periodicOrbits[request[2]] = solution
+            self.showPeriodicOrbits()
+        elif kind == "texture":
+            self.fieldTexture = solution
+            self.fieldTextureImage.show(solution)
+            self.mainGraph.requestRefresh()
+        elif kind == "fatemap":
+            self.fateMap = solution
+            self.fateMapImage.show(solution)
+            self.mainGraph.requestRefresh()
+        elif kind == "portrait":
+            self.portraitLines.clear()
+            self.portraitLines.extend(solution, ['tab:blue'] * len(solution))
+            self.mainGraph.requestRefresh()
+        elif isStandard:
+            self.graphStandardSolution(solution)
+        else:
+            self.graphParametricSolution(solution)
+
+    def autoPortrait(self):
+        self.portraitSeeding = self.portraitSeedingBox.currentText()
+        if self.graphsLoaded:
+            self.graphPortrait()
+
+    def graphPortrait(self):
+        if self.isStandard:
+            if self.yEquation[0] is None:
+                return
+            system = standardSystem(self.yEquation[1])
+            forwardSpan, backwardSpan = self.xmax - self.xmin, self.xmin - self.xmax
+        else:
+            if self.xEquation[0] is None or self.yEquation[0] is None:
+                return
+            system = parametricSystem(self.xEquation[1], self.yEquation[1])
+            forwardSpan, backwardSpan = self.tmax, -self.tmax
+        existingSegments = list(self.solutionLines[self.mainGraph].segments)
+        self.solverService.submit((self.isStandard, "portrait"), computePortrait, system, self.xmin, self.xmax,
+                                  self.ymin, self.ymax, forwardSpan, backwardSpan, self.portraitSeeding, self.density,
+                                  existingSegments)
+
+    def setFieldRenderer(self, renderer):
+        self.fieldRenderer = renderer
+        self.requestRender()
+
+    def graphFieldTexture(self):
+        xEquation = None if self.isStandard else self.xEquation[1]
+        key = (self.fieldRenderer, self.isStandard, xEquation, self.yEquation[1], self.xmin, self.xmax, self.ymin,
+               self.ymax, self.density)
+        if key == self.fieldTextureKey and self.fieldTexture is not None:
+            self.fieldTextureImage.show(self.fieldTexture)
+            return
+        # The previous image stays up until the new one arrives, so panning does not flicker
+        self.fieldTextureKey = key
+        self.fieldTexture = None
+        self.solverService.submit((self.isStandard, "texture"), computeFieldTexture, self.fieldRenderer,
+                                  self.isStandard, xEquation, self.yEquation[1], self.xmin, self.xmax, self.ymin,
+                                  self.ymax, self.density)
+
+    def setAnalysisEnabled(self, enabled):
+        self.analysisEnabled = enabled
+        self.requestRender()
+
+    def graphAnalysis(self):
+        # Analysis results are cached per bound equation and window, and carry the quiver sample they were taken from
+        if not self.analysisEnabled:
+            return None
+        if self.isStandard:
+            analysis = analyseStandard(self.yEquation[1], self.xmin, self.xmax, self.ymin, self.ymax, self.density)
+        else:
+            analysis = analyseParametric(self.xEquation[1], self.yEquation[1], self.xmin, self.xmax, self.ymin,
+                                         self.ymax, self.density)
+        self.analysisOverlay.show(analysis)
+        return analysis
+
+    def setOrbitsEnabled(self, enabled):
+        self.orbitsEnabled = enabled
+        self.requestRender()
+
+    def graphPeriodicOrbit(self, xinit, yinit):
+        key = (self.xEquation[1], self.yEquation[1], (xinit, yinit))
+        if key in self.periodicOrbits:
+            self.showPeriodicOrbits()
+            return
+        self.solverService.submit((False, "orbit", key), findPeriodicOrbit, self.xEquation[1], self.yEquation[1],
+                                  xinit, yinit, self.xmin, self.xmax, self.ymin, self.ymax)
+
+    def showPeriodicOrbits(self):
+        orbits = [self.periodicOrbits[key] for key in
+                  ((self.xEquation[1], self.yEquation[1], point) for point in self.solutionPoints)
+                  if key in self.periodicOrbits]
+        self.periodicOrbitOverlay.show(orbits)
+        self.mainGraph.requestRefresh()
+
+    def setFateMapEnabled(self, enabled):
+        self.fateMapEnabled = enabled
+        self.requestRender()
+
+    def graphFateMap(self):
+        # Fate maps are parametric only, a standard equation has no long-run state to classify
+        if self.isStandard or self.xEquation[0] is None or self.yEquation[0] is None:
+            return
+        resolution = min(600, int(200 * self.density))
+        key = (self.xEquation[1], self.yEquation[1], self.xmin, self.xmax, self.ymin, self.ymax, resolution,
+               self.tmax)
+        if key == self.fateMapKey and self.fateMap is not None:
+            self.fateMapImage.show(self.fateMap)
+            return
+        self.fateMapKey = key
+        self.fateMap = None
+        self.solverService.submit((False, "fatemap"), computeFateMap, self.xEquation[1], self.yEquation[1],
+                                  self.xmin, self.xmax, self.ymin, self.ymax, resolution, max(self.tmax, 100))
+
     def setTitle(self, title):
         self.mainGraph.axes.set_title(title)
         self.mainGraph.axes.draw()
 
-    def graphStandardField(self):
-        x = np.linspace(self.xmin, self.xmax, int(self.density * 20))
-        y = np.linspace(self.ymin, self.ymax, int(self.density * 20))
-        X, Y = np.meshgrid(x, y)
-        ratio = (self.ymax-self.ymin)/(self.xmax-self.xmin)
-
-        slopes = self.yEquation[1](X, Y)
-        U = (1 / (1 + slopes ** 2) ** 0.5) * np.ones(X.shape) * ratio
-        V = (1 / (1 + slopes ** 2) ** 0.5) * slopes
-
-        scale = 50 / self.lineLength
-        self.mainGraph.axes.set_title("Slope Field Generator")
+    def graphStandardField(self, field=None):
+        analysis = self.graphAnalysis()
+        self.mainGraph.axes.set_title(standardTitle)
         self.mainGraph.axes.set_xlabel("x")
         self.mainGraph.axes.set_ylabel("y")
-        self.mainGraph.axes.quiver(X, Y, U, V, headlength=0, headwidth=1, color='deepskyblue', scale=scale)
-        self.mainGraph.draw()
-
-    def graphParametricField(self):
-        x = np.linspace(self.xmin, self.xmax, int(self.density * 20))
-        y = np.linspace(self.ymin, self.ymax, int(self.density * 20))
-        X, Y = np.meshgrid(x, y)
-        ratio = (self.ymax-self.ymin)/(self.xmax-self.xmin)
-
-        U = self.xEquation[1](X, Y) * ratio
-        V = self.yEquation[1](X, Y)
-
-        scale = 50 / self.lineLength
-        self.mainGraph.axes.set_title("Vector Field Generator")
+        self.drawField(field, analysis, lambda: sampleStandardField(self.yEquation[1], self.xmin, self.xmax,
+                                                                    self.ymin, self.ymax, self.density),
+                       standardQuiverStyle)
+        self.mainGraph.requestRefresh()
+
+    def graphParametricField(self, field=None):
+        analysis = self.graphAnalysis()
+        self.mainGraph.axes.set_title(parametricTitle)
         self.mainGraph.axes.set_xlabel("x")
         self.mainGraph.axes.set_ylabel("y")
-        self.mainGraph.axes.quiver(X, Y, U, V, headwidth=5, color='deepskyblue', scale=scale)
-        self.mainGraph.draw()
+        self.drawField(field, analysis, lambda: sampleParametricField(self.xEquation[1], self.yEquation[1], self.xmin,
+                                                                      self.xmax, self.ymin, self.ymax, self.density),
+                       parametricQuiverStyle)
+        self.mainGraph.requestRefresh()
 
         self.xParametricGraph.axes.set_xlabel("t")
         self.xParametricGraph.axes.set_ylabel("x")
-        self.xParametricGraph.draw()
+        self.xParametricGraph.requestRefresh()
 
         self.yParametricGraph.axes.set_xlabel("t")
         self.yParametricGraph.axes.set_ylabel("y")
-        self.yParametricGraph.draw()
-
-    def graphStandardSolution(self, xinit, yinit):
-        colors = list(mcolors.TABLEAU_COLORS.keys())
-        lineColor = colors[random.randint(0, 9)]
-
-        leftTimes = np.linspace(xinit, self.xmin, 500)
-        solution = solve_ivp(self.yEquation[1], y0=(xinit, yinit), t_span=(xinit, self.xmin), t_eval=leftTimes)
-        xvals = []
-        yvals = []
-        if len(solution.y)>0:
-            for i in range(len(solution.y[0])):
-                x = solution.t[i]
-                y = solution.y[1][i]
-                if self.xmin < x < self.xmax and self.ymin < y < self.ymax:
-                    xvals.append(x)
-                    yvals.append(y)
-                else:
-                    self.mainGraph.axes.plot(xvals, yvals, color=lineColor)
-                    xvals = []
-                    yvals = []
-
-
-        rightTimes = np.linspace(xinit, self.xmax, 500)
-        solution = solve_ivp(self.yEquation[1], y0=(xinit, yinit), t_span=(xinit, self.xmax), t_eval=rightTimes)
-        if len(solution.y)>0:
-            for i in range(len(solution.y[0])):
-                x = solution.t[i]
-                y = solution.y[1][i]
-                if self.xmin < x < self.xmax and self.ymin < y < self.ymax:
-                    xvals.append(x)
-                    yvals.append(y)
-                else:
-                    self.mainGraph.axes.plot(xvals, yvals, color=lineColor)
-                    xvals = []
-                    yvals = []
-
-        self.mainGraph.axes.plot(xvals, yvals, color=lineColor)
-        self.mainGraph.draw()
-
-    def graphParametricSolution(self, xinit, yinit):
-        times = np.linspace(0, self.tmax, 500)
-        solution = solve_ivp(lambda t, vars: [self.xEquation[1](vars[0], vars[1]), self.yEquation[1](vars[0], vars[1])],
-                             [0, self.tmax],
-                             [xinit, yinit], t_eval=times)
-        xvals = []
-        yvals = []
-        for i in range(len(solution.y[0])):
-            x = solution.y[0][i]
-            y = solution.y[1][i]
-            if self.xmin < x < self.xmax and self.ymin < y < self.ymax:
-                xvals.append(x)
-                yvals.append(y)
-        self.mainGraph.axes.plot(xvals, yvals)
-        self.xParametricGraph.axes.plot(solution.t, solution.y[0], label="x(t)")
-        self.yParametricGraph.axes.plot(solution.t, solution.y[1], label="y(t)")
-        self.mainGraph.draw()
-        self.xParametricGraph.draw()
-        self.yParametricGraph.draw()
+        self.yParametricGraph.requestRefresh()
+
+    def drawField(self, field, analysis, sampleField, quiverStyle):
+        # Only the selected renderer stays on screen, the quiver is already hidden by clearGraphs
+        if self.fieldRenderer != particleRenderer:
+            self.particleImage.stop()
+        if self.fieldRenderer in (arrowRenderer, particleRenderer):
+            self.fieldTextureImage.hide()
+
+        if self.fieldRenderer == particleRenderer:
+            system = (standardSystem(self.yEquation[1]) if self.isStandard
+                      else parametricSystem(self.xEquation[1], self.yEquation[1]))
+            self.particleImage.start(system, (self.xmin, self.xmax, self.ymin, self.ymax))
+        elif self.fieldRenderer != arrowRenderer:
+            self.graphFieldTexture()
+        else:
+            if field is None and analysis is not None:
+                field = analysis.field
+            if field is None:
+                field = sampleField()
+            X, Y, U, V = field
+            self.updateQuiver(X, Y, U, V, quiverScale(self.lineLength), **quiverStyle)
+        self.fitWindow()
+
+    def updateQuiver(self, X, Y, U, V, scale, **style):
+        # The quiver is only rebuilt when its grid size or arrow style changes, pans just move its arrows
+        key = (X.shape, tuple(sorted(style.items())))
+        if self.fieldQuiver is not None and key != self.fieldQuiverKey:
+            self.mainGraph.removeAnimatedArtist(self.fieldQuiver)
+            self.fieldQuiver = None
+        if self.fieldQuiver is None:
+            self.fieldQuiver = self.mainGraph.axes.quiver(X, Y, U, V, color=fieldColor, scale=scale, **style)
+            profiler.count("artistsCreated")
+            self.fieldQuiverKey = key
+            self.mainGraph.addAnimatedArtist(self.fieldQuiver)
+        else:
+            self.fieldQuiver.set_offsets(np.column_stack((X.ravel(), Y.ravel())))
+            self.fieldQuiver.set_UVC(U, V)
+            self.fieldQuiver.scale = scale
+            self.fieldQuiver.set_visible(True)
+
+    def fitWindow(self):
+        # The lattice points sit inside the window, the limits follow the window itself
+        self.mainGraph.axes.ignore_existing_data_limits = True
+        self.mainGraph.axes.update_datalim([(self.xmin, self.ymin), (self.xmax, self.ymax)])
+        self.mainGraph.axes.autoscale_view()
+
+    def graphStandardSolution(self, solution):
+        lineColor = self.lineColors[random.randint(0, 9)]
+
+        segment = standardSegment(solution, self.xmin, self.xmax, self.ymin, self.ymax)
+        self.solutionLines[self.mainGraph].add(segment, lineColor)
+        self.mainGraph.requestRefresh()
+
+    def graphParametricSolution(self, solution):
+        times, values = solution
+        mainLines = self.solutionLines[self.mainGraph]
+        lineColor = self.lineColors[len(mainLines.segments) % len(self.lineColors)]
+
+        mainLines.add(clipToWindow(values[0], values[1], self.xmin, self.xmax, self.ymin, self.ymax), lineColor)
+        self.solutionLines[self.xParametricGraph].add(np.column_stack((times, values[0])), lineColor, True)
+        self.solutionLines[self.yParametricGraph].add(np.column_stack((times, values[1])), lineColor, True)
+        self.mainGraph.requestRefresh()
+        self.xParametricGraph.requestRefresh()
+        self.yParametricGraph.requestRefresh()
 
     def clearFields(self):
         self.clearGraphs()
         for point in self.solutionPoints:
             self.graphSolution(point[0], point[1])
+        if self.portraitSeeding is not None:
+            self.graphPortrait()
+        if self.fateMapEnabled:
+            self.graphFateMap()
 
     def clearGraphs(self):
-        self.mainGraph.axes.cla()
-        self.mainGraph.draw()
-        self.xParametricGraph.axes.cla()
-        self.xParametricGraph.draw()
-        self.yParametricGraph.axes.cla()
-        self.yParametricGraph.draw()
+        self.solverService.cancelAll()
+        self.renderScheduler.invalidate()
+        if not self.graphsLoaded:
+            return
+        for solutionLines in self.solutionLines.values():
+            solutionLines.clear()
+        self.portraitLines.clear()
+        self.fateMapImage.hide()
+        self.analysisOverlay.hide()
+        self.periodicOrbitOverlay.hide()
+        if self.fieldQuiver is not None:
+            self.fieldQuiver.set_visible(False)
+        self.mainGraph.requestRefresh()
+        self.xParametricGraph.requestRefresh()
+        self.yParametricGraph.requestRefresh()
 
 
 class InputErrorDialog(QtWidgets.QDialog):
@@ -481,27 +1203,13 @@ class InputGroupBox(QtWidgets.QWidget):
 
     def enterData(self):
         func = self.inputBox.text()
-        funcActual = func.replace("^", "**")
-        lambdaExpression = lambda x, y: eval(funcActual, {}, {
-            "t": x,
-            "P": y,
-            "x": x,
-            "y": y,
-            "e": np.e,
-            "sin": np.sin,
-            "cos": np.cos,
-            "tan": np.tan,
-            "arcsin": np.arcsin,
-            "arccos": np.arccos,
-            "arctan": np.arctan,
-            "π": np.pi
-        })
 
         try:
-            if type(lambdaExpression(1.0, 1.0)) is float or type(lambdaExpression(1.0, 1.0)) is np.float64:
+            lambdaExpression = compileEquation(func)
+            value = lambdaExpression(1.0, 1.0)
+            if type(value) is float or type(value) is np.float64:
                 self.lambdaEquationSignal.emit(func, lambdaExpression)
             else:
-                print(type(lambdaExpression(1.0, 1.0)))
                 popup = InputErrorDialog()
                 popup.exec()
         except Exception as err:
@@ -666,10 +1374,14 @@ class CentralWidget(QtWidgets.QWidget):
         self.inputGroupBox.lambdaEquationSignal.connect(self.equationListGroupBox.equationListWidget.addEquation)
 
         self.parametersGroupBox.parametersSignal.connect(self.graphsGroupBox.updateParameters)
+        self.graphsGroupBox.windowSignal.connect(self.parametersGroupBox.setWindow)
+        self.parametersGroupBox.parameterSignal.connect(self.graphsGroupBox.setParameter)
+        self.parametersGroupBox.sweepSignal.connect(self.graphsGroupBox.sweepParameter)
+        self.graphsGroupBox.parameterNamesSignal.connect(self.parametersGroupBox.setParameterNames)
 
-        self.equationListGroupBox.equationListWidget.addEquation("-y+xy", lambda x, y: -y+x*y)
+        self.equationListGroupBox.equationListWidget.addEquation("-y+xy", compileEquation("-y+xy"))
         #self.equationListGroupBox.equationListWidget.addEquation("(x-tan(x-y)/cos(y)^2-sin(x)^3", lambda x, y: (x-np.tan(x-y))/np.cos(y)**2-np.sin(x)**3)
-        self.equationListGroupBox.equationListWidget.addEquation("x-xy", lambda x, y: x-x*y)
+        self.equationListGroupBox.equationListWidget.addEquation("x-xy", compileEquation("x-xy"))
 
         self.setLayout(self.layout)
 
@@ -680,10 +1392,12 @@ class CentralWidget(QtWidgets.QWidget):
         self.layout.addWidget(self.parametersGroupBox, 3, 2, 1, 1)
         self.graphsGroupBox.yParametricGraph.show()
         self.graphsGroupBox.xParametricGraph.show()
+        self.graphsGroupBox.fateMapButton.show()
+        self.graphsGroupBox.orbitButton.show()
         self.parametersGroupBox.tRange.show()
         self.equationListGroupBox.parametricShowButtons()
         self.graphsGroupBox.isStandard = False
-        self.graphsGroupBox.graphField()
+        self.graphsGroupBox.requestRender()
         self.parent().setMinimumSize(1300, 1000)
         self.parent().setMaximumSize(1300, 1000)
 
@@ -694,13 +1408,83 @@ class CentralWidget(QtWidgets.QWidget):
         self.layout.addWidget(self.parametersGroupBox, 3, 2, 1, 1)
         self.graphsGroupBox.yParametricGraph.hide()
         self.graphsGroupBox.xParametricGraph.hide()
+        self.graphsGroupBox.fateMapButton.hide()
+        self.graphsGroupBox.orbitButton.hide()
         self.parametersGroupBox.tRange.hide()
         self.equationListGroupBox.standardHideButtons()
         self.graphsGroupBox.isStandard = True
-        self.graphsGroupBox.graphField()
+        self.graphsGroupBox.requestRender()
         self.parent().setMinimumSize(1000, 1000)
         self.parent().setMaximumSize(1000, 1000)
 
+    def workspaceEquations(self):
+        graphs = self.graphsGroupBox
+        return [equation for equationString, equation in (graphs.xEquation, graphs.yEquation)
+                if equationString is not None]
+
+    def saveWorkspace(self, fileName):
+        graphs = self.graphsGroupBox
+        state = {"mode": "standard" if graphs.isStandard else "parametric",
+                 "equations": list(self.equationListGroupBox.equationListWidget.equationWidgets),
+                 "xEquation": graphs.xEquation[0], "yEquation": graphs.yEquation[0],
+                 "window": [graphs.xmin, graphs.xmax, graphs.ymin, graphs.ymax], "tmax": graphs.tmax,
+                 "density": graphs.density, "lineLength": graphs.lineLength,
+                 "parameters": self.parametersGroupBox.sliderStates(),
+                 "seeds": [list(point) for point in graphs.solutionPoints]}
+        saveWorkspace(fileName, state, self.workspaceEquations(), graphs.trajectoryCache, fieldTiles)
+
+    def openWorkspace(self, fileName):
+        state, results = loadWorkspace(fileName)
+        graphs = self.graphsGroupBox
+        equationList = self.equationListGroupBox.equationListWidget
+        for equationString in list(equationList.equationWidgets):
+            equationList.removeEquation(equationString)
+        for equationString in state["equations"]:
+            equationList.addEquation(equationString, compileEquation(equationString))
+        if state["mode"] == "standard":
+            self.switchToStandard()
+        else:
+            self.switchToParametric()
+
+        # Equations bind to the saved slider values straight away, the sliders only appear once they are selected
+        graphs.parameterValues.update({name: slider["value"] for name, slider in state["parameters"].items()})
+        for variable, equationString in ((Variables.X, state["xEquation"]), (Variables.Y, state["yEquation"])):
+            equationWidget = equationList.equationWidgets.get(equationString)
+            if equationWidget is None:
+                continue
+            button = equationWidget.xButton if variable == Variables.X else equationWidget.yButton
+            button.setChecked(True)
+            graphs.setEquation(variable, equationString, equationWidget.equationLambda)
+        self.parametersGroupBox.setSliderStates(state["parameters"])
+        self.parametersGroupBox.setParameters(*state["window"], state["tmax"], state["density"], state["lineLength"])
+
+        # Stored arrays whose equations still match fill the caches, the redraw then only solves what is missing
+        restoreResults(results, self.workspaceEquations(), graphs.trajectoryCache, fieldTiles)
+        graphs.solutionPoints = [tuple(point) for point in state["seeds"]]
+        graphs.requestRender()
+
+
+
+class ProfilingOverlay(QtWidgets.QLabel):
+    def __init__(self):
+        super().__init__()
+        self.setWordWrap(True)
+        self.setTextInteractionFlags(QtCore.Qt.TextInteractionFlag.TextSelectableByMouse)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.updateText)
+
+    def setActive(self, active):
+        if active:
+            self.updateText()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def updateText(self):
+        parts = profiler.summary()
+        self.setText("  |  ".join(parts) if parts else "Profiling, nothing recorded yet")
+        self.setToolTip("\n".join(parts))
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -711,6 +1495,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.centralWidget = CentralWidget()
         self.setCentralWidget(self.centralWidget)
 
+        self.profilingOverlay = ProfilingOverlay()
+        self.statusBar().addWidget(self.profilingOverlay, 1)
+        self.statusBar().hide()
+
         self.createMenuBar()
 
         self.show()
@@ -722,12 +1510,80 @@ class MainWindow(QtWidgets.QMainWindow):
         self.saveAction.setShortcut(QtGui.QKeySequence("Ctrl+s"))
         self.saveAction.triggered.connect(self.centralWidget.graphsGroupBox.saveToFile)
         self.saveMenu.addAction(self.saveAction)
+        self.exportAction = QtGui.QAction("Export Data...")
+        self.exportAction.setShortcut(QtGui.QKeySequence("Ctrl+e"))
+        self.exportAction.triggered.connect(self.centralWidget.graphsGroupBox.exportToFile)
+        self.saveMenu.addAction(self.exportAction)
+        self.exportSweepAction = QtGui.QAction("Export Sweep Frames...")
+        self.exportSweepAction.setToolTip("Render every position of the active slider sweep, or a tmax sweep")
+        self.exportSweepAction.triggered.connect(self.centralWidget.graphsGroupBox.exportSweepFrames)
+        self.saveMenu.addAction(self.exportSweepAction)
+        self.saveMenu.addSeparator()
+        self.openWorkspaceAction = QtGui.QAction("Open Workspace...")
+        self.openWorkspaceAction.setShortcut(QtGui.QKeySequence("Ctrl+o"))
+        self.openWorkspaceAction.triggered.connect(self.openWorkspace)
+        self.saveWorkspaceAction = QtGui.QAction("Save Workspace...")
+        self.saveWorkspaceAction.setShortcut(QtGui.QKeySequence("Ctrl+Shift+s"))
+        self.saveWorkspaceAction.triggered.connect(self.saveWorkspace)
+        self.saveMenu.addAction(self.openWorkspaceAction)
+        self.saveMenu.addAction(self.saveWorkspaceAction)
         self.menuBar.addMenu(self.saveMenu)
+
+        self.profileMenu = QtWidgets.QMenu("&Profile")
+        self.overlayAction = QtGui.QAction("Show Profiling Overlay")
+        self.overlayAction.setCheckable(True)
+        self.overlayAction.setShortcut(QtGui.QKeySequence("F12"))
+        self.overlayAction.toggled.connect(self.setProfiling)
+        self.resetProfileAction = QtGui.QAction("Reset Counters")
+        self.resetProfileAction.triggered.connect(profiler.reset)
+        self.exportTraceAction = QtGui.QAction("Export Trace...")
+        self.exportTraceAction.triggered.connect(self.exportTrace)
+        self.profileMenu.addAction(self.overlayAction)
+        self.profileMenu.addAction(self.resetProfileAction)
+        self.profileMenu.addAction(self.exportTraceAction)
+        self.menuBar.addMenu(self.profileMenu)
         self.setMenuBar(self.menuBar)
+        self.overlayAction.setChecked(profiler.enabled)
+
+    def setProfiling(self, enabled):
+        # Profiling only records while the overlay is shown
+        profiler.enabled = enabled
+        self.profilingOverlay.setActive(enabled)
+        self.statusBar().setVisible(enabled)
+
+    def openWorkspace(self):
+        fileName, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Workspace", filter=workspaceFilter)
+        if not fileName:
+            return
+        try:
+            self.centralWidget.openWorkspace(fileName)
+        except (OSError, ValueError, KeyError) as err:
+            QtWidgets.QMessageBox.warning(self, "Open Workspace", "Could not open the workspace: " + str(err))
+
+    def saveWorkspace(self):
+        fileName, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Workspace", "workspace" + workspaceExtension,
+                                                            filter=workspaceFilter)
+        if not fileName:
+            return
+        if not fileName.endswith(workspaceExtension):
+            fileName += workspaceExtension
+        self.centralWidget.saveWorkspace(fileName)
+
+    def exportTrace(self):
+        fileName, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Trace", "trace.json",
+                                                            filter="Chrome trace (*.json)")
+        if fileName:
+            profiler.exportTrace(fileName)
 
 
+def main():
+    app = QtWidgets.QApplication(sys.argv)
+    w = MainWindow()
+    # Paint the window first, matplotlib and SciPy are only imported once the graphs load
+    app.processEvents()
+    w.centralWidget.graphsGroupBox.loadGraphs()
+    return app.exec()
 
 
-app = QtWidgets.QApplication(sys.argv)
-w = MainWindow()
-app.exec()
+if __name__ == "__main__":
+    sys.exit(main())
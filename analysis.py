@@ -0,0 +1,149 @@
+import functools
+
+import contourpy
+import numpy as np
+
+from equations import partialDerivative
+from fields import fieldLattice, fieldTiles, latticeGrid, parametricArrows, standardArrows
+from profiling import profiler
+
+# The analysis lattice is this many times finer than the quiver lattice, which it contains as every n-th point
+analysisRefinement = 4
+isoclineSlopes = (-1.0, 0.0, 1.0)
+newtonIterations = 30
+
+
+class FieldAnalysis:
+    def __init__(self, field, curves, equilibria):
+        # field is the quiver sample taken from the analysis grid, curves are (label, level, segments) and
+        # equilibria are (x, y, kind, eigenvalues)
+        self.field = field
+        self.curves = curves
+        self.equilibria = equilibria
+
+
+def analysisGrid(xmin, xmax, ymin, ymax, density):
+    levels, indices = fieldLattice(xmin, xmax, ymin, ymax, density, analysisRefinement)
+    _, coarseIndices = fieldLattice(xmin, xmax, ymin, ymax, density)
+    # Positions of the quiver points inside the analysis grid
+    quiverPoints = np.ix_(coarseIndices[1] * analysisRefinement - indices[1][0],
+                          coarseIndices[0] * analysisRefinement - indices[0][0])
+    return levels, indices, quiverPoints
+
+
+def contourSegments(X, Y, Z, level):
+    generator = contourpy.contour_generator(X, Y, np.ma.masked_invalid(Z))
+    return [line for line in generator.lines(level) if len(line) > 1]
+
+
+def signChangeCells(Z):
+    # A cell can hold a zero when its four corners do not all share a sign, NaN corners never qualify
+    corners = np.stack((Z[:-1, :-1], Z[1:, :-1], Z[:-1, 1:], Z[1:, 1:]))
+    with np.errstate(invalid="ignore"):
+        return (corners.min(axis=0) <= 0) & (corners.max(axis=0) >= 0)
+
+
+def partials(xEquation, yEquation, step):
+    # Analytic partials where the equations allow it, central differences otherwise
+    derivatives = [partialDerivative(equation, variable) for equation in (xEquation, yEquation) for variable in "xy"]
+    if all(derivative is not None for derivative in derivatives):
+        def jacobian(x, y):
+            return [np.broadcast_to(derivative(x, y), x.shape) for derivative in derivatives]
+        return jacobian
+
+    def jacobian(x, y):
+        return [(equation(x + step, y) - equation(x - step, y)) / (2 * step) if variable == "x" else
+                (equation(x, y + step) - equation(x, y - step)) / (2 * step)
+                for equation in (xEquation, yEquation) for variable in "xy"]
+    return jacobian
+
+
+def newtonRefine(xEquation, yEquation, jacobian, x, y):
+    # Every candidate takes its Newton steps together, the 2x2 systems are solved in closed form
+    with np.errstate(all="ignore"):
+        for _ in range(newtonIterations):
+            f = np.broadcast_to(xEquation(x, y), x.shape)
+            g = np.broadcast_to(yEquation(x, y), x.shape)
+            a, b, c, d = jacobian(x, y)
+            determinant = a * d - b * c
+            x = x - (d * f - b * g) / determinant
+            y = y - (a * g - c * f) / determinant
+        f = np.broadcast_to(xEquation(x, y), x.shape)
+        g = np.broadcast_to(yEquation(x, y), x.shape)
+    return x, y, np.hypot(f, g)
+
+
+def classifyEquilibrium(a, b, c, d, tolerance=1e-9):
+    trace = a + d
+    determinant = a * d - b * c
+    eigenvalues = np.linalg.eigvals(np.array([[a, b], [c, d]]))
+    scale = max(1.0, abs(trace), abs(determinant) ** 0.5)
+    if abs(determinant) < tolerance * scale ** 2:
+        return "degenerate", eigenvalues
+    if determinant < 0:
+        return "saddle", eigenvalues
+    if abs(trace) < tolerance * scale:
+        return "center", eigenvalues
+    stability = "stable" if trace < 0 else "unstable"
+    return stability + (" node" if trace ** 2 >= 4 * determinant else " spiral"), eigenvalues
+
+
+def findEquilibria(xEquation, yEquation, X, Y, xValues, yValues):
+    xmin, xmax, ymin, ymax = X[0, 0], X[0, -1], Y[0, 0], Y[-1, 0]
+    scale = max(xmax - xmin, ymax - ymin)
+    cells = signChangeCells(xValues) & signChangeCells(yValues)
+    rows, columns = np.nonzero(cells)
+    if len(rows) == 0:
+        return []
+    x = (X[rows, columns] + X[rows, columns + 1]) / 2
+    y = (Y[rows, columns] + Y[rows + 1, columns]) / 2
+    jacobian = partials(xEquation, yEquation, 1e-6 * scale)
+    x, y, residual = newtonRefine(xEquation, yEquation, jacobian, x, y)
+    valueScale = max(1.0, np.nanmax(np.abs(xValues)), np.nanmax(np.abs(yValues)))
+    found = (np.isfinite(x) & np.isfinite(y) & (residual < 1e-8 * valueScale)
+             & (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))
+    if not found.any():
+        return []
+
+    # Neighbouring cells usually converge onto the same point
+    points = np.column_stack((x[found], y[found]))
+    _, unique = np.unique(np.round(points / (1e-6 * scale)).astype(np.int64), axis=0, return_index=True)
+    points = points[np.sort(unique)]
+    with np.errstate(all="ignore"):
+        entries = [np.broadcast_to(np.asarray(entry, dtype=float), len(points))
+                   for entry in jacobian(points[:, 0], points[:, 1])]
+    equilibria = []
+    for index, (xPoint, yPoint) in enumerate(points):
+        a, b, c, d = (float(entry[index]) for entry in entries)
+        if not np.all(np.isfinite((a, b, c, d))):
+            continue
+        kind, eigenvalues = classifyEquilibrium(a, b, c, d)
+        equilibria.append((float(xPoint), float(yPoint), kind, eigenvalues))
+    return equilibria
+
+
+@functools.lru_cache(maxsize=32)
+def analyseStandard(equation, xmin, xmax, ymin, ymax, density):
+    # Cached on the bound equation and window, so redraws that change neither cost a dictionary lookup
+    with profiler.span("analyseField"):
+        levels, indices, quiverPoints = analysisGrid(xmin, xmax, ymin, ymax, density)
+        X, Y = latticeGrid(levels, indices)
+        slopes = fieldTiles.sample(equation, levels, indices)
+        curves = [("nullcline" if slope == 0 else "isocline", slope, contourSegments(X, Y, slopes, slope))
+                  for slope in isoclineSlopes]
+        field = standardArrows(X[quiverPoints], Y[quiverPoints], slopes[quiverPoints], (ymax - ymin) / (xmax - xmin))
+    return FieldAnalysis(field, curves, [])
+
+
+@functools.lru_cache(maxsize=32)
+def analyseParametric(xEquation, yEquation, xmin, xmax, ymin, ymax, density):
+    with profiler.span("analyseField"):
+        levels, indices, quiverPoints = analysisGrid(xmin, xmax, ymin, ymax, density)
+        X, Y = latticeGrid(levels, indices)
+        xValues, yValues = fieldTiles.sampleSystem(xEquation, yEquation, levels, indices)
+        curves = [("x nullcline", 0.0, contourSegments(X, Y, xValues, 0.0)),
+                  ("y nullcline", 0.0, contourSegments(X, Y, yValues, 0.0))]
+        equilibria = findEquilibria(xEquation, yEquation, X, Y, xValues, yValues)
+        field = parametricArrows(X[quiverPoints], Y[quiverPoints], xValues[quiverPoints], yValues[quiverPoints],
+                                 (ymax - ymin) / (xmax - xmin))
+    return FieldAnalysis(field, curves, equilibria)
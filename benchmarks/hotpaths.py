@@ -0,0 +1,224 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PySide6 import QtWidgets
+
+import GUI
+from equations import compileEquation
+from fields import fieldTiles
+from integrators import parametricSystem, standardSystem
+from particles import ParticleFlow
+from profiling import profiler
+from solvers import solveParametric, solveStandard
+
+# name: (dx/dt, dy/dt), the dy/dt equation doubles as dy/dx in standard mode
+equationCases = {
+    "builtin": ("x-xy", "-y+xy"),
+    "stiff": ("y", "-50*(y-cos(x))"),
+    "trig": ("sin(x)*cos(y)+arctan(x*y)", "cos(x+y)-sin(x*y)+tan(x/10)"),
+}
+densities = (1, 3)
+windowSizes = (10, 100)
+seedCounts = (10, 50)
+
+
+class CountingEquation:
+    # Counts the calls that reach the equation. Fused equations forward their source, so parametric systems go
+    # through the fused kernel and solves get analytic Jacobians, which these counts do not see. Unfused ones hide it
+    # and take the per-equation path with finite-difference Jacobians
+    def __init__(self, equation, fused=True):
+        self.equation = equation
+        self.calls = 0
+        self.points = 0
+        if fused:
+            self.equationString = equation.equationString
+            self.parameters = equation.parameters
+
+    def __call__(self, x, y):
+        self.calls += 1
+        self.points += max(np.size(x), np.size(y))
+        return self.equation(x, y)
+
+    def reset(self):
+        self.calls = 0
+        self.points = 0
+
+
+def percentiles(values):
+    values = np.array(values) * 1000
+    return {"p50": float(np.percentile(values, 50)), "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)), "max": float(values.max())}
+
+
+def waitForSolutions(app, graphs):
+    graphs.solverService.threadPool.waitForDone()
+    while graphs.solverService.jobs:
+        app.processEvents()
+    app.processEvents()
+
+
+def rhsEvaluations(isStandard, solving):
+    # Equation evaluations by the profiler's counts, which the tile sampler and the solvers keep whichever path they
+    # take. Solver counts are system calls, a parametric call evaluates both equations
+    evaluations = profiler.snapshot()[0].get("rhsEvaluations", 0)
+    return evaluations * (2 if solving and not isStandard else 1)
+
+
+def benchmarkCase(app, graphs, caseName, mode, density, windowSize, seedCount, repeats):
+    rng = np.random.default_rng(0)
+    seeds = [tuple(seed) for seed in rng.uniform(-windowSize, windowSize, (seedCount, 2))]
+    bounds = (-windowSize, windowSize, -windowSize, windowSize)
+    isStandard = mode == "standard"
+    result = {"equation": caseName, "mode": mode, "density": density, "window": windowSize, "seeds": seedCount}
+
+    # The unfused pass runs first, so the fused equations are the ones left in graphs for the rest of the case
+    for fused, suffix in ((False, "Unfused"), (True, "")):
+        xEquation = CountingEquation(compileEquation(equationCases[caseName][0]), fused)
+        yEquation = CountingEquation(compileEquation(equationCases[caseName][1]), fused)
+        graphs.isStandard = isStandard
+        graphs.xEquation = (equationCases[caseName][0], xEquation)
+        graphs.yEquation = (equationCases[caseName][1], yEquation)
+        graphs.xmin, graphs.xmax, graphs.ymin, graphs.ymax = bounds
+        graphs.density = density
+        graphs.solutionPoints = []
+
+        fieldFunction = graphs.graphStandardField if isStandard else graphs.graphParametricField
+        fieldTimes = []
+        cachedFieldTimes = []
+        for repeat in range(repeats):
+            profiler.reset()
+            fieldTiles.clear()
+            start = time.perf_counter()
+            fieldFunction()
+            fieldTimes.append(time.perf_counter() - start)
+            fieldEvaluations = rhsEvaluations(isStandard, False)
+            start = time.perf_counter()
+            fieldFunction()
+            cachedFieldTimes.append(time.perf_counter() - start)
+        result["field" + suffix] = dict(percentiles(fieldTimes),
+                                        rhsEvalsPerSecond=fieldEvaluations / float(np.median(fieldTimes)))
+        result["fieldCached" + suffix] = percentiles(cachedFieldTimes)
+
+        xEquation.reset()
+        yEquation.reset()
+        profiler.reset()
+        start = time.perf_counter()
+        for xinit, yinit in seeds:
+            if isStandard:
+                solveStandard(yEquation, xinit, yinit, *bounds)
+            else:
+                solveParametric(xEquation, yEquation, xinit, yinit, graphs.tmax, *bounds)
+        solveTime = time.perf_counter() - start
+        result["solve" + suffix] = {"seconds": solveTime, "trajectoriesPerSecond": seedCount / solveTime,
+                                    "rhsCalls": xEquation.calls + yEquation.calls,
+                                    "rhsEvalsPerSecond": rhsEvaluations(isStandard, True) / solveTime}
+
+    # clearFields re-solves every stored seed, once with an empty cache and once with a warm one
+    graphs.solutionPoints = list(seeds)
+    for label in ("clearFieldsCold", "clearFieldsCached"):
+        if label == "clearFieldsCold":
+            graphs.trajectoryCache.clear()
+        start = time.perf_counter()
+        graphs.graphField()
+        waitForSolutions(app, graphs)
+        graphs.mainGraph.refresh()
+        result[label] = {"seconds": time.perf_counter() - start}
+
+    blitTimes = []
+    fullTimes = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        graphs.mainGraph.refresh()
+        blitTimes.append(time.perf_counter() - start)
+        graphs.mainGraph.background = None
+        start = time.perf_counter()
+        graphs.mainGraph.refresh()
+        fullTimes.append(time.perf_counter() - start)
+    result["redrawBlit"] = percentiles(blitTimes)
+    result["redrawFull"] = percentiles(fullTimes)
+
+    # One animation frame of the particle renderer, outside of the timer and the blit
+    flow = ParticleFlow(600, 600)
+    flow.setSystem(standardSystem(yEquation) if isStandard else parametricSystem(xEquation, yEquation), bounds)
+    particleTimes = []
+    for repeat in range(max(repeats, 10)):
+        start = time.perf_counter()
+        flow.step()
+        particleTimes.append(time.perf_counter() - start)
+    result["particleStep"] = percentiles(particleTimes)
+
+    graphs.trajectoryCache.clear()
+    tracemalloc.start()
+    graphs.graphField()
+    waitForSolutions(app, graphs)
+    graphs.mainGraph.refresh()
+    result["peakMemoryBytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+
+def environmentInfo():
+    import matplotlib
+    import scipy
+    import PySide6
+    return {"python": platform.python_version(), "platform": platform.platform(), "numpy": np.__version__,
+            "scipy": scipy.__version__, "matplotlib": matplotlib.__version__, "pyside6": PySide6.__version__}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark field sampling, trajectory solving and redraw headlessly.")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("-r", "--repeats", type=int, default=10)
+    parser.add_argument("--quick", action="store_true", help="only the smallest density, window and seed count")
+    parser.add_argument("--equations", nargs="*", choices=sorted(equationCases), default=sorted(equationCases))
+    arguments = parser.parse_args(argv)
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    graphs = GUI.GraphsGroupBox()
+    graphs.loadGraphs()
+    graphs.resize(1000, 700)
+    # Pay the lazy SciPy import outside of the measurements
+    solveStandard(compileEquation("x"), 0.0, 0.0, -1, 1, -1, 1)
+    # Evaluation counts come from the profiler, its overhead is a lock per tile batch or solve, not per evaluation
+    profiler.enabled = True
+
+    matrix = itertools.product(arguments.equations, ("standard", "parametric"),
+                               densities[:1] if arguments.quick else densities,
+                               windowSizes[:1] if arguments.quick else windowSizes,
+                               seedCounts[:1] if arguments.quick else seedCounts)
+    results = []
+    for caseName, mode, density, windowSize, seedCount in matrix:
+        result = benchmarkCase(app, graphs, caseName, mode, density, windowSize, seedCount, arguments.repeats)
+        results.append(result)
+        print("{equation:<8} {mode:<10} density {density:<3} window {window:<4} seeds {seeds:<3} | "
+              "field {field[p50]:7.2f} ms (unfused {fieldUnfused[p50]:7.2f}) | "
+              "solve {solve[trajectoriesPerSecond]:8.1f} traj/s {solve[rhsEvalsPerSecond]:10.0f} rhs/s "
+              "(unfused {solveUnfused[trajectoriesPerSecond]:8.1f} traj/s "
+              "{solveUnfused[rhsEvalsPerSecond]:10.0f} rhs/s) | clearFields {clearFieldsCold[seconds]:6.3f} s cold "
+              "{clearFieldsCached[seconds]:6.3f} s cached | blit p50 {redrawBlit[p50]:6.2f} ms "
+              "full p50 {redrawFull[p50]:6.2f} ms | particles p50 {particleStep[p50]:5.2f} ms | peak {peak:6.1f} MB".format(
+                  peak=result["peakMemoryBytes"] / 1e6, **result), flush=True)
+
+    # Tear the widgets down while Qt is still alive, leaving them to interpreter shutdown aborts on PySide6
+    graphs.solverService.threadPool.waitForDone()
+    graphs.deleteLater()
+    app.processEvents()
+
+    if arguments.output:
+        with open(arguments.output, "w") as outputFile:
+            json.dump({"environment": environmentInfo(), "results": results}, outputFile, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+repositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so every sample is a cold start
+childScript = r'''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+timings = {}
+
+import GUI
+timings["importGui"] = time.perf_counter() - start
+from PySide6 import QtCore, QtWidgets
+
+app = QtWidgets.QApplication([])
+timings["qApplication"] = time.perf_counter() - start
+window = GUI.MainWindow()
+timings["mainWindow"] = time.perf_counter() - start
+
+
+class PaintWatcher(QtCore.QObject):
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Type.Paint and "firstPaint" not in timings:
+            timings["firstPaint"] = time.perf_counter() - start
+            timings["heavyModulesAtFirstPaint"] = sorted(name for name in ("matplotlib", "scipy") if name in sys.modules)
+        return False
+
+
+watcher = PaintWatcher()
+window.installEventFilter(watcher)
+for widget in window.findChildren(QtWidgets.QWidget):
+    widget.installEventFilter(watcher)
+app.processEvents()
+window.centralWidget.graphsGroupBox.loadGraphs()
+timings["graphsLoaded"] = time.perf_counter() - start
+app.processEvents()
+timings["firstRender"] = time.perf_counter() - start
+print(json.dumps(timings))
+'''
+
+stages = ("importGui", "qApplication", "mainWindow", "firstPaint", "graphsLoaded", "firstRender")
+
+
+def measureStartup(environment):
+    output = subprocess.run([sys.executable, "-c", childScript, repositoryDirectory], env=environment,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start import and first-paint timings of the GUI.")
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--offscreen", action="store_true", help="use the offscreen Qt platform")
+    parser.add_argument("-o", "--output", help="also write the results as JSON to this file")
+    arguments = parser.parse_args(argv)
+
+    environment = dict(os.environ)
+    if arguments.offscreen:
+        environment["QT_QPA_PLATFORM"] = "offscreen"
+    samples = [measureStartup(environment) for run in range(arguments.runs)]
+
+    results = {"runs": arguments.runs, "stages": {}, "heavyModulesAtFirstPaint": samples[-1].get("heavyModulesAtFirstPaint")}
+    for stage in stages:
+        values = [sample[stage] for sample in samples if stage in sample]
+        if values:
+            results["stages"][stage] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+            print("{:<14} median {:8.1f} ms   min {:8.1f} ms   max {:8.1f} ms".format(
+                stage, statistics.median(values) * 1000, min(values) * 1000, max(values) * 1000))
+    print("loaded before first paint:", ", ".join(results["heavyModulesAtFirstPaint"] or []) or "nothing heavy")
+
+    if arguments.output:
+        with open(arguments.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
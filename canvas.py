@@ -0,0 +1,349 @@
+from PySide6 import QtCore
+import numpy as np
+import matplotlib
+import matplotlib.colors as mcolors
+from matplotlib.backend_bases import MouseButton
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.image import AxesImage
+from matplotlib.lines import Line2D
+
+from particles import ParticleFlow
+from profiling import profiler
+
+matplotlib.use('Qt5Agg')
+
+lineColors = list(mcolors.TABLEAU_COLORS.keys())
+curveColors = {"nullcline": "tab:red", "x nullcline": "tab:red", "y nullcline": "tab:green", "isocline": "tab:gray"}
+equilibriumStyles = {"stable node": ("o", "k"), "stable spiral": ("o", "k"), "unstable node": ("o", "w"),
+                     "unstable spiral": ("o", "w"), "saddle": ("X", "k"), "center": ("s", "w"),
+                     "degenerate": ("D", "tab:gray")}
+orbitColors = {"stable limit cycle": "k", "unstable limit cycle": "tab:red", "closed orbit": "tab:purple",
+               None: "tab:gray"}
+
+
+class MplCanvas(FigureCanvasQTAgg):
+    fig = None
+    graphClickedSignal = QtCore.Signal(float, float)
+    graphPanSignal = QtCore.Signal(float, float)
+    graphZoomSignal = QtCore.Signal(float, float, float)
+
+    def __init__(self, parent=None, width=5, height=4, dpi=100):
+        self.fig = Figure(figsize=(width, height), dpi=dpi)
+        self.axes = self.fig.add_subplot(111)
+        super(MplCanvas, self).__init__(self.fig)
+        self.cid = self.fig.canvas.mpl_connect('button_press_event', self.onGraphPress)
+        self.mpl_connect('motion_notify_event', self.onGraphDrag)
+        self.mpl_connect('button_release_event', self.onGraphRelease)
+        self.mpl_connect('scroll_event', self.onGraphScroll)
+        self.panOrigin = None
+
+        self.animatedArtists = []
+        self.background = None
+        self.staticKey = None
+        self.refreshPending = False
+        self.printing = False
+        self.mpl_connect('draw_event', self.captureBackground)
+
+    def onGraphPress(self, event):
+        # Left clicks place solutions, the other buttons drag the view
+        if event.button in (MouseButton.MIDDLE, MouseButton.RIGHT):
+            self.panOrigin = (event.x, event.y)
+            return
+        self.graphClickedSignal.emit(event.xdata, event.ydata)
+
+    def onGraphDrag(self, event):
+        if self.panOrigin is None:
+            return
+        toData = self.axes.transData.inverted()
+        startX, startY = toData.transform(self.panOrigin)
+        endX, endY = toData.transform((event.x, event.y))
+        self.panOrigin = (event.x, event.y)
+        self.graphPanSignal.emit(startX - endX, startY - endY)
+
+    def onGraphRelease(self, event):
+        self.panOrigin = None
+
+    def onGraphScroll(self, event):
+        if event.xdata is None or event.ydata is None:
+            return
+        self.graphZoomSignal.emit(event.xdata, event.ydata, 0.8 ** event.step)
+
+    def addAnimatedArtist(self, artist):
+        artist.set_animated(True)
+        self.animatedArtists.append(artist)
+
+    def removeAnimatedArtist(self, artist):
+        self.animatedArtists.remove(artist)
+        artist.remove()
+
+    def captureBackground(self, event):
+        if self.printing:
+            return
+        self.background = self.copy_from_bbox(self.fig.bbox)
+        self.drawAnimatedArtists()
+
+    def drawAnimatedArtists(self):
+        for artist in sorted(self.animatedArtists, key=lambda artist: artist.get_zorder()):
+            self.axes.draw_artist(artist)
+
+    def currentStaticKey(self):
+        return (self.axes.get_xlim(), self.axes.get_ylim(), self.axes.get_title(), self.axes.get_xlabel(),
+                self.axes.get_ylabel(), self.get_width_height())
+
+    def requestRefresh(self):
+        if not self.refreshPending:
+            self.refreshPending = True
+            QtCore.QTimer.singleShot(0, self.refresh)
+
+    def refresh(self):
+        # Only limits, labels and size changes need a full redraw, everything else is blitted over the background
+        self.refreshPending = False
+        staticKey = self.currentStaticKey()
+        if self.background is None or staticKey != self.staticKey:
+            self.staticKey = staticKey
+            with profiler.span("draw " + self.objectName()):
+                self.draw()
+        else:
+            with profiler.span("blit " + self.objectName()):
+                self.restore_region(self.background)
+                self.drawAnimatedArtists()
+                self.blit(self.fig.bbox)
+
+    def printFigure(self, fileName):
+        self.printing = True
+        for artist in self.animatedArtists:
+            artist.set_animated(False)
+        try:
+            self.print_jpg(fileName)
+        finally:
+            for artist in self.animatedArtists:
+                artist.set_animated(True)
+            self.printing = False
+            self.background = None
+            self.requestRefresh()
+
+
+class SolutionLines:
+    def __init__(self, canvas, linewidth=None):
+        self.axes = canvas.axes
+        self.segments = []
+        self.colors = []
+        if linewidth is None:
+            linewidth = matplotlib.rcParams["lines.linewidth"]
+        self.collection = LineCollection([], linewidths=linewidth)
+        profiler.count("artistsCreated")
+        self.axes.add_collection(self.collection, autolim=False)
+        canvas.addAnimatedArtist(self.collection)
+
+    def clear(self):
+        self.segments = []
+        self.colors = []
+        self.collection.set_segments([])
+        self.axes.ignore_existing_data_limits = True
+
+    def add(self, segment, color, autoscale=False):
+        self.extend([segment], [color], autoscale)
+
+    def extend(self, segments, colors, autoscale=False):
+        self.segments += segments
+        self.colors += colors
+        self.collection.set_segments(self.segments)
+        self.collection.set_color(self.colors)
+        if autoscale:
+            for segment in segments:
+                finite = segment[np.isfinite(segment).all(axis=1)]
+                if len(finite) > 0:
+                    self.axes.update_datalim(finite)
+            self.axes.autoscale_view()
+
+
+class FateMapImage:
+    undecidedColor = (1.0, 1.0, 1.0, 0.0)
+    escapedColor = (0.85, 0.85, 0.85, 1.0)
+
+    def __init__(self, canvas):
+        # One image under the quiver, the palette is indexed by label + 2 so ESCAPED and UNDECIDED come first
+        self.axes = canvas.axes
+        self.image = AxesImage(self.axes, origin="lower", interpolation="nearest", zorder=0)
+        self.image.set_data(np.zeros((1, 1, 4)))
+        self.image.set_visible(False)
+        self.axes.add_image(self.image)
+        canvas.addAnimatedArtist(self.image)
+        self.markers = Line2D([], [], color="k", marker="x", linestyle="none", zorder=1)
+        self.axes.add_line(self.markers)
+        canvas.addAnimatedArtist(self.markers)
+        self.cycles = Line2D([], [], color="k", linewidth=1, zorder=1)
+        self.axes.add_line(self.cycles)
+        canvas.addAnimatedArtist(self.cycles)
+        profiler.count("artistsCreated", 3)
+
+    def show(self, fateMap):
+        attractorColors = [mcolors.to_rgba(lineColors[index % len(lineColors)], 0.45)
+                           for index in range(len(fateMap.attractors) + len(fateMap.cycles))]
+        palette = np.array([self.undecidedColor, self.escapedColor] + attractorColors)
+        self.image.set_data(palette[fateMap.labels + 2])
+        self.image.set_extent(fateMap.extent)
+        self.image.set_visible(True)
+        if len(fateMap.attractors) > 0:
+            self.markers.set_data(fateMap.attractors[:, 0], fateMap.attractors[:, 1])
+        else:
+            self.markers.set_data([], [])
+        self.markers.set_visible(True)
+        # One line for all cycles, NaN columns keep them apart
+        if fateMap.cycles:
+            self.cycles.set_data(*np.hstack([np.column_stack((cycle, [np.nan, np.nan])) for cycle in fateMap.cycles]))
+        else:
+            self.cycles.set_data([], [])
+        self.cycles.set_visible(True)
+
+    def hide(self):
+        self.image.set_visible(False)
+        self.markers.set_visible(False)
+        self.cycles.set_visible(False)
+
+
+class AnalysisOverlay:
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.curves = SolutionLines(canvas, 1.2)
+        self.curves.collection.set_linestyle("--")
+        self.markers = {}
+        for kind, (marker, faceColor) in equilibriumStyles.items():
+            markers = Line2D([], [], marker=marker, markerfacecolor=faceColor, markeredgecolor="k", markersize=8,
+                             linestyle="none", zorder=3)
+            self.markers[kind] = markers
+            canvas.axes.add_line(markers)
+            canvas.addAnimatedArtist(markers)
+        profiler.count("artistsCreated", len(self.markers))
+
+    def show(self, analysis):
+        self.curves.clear()
+        for label, level, segments in analysis.curves:
+            self.curves.extend(segments, [curveColors[label]] * len(segments))
+        for kind, markers in self.markers.items():
+            points = [(x, y) for x, y, pointKind, eigenvalues in analysis.equilibria if pointKind == kind]
+            markers.set_data([x for x, y in points], [y for x, y in points])
+            markers.set_visible(True)
+
+    def hide(self):
+        self.curves.clear()
+        for markers in self.markers.values():
+            markers.set_visible(False)
+
+
+class PeriodicOrbitOverlay:
+    def __init__(self, canvas):
+        # Cycles coloured by their stability, each with its Poincaré section and the crossings on it, and one text
+        # listing the periods and multipliers
+        self.axes = canvas.axes
+        self.cycles = SolutionLines(canvas, 2.5)
+        self.sections = SolutionLines(canvas, 0.8)
+        self.sections.collection.set_linestyle(":")
+        self.crossings = Line2D([], [], color="k", marker=".", markersize=4, linestyle="none", zorder=3)
+        self.axes.add_line(self.crossings)
+        canvas.addAnimatedArtist(self.crossings)
+        self.label = self.axes.text(0.02, 0.98, "", transform=self.axes.transAxes, fontsize=8, va="top",
+                                    bbox={"facecolor": "w", "alpha": 0.8, "edgecolor": "none"}, zorder=4)
+        canvas.addAnimatedArtist(self.label)
+        profiler.count("artistsCreated", 4)
+
+    def show(self, orbits):
+        self.cycles.clear()
+        self.sections.clear()
+        crossings = []
+        for orbit in orbits:
+            color = orbitColors[orbit.kind]
+            if orbit.found:
+                self.cycles.add(orbit.states.T, color)
+            if orbit.section is not None:
+                # The section is drawn as far as the crossings on it reach, plus a little either side
+                point, normal = orbit.section
+                tangent = np.array([-normal[1], normal[0]])
+                positions = (orbit.crossings.T - point) @ tangent
+                margin = 0.03 * np.ptp(self.axes.get_xlim())
+                self.sections.add(point + np.outer([positions.min() - margin, positions.max() + margin], tangent),
+                                  color)
+            crossings.append(orbit.crossings)
+        if crossings:
+            crossings = np.hstack(crossings)
+            self.crossings.set_data(crossings[0], crossings[1])
+        else:
+            self.crossings.set_data([], [])
+        self.crossings.set_visible(True)
+        self.label.set_text("\n".join(orbit.description() for orbit in orbits))
+        self.label.set_visible(bool(orbits))
+
+    def hide(self):
+        self.cycles.clear()
+        self.sections.clear()
+        self.crossings.set_visible(False)
+        self.label.set_visible(False)
+
+
+class FieldTextureImage:
+    def __init__(self, canvas):
+        # Below the fate map, which stays partly transparent over it
+        self.image = AxesImage(canvas.axes, origin="lower", interpolation="antialiased", zorder=-1)
+        self.image.set_data(np.zeros((1, 1, 4)))
+        self.image.set_visible(False)
+        canvas.axes.add_image(self.image)
+        canvas.addAnimatedArtist(self.image)
+        profiler.count("artistsCreated")
+
+    def show(self, texture):
+        colormap = matplotlib.colormaps["coolwarm" if texture.diverging else "viridis"]
+        rgba = colormap(texture.scalar)
+        if texture.shadingMode == "multiply":
+            rgba[..., :3] *= (0.3 + 0.7 * texture.shading)[..., None]
+        elif texture.shadingMode == "glyph":
+            rgba[..., :3] = 1 - texture.shading[..., None] * (1 - rgba[..., :3])
+        self.image.set_data(rgba)
+        self.image.set_extent(texture.extent)
+        self.image.set_visible(True)
+
+    def hide(self):
+        self.image.set_visible(False)
+
+
+class ParticleFlowImage:
+    frameInterval = 16
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.flow = None
+        colormap = mcolors.LinearSegmentedColormap.from_list("particles", [(0.05, 0.2, 0.45, 0.0),
+                                                                           (0.05, 0.2, 0.45, 1.0)])
+        self.image = AxesImage(canvas.axes, origin="lower", interpolation="nearest", cmap=colormap, zorder=0.5)
+        self.image.set_clim(0, 1)
+        self.image.set_data(np.zeros((1, 1)))
+        self.image.set_visible(False)
+        canvas.axes.add_image(self.image)
+        canvas.addAnimatedArtist(self.image)
+        profiler.count("artistsCreated")
+        self.timer = QtCore.QTimer(canvas)
+        self.timer.setInterval(self.frameInterval)
+        self.timer.timeout.connect(self.advance)
+
+    def start(self, system, window):
+        # One trail pixel per screen pixel of the axes, so the image is drawn without resampling
+        width = max(int(self.canvas.axes.bbox.width), 1)
+        height = max(int(self.canvas.axes.bbox.height), 1)
+        if self.flow is None or (self.flow.width, self.flow.height) != (width, height):
+            self.flow = ParticleFlow(width, height)
+        self.flow.setSystem(system, window)
+        self.image.set_extent(window)
+        self.image.set_data(self.flow.trails)
+        self.image.set_visible(True)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.image.set_visible(False)
+
+    def advance(self):
+        with profiler.span("particleFrame"):
+            self.image.set_data(self.flow.step())
+        self.canvas.requestRefresh()
@@ -0,0 +1,533 @@
+import ast
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+
+import numpy as np
+
+
+class EquationError(ValueError):
+    pass
+
+
+constants = {
+    "e": np.e,
+    "π": np.pi,
+}
+
+functions = {
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "arcsin": np.arcsin,
+    "arccos": np.arccos,
+    "arctan": np.arctan,
+}
+
+# t and P are aliases kept from the original eval namespace
+variableAliases = {
+    "x": "x",
+    "y": "y",
+    "t": "x",
+    "P": "y",
+}
+
+# Any other single letter is a free parameter that sliders can set, longer names are rejected so that typos like
+# "sinx" or "foo" do not quietly become parameters
+defaultParameterValue = 1.0
+reservedNames = {"constantEquation", "log", "floor"}
+
+allowedNodes = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Constant, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv, ast.UAdd, ast.USub,
+)
+
+
+def constantEquation(value, x, y):
+    if np.ndim(x) == 0 and np.ndim(y) == 0:
+        return float(value)
+    return np.full(np.broadcast(x, y).shape, value, dtype=float)
+
+
+class EquationValidator(ast.NodeTransformer):
+    def __init__(self):
+        self.usedVariables = set()
+        self.usedParameters = set()
+
+    def generic_visit(self, node):
+        if not isinstance(node, allowedNodes):
+            raise EquationError("Unsupported syntax: " + type(node).__name__)
+        return super().generic_visit(node)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise EquationError("Unsupported constant: " + repr(node.value))
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in functions:
+            raise EquationError("Unknown function")
+        if node.keywords or len(node.args) != 1:
+            raise EquationError("Functions take exactly one argument")
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Name(self, node):
+        if node.id in variableAliases:
+            name = variableAliases[node.id]
+            self.usedVariables.add(name)
+            return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+        if node.id in constants:
+            return node
+        # "xy" style implicit products of x and y only, "tx" or "ax" are more likely a missing operator
+        if set(node.id) <= {"x", "y"}:
+            product = None
+            for char in node.id:
+                factor = ast.Name(id=char, ctx=ast.Load())
+                self.usedVariables.add(char)
+                product = factor if product is None else ast.BinOp(left=product, op=ast.Mult(), right=factor)
+            return ast.copy_location(product, node)
+        if node.id in functions or node.id in reservedNames:
+            raise EquationError("Unknown name: " + node.id)
+        if len(node.id) > 1:
+            prefixes = [name for name in tuple(functions) + tuple(constants) + tuple(variableAliases)
+                        if node.id.startswith(name)]
+            raise EquationError("Unknown name: " + node.id + ", missing an operator or parentheses after "
+                                + max(prefixes or [node.id[0]], key=len) + "?")
+        if not node.id.isalpha():
+            raise EquationError("Unknown name: " + node.id)
+        self.usedParameters.add(node.id)
+        return node
+
+
+def parseEquation(equationString):
+    source = equationString.replace("^", "**").strip()
+    if not source:
+        raise EquationError("Empty equation")
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as err:
+        raise EquationError(str(err)) from err
+    validator = EquationValidator()
+    tree = ast.fix_missing_locations(validator.visit(tree))
+    return tree, validator.usedVariables, validator.usedParameters
+
+
+@lru_cache(maxsize=256)
+def equationParameters(equationString):
+    return tuple(sorted(parseEquation(equationString)[2]))
+
+
+def usesVariables(node):
+    return any(isinstance(child, ast.Name) and child.id in ("x", "y") for child in ast.walk(node))
+
+
+def compileBody(body, namespaceExtras=None):
+    namespace = {"__builtins__": {}, "constantEquation": constantEquation}
+    namespace.update(constants)
+    namespace.update(functions)
+    namespace.update(namespaceExtras or {})
+
+    if not usesVariables(body):
+        value = eval(compile(ast.fix_missing_locations(ast.Expression(body=body)), "<equation>", "eval"), namespace)
+        body = ast.Call(func=ast.Name(id="constantEquation", ctx=ast.Load()),
+                        args=[ast.Constant(value=float(value)), ast.Name(id="x", ctx=ast.Load()),
+                              ast.Name(id="y", ctx=ast.Load())],
+                        keywords=[])
+
+    arguments = ast.arguments(posonlyargs=[], args=[ast.arg(arg="x"), ast.arg(arg="y")], kwonlyargs=[],
+                              kw_defaults=[], defaults=[])
+    lambdaTree = ast.fix_missing_locations(ast.Expression(body=ast.Lambda(args=arguments, body=body)))
+    return eval(compile(lambdaTree, "<equation>", "eval"), namespace)
+
+
+def parameterValues(names, parameters):
+    values = dict(parameters)
+    return tuple((name, float(values.get(name, defaultParameterValue))) for name in names)
+
+
+@lru_cache(maxsize=256)
+def compileEquation(equationString, parameters=()):
+    tree, usedVariables, usedParameters = parseEquation(equationString)
+    boundParameters = parameterValues(sorted(usedParameters), parameters)
+    equationLambda = compileBody(tree.body, dict(boundParameters))
+    equationLambda.equationString = equationString
+    equationLambda.parameters = boundParameters
+    return equationLambda
+
+
+def bindEquation(equationString, parameters):
+    # Only the parameters the equation uses take part in the cache key, so unrelated sliders keep the same function
+    names = equationParameters(equationString)
+    if not names:
+        return compileEquation(equationString)
+    return compileEquation(equationString, parameterValues(names, parameters))
+
+
+# Functions only derivatives can produce, users cannot type them
+derivativeFunctions = {
+    "log": np.log,
+    "floor": np.floor,
+}
+
+
+def number(value):
+    return ast.Constant(value=float(value))
+
+
+def isNumber(node, value=None):
+    return isinstance(node, ast.Constant) and (value is None or node.value == value)
+
+
+def call(name, argument):
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[argument], keywords=[])
+
+
+def negate(node):
+    if isNumber(node):
+        return number(-node.value)
+    return ast.UnaryOp(op=ast.USub(), operand=node)
+
+
+def add(left, right):
+    if isNumber(left, 0):
+        return right
+    if isNumber(right, 0):
+        return left
+    return ast.BinOp(left=left, op=ast.Add(), right=right)
+
+
+def subtract(left, right):
+    if isNumber(right, 0):
+        return left
+    if isNumber(left, 0):
+        return negate(right)
+    return ast.BinOp(left=left, op=ast.Sub(), right=right)
+
+
+def multiply(left, right):
+    if isNumber(left, 0) or isNumber(right, 0):
+        return number(0)
+    if isNumber(left, 1):
+        return right
+    if isNumber(right, 1):
+        return left
+    return ast.BinOp(left=left, op=ast.Mult(), right=right)
+
+
+def divide(left, right):
+    if isNumber(left, 0):
+        return number(0)
+    if isNumber(right, 1):
+        return left
+    return ast.BinOp(left=left, op=ast.Div(), right=right)
+
+
+def power(base, exponent):
+    if isNumber(exponent, 1):
+        return base
+    return ast.BinOp(left=base, op=ast.Pow(), right=exponent)
+
+
+def functionDerivative(name, argument):
+    if name == "sin":
+        return call("cos", argument)
+    if name == "cos":
+        return negate(call("sin", argument))
+    if name == "tan":
+        return divide(number(1), power(call("cos", argument), number(2)))
+    if name == "arcsin":
+        return divide(number(1), power(subtract(number(1), power(argument, number(2))), number(0.5)))
+    if name == "arccos":
+        return divide(number(-1), power(subtract(number(1), power(argument, number(2))), number(0.5)))
+    if name == "arctan":
+        return divide(number(1), add(number(1), power(argument, number(2))))
+    raise EquationError("No derivative for " + name)
+
+
+def differentiate(node, variable):
+    # Works on trees from parseEquation, so names are already x, y or constants
+    if isinstance(node, ast.Constant):
+        return number(0)
+    if isinstance(node, ast.Name):
+        return number(1 if node.id == variable else 0)
+    if isinstance(node, ast.UnaryOp):
+        derivative = differentiate(node.operand, variable)
+        return negate(derivative) if isinstance(node.op, ast.USub) else derivative
+    if isinstance(node, ast.Call):
+        argument = node.args[0]
+        return multiply(functionDerivative(node.func.id, argument), differentiate(argument, variable))
+    if isinstance(node, ast.BinOp):
+        left, right = node.left, node.right
+        leftDerivative = differentiate(left, variable)
+        rightDerivative = differentiate(right, variable)
+        if isinstance(node.op, ast.Add):
+            return add(leftDerivative, rightDerivative)
+        if isinstance(node.op, ast.Sub):
+            return subtract(leftDerivative, rightDerivative)
+        if isinstance(node.op, ast.Mult):
+            return add(multiply(leftDerivative, right), multiply(left, rightDerivative))
+        if isinstance(node.op, ast.Div):
+            return divide(subtract(multiply(leftDerivative, right), multiply(left, rightDerivative)),
+                          power(right, number(2)))
+        if isinstance(node.op, ast.Pow):
+            if isNumber(rightDerivative, 0):
+                return multiply(multiply(right, power(left, subtract(right, number(1)))), leftDerivative)
+            return multiply(node, add(multiply(rightDerivative, call("log", left)),
+                                      divide(multiply(right, leftDerivative), left)))
+        if isinstance(node.op, ast.Mod):
+            return subtract(leftDerivative, multiply(rightDerivative, call("floor", divide(left, right))))
+        if isinstance(node.op, ast.FloorDiv):
+            return number(0)
+    raise EquationError("No derivative for " + type(node).__name__)
+
+
+@lru_cache(maxsize=256)
+def compileDerivative(equationString, variable, parameters=()):
+    tree, usedVariables, usedParameters = parseEquation(equationString)
+    return compileBody(differentiate(tree.body, variable),
+                       dict(derivativeFunctions, **dict(parameterValues(sorted(usedParameters), parameters))))
+
+
+def partialDerivative(equation, variable):
+    # None when the equation was not compiled from a string, callers then fall back to finite differences
+    equationString = getattr(equation, "equationString", None)
+    if equationString is None:
+        return None
+    try:
+        return compileDerivative(equationString, variable, getattr(equation, "parameters", ()))
+    except EquationError:
+        return None
+
+
+# Fused parametric systems: both components in one function, shared subexpressions computed once
+binaryUfuncs = {
+    ast.Add: ("add", "+"),
+    ast.Sub: ("subtract", "-"),
+    ast.Mult: ("multiply", "*"),
+    ast.Div: ("true_divide", "/"),
+    ast.Pow: ("power", "**"),
+    ast.Mod: ("remainder", "%"),
+    ast.FloorDiv: ("floor_divide", "//"),
+}
+kernelUfuncs = dict({name: getattr(np, name) for name, _ in binaryUfuncs.values()}, negative=np.negative,
+                    square=np.square, copyto=np.copyto, **functions)
+# Array inputs are evaluated this many points at a time, so every register of a kernel stays in cache
+kernelChunk = 8192
+# Inputs of at least this many chunks spread them over threads, NumPy releases the GIL inside ufuncs
+threadedChunks = 4
+kernelPool = None
+kernelPoolLock = threading.Lock()
+
+
+def kernelThreads():
+    global kernelPool
+    with kernelPoolLock:
+        if kernelPool is None and (os.cpu_count() or 1) > 1:
+            kernelPool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="kernel")
+        return kernelPool
+
+
+class KernelProgram:
+    # The two equation trees as one graph of numbered operations, identical subtrees share a number
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.operations = []
+        self.numbers = {}
+
+    def intern(self, key):
+        if key not in self.numbers:
+            self.numbers[key] = len(self.operations)
+            self.operations.append(key)
+        return self.numbers[key]
+
+    def add(self, node):
+        if not usesVariables(node):
+            # Folding errors like 1/0 leave the equations to the unfused path, which reports them as before
+            try:
+                value = float(eval(compile(ast.fix_missing_locations(ast.Expression(body=node)), "<equation>",
+                                           "eval"), self.namespace))
+            except ArithmeticError as err:
+                raise EquationError("Constant cannot be folded: " + str(err)) from err
+            return self.intern(("constant", value))
+        if isinstance(node, ast.Name):
+            return self.intern(("variable", node.id))
+        if isinstance(node, ast.UnaryOp):
+            operand = self.add(node.operand)
+            return self.intern(("negative", operand)) if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.Call):
+            return self.intern((node.func.id, self.add(node.args[0])))
+        if isinstance(node, ast.BinOp):
+            if isinstance(node.op, ast.Pow) and isNumber(node.right, 2):
+                return self.intern(("square", self.add(node.left)))
+            return self.intern((type(node.op), self.add(node.left), self.add(node.right)))
+        raise EquationError("Unsupported syntax: " + type(node).__name__)
+
+    def uses(self, outputs):
+        counts = [0] * len(self.operations)
+        for key in self.operations:
+            for operand in key[1:]:
+                if not isinstance(key[0], str) or key[0] not in ("constant", "variable"):
+                    counts[operand] += 1
+        for output in outputs:
+            counts[output] += 1
+        return counts
+
+    def constantValues(self):
+        # Constants are passed to the generated code by name, repr would spell inf and nan as undefined names
+        return {"_c" + str(number): key[1] for number, key in enumerate(self.operations) if key[0] == "constant"}
+
+    def leaf(self, number):
+        kind, value = self.operations[number][:2]
+        if kind == "constant":
+            return "_c" + str(number)
+        if kind == "variable":
+            return value
+        return None
+
+    def scalarSource(self, outputs):
+        # Plain operators on scalars, subexpressions used more than once go into locals
+        uses = self.uses(outputs)
+        expressions = []
+        lines = []
+        for number, key in enumerate(self.operations):
+            expression = self.leaf(number)
+            if expression is None:
+                operands = [expressions[operand] for operand in key[1:]]
+                if key[0] == "negative":
+                    expression = "(-" + operands[0] + ")"
+                elif key[0] == "square":
+                    expression = "(" + operands[0] + " ** 2)"
+                elif isinstance(key[0], str):
+                    expression = key[0] + "(" + operands[0] + ")"
+                else:
+                    expression = "(" + operands[0] + " " + binaryUfuncs[key[0]][1] + " " + operands[1] + ")"
+                if uses[number] > 1:
+                    lines.append("    _t" + str(number) + " = " + expression)
+                    expression = "_t" + str(number)
+            expressions.append(expression)
+        lines.append("    return " + expressions[outputs[0]] + ", " + expressions[outputs[1]])
+        return "def scalarKernel(x, y):\n" + "\n".join(lines) + "\n"
+
+    def bufferSource(self, outputs):
+        # One ufunc call per operation writing into a register or an output buffer. Registers are reused as soon as
+        # their last reader has run, so the kernel needs as few as the widest point of the graph
+        lastUse = {}
+        for number, key in enumerate(self.operations):
+            if self.leaf(number) is None:
+                for operand in key[1:]:
+                    lastUse[operand] = number
+        locations = {}
+        for number in range(len(self.operations)):
+            if self.leaf(number) is not None:
+                locations[number] = self.leaf(number)
+        freeRegisters = []
+        registerCount = 0
+        lines = []
+        for number, key in enumerate(self.operations):
+            if number in locations:
+                continue
+            operands = [locations[operand] for operand in key[1:]]
+            for operand in set(key[1:]):
+                if lastUse.get(operand) == number and locations[operand].startswith("r["):
+                    freeRegisters.append(locations[operand])
+            if number == outputs[0]:
+                location = "out0"
+            elif number == outputs[1]:
+                location = "out1"
+            elif freeRegisters:
+                location = freeRegisters.pop()
+            else:
+                location = "r[" + str(registerCount) + "]"
+                registerCount += 1
+            function = key[0] if isinstance(key[0], str) else binaryUfuncs[key[0]][0]
+            lines.append("    " + function + "(" + ", ".join(operands) + ", out=" + location + ")")
+            locations[number] = location
+
+        for output, buffer in zip(outputs, ("out0", "out1")):
+            if locations[output] == buffer:
+                continue
+            if self.leaf(output) is not None and self.operations[output][0] == "constant":
+                lines.append("    " + buffer + ".fill(" + locations[output] + ")")
+            else:
+                lines.append("    copyto(" + buffer + ", " + locations[output] + ")")
+        return "def bufferKernel(x, y, out0, out1, r):\n" + "\n".join(lines) + "\n", registerCount
+
+
+class SystemKernel:
+    # Both derivatives of a parametric system in one call. Scalars go through plain Python arithmetic, arrays
+    # through preallocated registers in cache-sized chunks, spread over threads when there are enough of them
+    def __init__(self, xEquation, yEquation, scalarFunction, bufferFunction, registerCount):
+        self.xEquation = xEquation
+        self.yEquation = yEquation
+        self.scalarFunction = scalarFunction
+        self.bufferFunction = bufferFunction
+        self.registerCount = registerCount
+        self.local = threading.local()
+
+    def registers(self, length):
+        registers = getattr(self.local, "registers", None)
+        if registers is None:
+            registers = self.local.registers = np.empty((self.registerCount, kernelChunk))
+        return registers[:, :length]
+
+    def evaluateChunk(self, x, y, out, start, errors=None):
+        end = min(start + kernelChunk, len(x))
+        # Worker threads do not see the caller's np.errstate, it is passed along instead
+        with np.errstate(**errors) if errors is not None else nullcontext():
+            self.bufferFunction(x[start:end], y[start:end], out[0, start:end], out[1, start:end],
+                                self.registers(end - start))
+
+    def __call__(self, x, y, out=None):
+        # out, when given, must be a C-contiguous (2, ...) float array of the broadcast input shape
+        if out is None and not isinstance(x, np.ndarray) and not isinstance(y, np.ndarray):
+            return np.array(self.scalarFunction(x, y), dtype=float)
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        if out is None:
+            out = np.empty((2,) + x.shape)
+        flatX = np.ascontiguousarray(x).reshape(-1)
+        flatY = np.ascontiguousarray(y).reshape(-1)
+        flatOut = out.reshape(2, -1)
+        starts = range(0, flatX.size, kernelChunk)
+        pool = kernelThreads() if len(starts) >= threadedChunks else None
+        if pool is not None:
+            errors = np.geterr()
+            for _ in pool.map(lambda start: self.evaluateChunk(flatX, flatY, flatOut, start, errors), starts):
+                pass
+        else:
+            for start in starts:
+                self.evaluateChunk(flatX, flatY, flatOut, start)
+        return out
+
+
+@lru_cache(maxsize=256)
+def compileSystem(xEquationString, yEquationString, parameters=()):
+    namespace = {"__builtins__": {}}
+    namespace.update(constants)
+    namespace.update(functions)
+    namespace.update(dict(parameters))
+    program = KernelProgram(namespace)
+    outputs = [program.add(parseEquation(equationString)[0].body)
+               for equationString in (xEquationString, yEquationString)]
+    kernelNamespace = dict(kernelUfuncs, __builtins__={})
+    kernelNamespace.update(program.constantValues())
+    exec(compile(program.scalarSource(outputs), "<kernel>", "exec"), kernelNamespace)
+    bufferSource, registerCount = program.bufferSource(outputs)
+    exec(compile(bufferSource, "<kernel>", "exec"), kernelNamespace)
+    return SystemKernel(bindEquation(xEquationString, parameters), bindEquation(yEquationString, parameters),
+                        kernelNamespace["scalarKernel"], kernelNamespace["bufferKernel"], registerCount)
+
+
+def systemKernel(xEquation, yEquation):
+    # None unless both equations were compiled from strings, callers then evaluate them one at a time
+    xEquationString = getattr(xEquation, "equationString", None)
+    yEquationString = getattr(yEquation, "equationString", None)
+    if xEquationString is None or yEquationString is None:
+        return None
+    parameters = tuple(sorted(set(getattr(xEquation, "parameters", ()) + getattr(yEquation, "parameters", ()))))
+    try:
+        return compileSystem(xEquationString, yEquationString, parameters)
+    except EquationError:
+        return None
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+
+from fields import fieldLattice, fieldTiles, latticeGrid
+from profiling import profiler
+from solvers import SolveCancelled, solveParametric, solveStandard
+
+exportVersion = 1
+exportFilters = {"NumPy archive (*.npz)": ".npz", "Raw arrays with JSON header (*.json)": ".json"}
+# Seeds solved between writes, only one chunk of trajectory points is ever held in memory
+trajectoryChunk = 256
+arrayAlignment = 64
+
+
+class RawExport:
+    # The header is a JSON file, the arrays lie back to back in a ".raw" file next to it at aligned offsets,
+    # so np.memmap(dataFile, dtype, "r", offset, shape) reads each of them without loading the rest
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.dataName = os.path.splitext(fileName)[0] + ".raw"
+        self.dataFile = open(self.dataName, "wb")
+        self.arrays = {}
+
+    def align(self):
+        offset = self.dataFile.tell()
+        padding = -offset % arrayAlignment
+        self.dataFile.write(b"\0" * padding)
+        return offset + padding
+
+    def writeArray(self, name, array):
+        array = np.ascontiguousarray(array)
+        offset = self.align()
+        array.tofile(self.dataFile)
+        self.arrays[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+
+    def streamArray(self, name, dtype, columns, blocks):
+        offset = self.align()
+        rows = 0
+        for block in blocks:
+            np.ascontiguousarray(block, dtype=dtype).tofile(self.dataFile)
+            rows += len(block)
+        self.arrays[name] = {"dtype": np.dtype(dtype).str, "shape": [rows, columns], "offset": offset}
+
+    def close(self, header):
+        self.dataFile.close()
+        header = dict(header, data=os.path.basename(self.dataName), arrays=self.arrays)
+        # The header goes last and appears in one step, its presence means the export is complete
+        with open(self.fileName + ".partial", "w") as headerFile:
+            json.dump(header, headerFile, indent=2)
+        os.replace(self.fileName + ".partial", self.fileName)
+        return [self.fileName, self.dataName]
+
+    def abort(self):
+        self.dataFile.close()
+        os.remove(self.dataName)
+
+
+class NpzExport:
+    # Streamed arrays go to a temporary file first, the .npy header needs their final length
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.archive = zipfile.ZipFile(fileName + ".partial", "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def writeArray(self, name, array):
+        with self.archive.open(name + ".npy", "w", force_zip64=True) as entry:
+            np.lib.format.write_array(entry, np.asarray(array), allow_pickle=False)
+
+    def streamArray(self, name, dtype, columns, blocks):
+        dtype = np.dtype(dtype)
+        with tempfile.TemporaryFile() as spool:
+            rows = 0
+            for block in blocks:
+                np.ascontiguousarray(block, dtype=dtype).tofile(spool)
+                rows += len(block)
+            spool.seek(0)
+            with self.archive.open(name + ".npy", "w", force_zip64=True) as entry:
+                np.lib.format.write_array_header_2_0(entry, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                             "fortran_order": False, "shape": (rows, columns)})
+                shutil.copyfileobj(spool, entry, 1 << 20)
+
+    def close(self, header):
+        self.writeArray("header", np.array(json.dumps(header)))
+        self.archive.close()
+        os.replace(self.fileName + ".partial", self.fileName)
+        return [self.fileName]
+
+    def abort(self):
+        self.archive.close()
+        os.remove(self.fileName + ".partial")
+
+
+def equationHeader(equation):
+    return {"equation": getattr(equation, "equationString", None),
+            "parameters": dict(getattr(equation, "parameters", ()))}
+
+
+def fieldSamples(isStandard, xEquation, yEquation, xmin, xmax, ymin, ymax, density):
+    # The raw equation values on the quiver lattice, not the normalised arrows drawn from them
+    levels, indices = fieldLattice(xmin, xmax, ymin, ymax, density)
+    X, Y = latticeGrid(levels, indices)
+    if isStandard:
+        return {"X": X, "Y": Y, "slopes": fieldTiles.sample(yEquation, levels, indices)}
+    xValues, yValues = fieldTiles.sampleSystem(xEquation, yEquation, levels, indices)
+    return {"X": X, "Y": Y, "U": xValues, "V": yValues}
+
+
+def trajectoryPoints(isStandard, xEquation, yEquation, xinit, yinit, tmax, xmin, xmax, ymin, ymax, cache):
+    if isStandard:
+        (leftX, leftY), (rightX, rightY) = solveStandard(yEquation, xinit, yinit, xmin, xmax, ymin, ymax, cache)
+        # Both branches start at the seed, so they join into one curve like standardSegment
+        return np.column_stack((np.concatenate((leftX[::-1], rightX[1:] if len(leftX) else rightX)),
+                                np.concatenate((leftY[::-1], rightY[1:] if len(leftY) else rightY))))
+    times, states = solveParametric(xEquation, yEquation, xinit, yinit, tmax, xmin, xmax, ymin, ymax, cache)
+    return np.column_stack((times, states[0], states[1]))
+
+
+def trajectoryBlocks(isStandard, xEquation, yEquation, seeds, tmax, xmin, xmax, ymin, ymax, offsets, cache,
+                     isCancelled):
+    # Yields the points of trajectoryChunk seeds at a time and fills in where each trajectory starts
+    for start in range(0, len(seeds), trajectoryChunk):
+        if isCancelled is not None and isCancelled():
+            raise SolveCancelled()
+        block = [trajectoryPoints(isStandard, xEquation, yEquation, xinit, yinit, tmax, xmin, xmax, ymin, ymax, cache)
+                 for xinit, yinit in seeds[start:start + trajectoryChunk]]
+        lengths = [len(points) for points in block]
+        offsets[start + 1:start + 1 + len(block)] = offsets[start] + np.cumsum(lengths)
+        profiler.count("exportedPoints", sum(lengths))
+        yield np.concatenate(block) if block else np.empty((0, 2 if isStandard else 3))
+
+
+def exportData(fileName, isStandard, xEquation, yEquation, seeds, xmin, xmax, ymin, ymax, tmax, density, cache=None,
+               isCancelled=None):
+    # Trajectory i is points[offsets[i]:offsets[i + 1]], the columns are listed in the header
+    seeds = np.asarray(seeds, dtype=float).reshape(-1, 2)
+    columns = ["x", "y"] if isStandard else ["t", "x", "y"]
+    header = {"version": exportVersion, "mode": "standard" if isStandard else "parametric",
+              "equations": ({"dy/dx": equationHeader(yEquation)} if isStandard else
+                            {"dx/dt": equationHeader(xEquation), "dy/dt": equationHeader(yEquation)}),
+              "window": [xmin, xmax, ymin, ymax], "tmax": tmax, "density": density, "columns": columns}
+    export = NpzExport(fileName) if fileName.endswith(".npz") else RawExport(fileName)
+    try:
+        with profiler.span("exportData"):
+            for name, array in fieldSamples(isStandard, xEquation, yEquation, xmin, xmax, ymin, ymax, density).items():
+                export.writeArray(name, array)
+            export.writeArray("seeds", seeds)
+            offsets = np.zeros(len(seeds) + 1, dtype=np.int64)
+            export.streamArray("points", np.float64, len(columns),
+                               trajectoryBlocks(isStandard, xEquation, yEquation, seeds, tmax, xmin, xmax, ymin, ymax,
+                                                offsets, cache, isCancelled))
+            export.writeArray("offsets", offsets)
+    except BaseException:
+        export.abort()
+        raise
+    return export.close(header)
+
+
+def loadExport(fileName, mmapMode="r"):
+    # Returns the header and a dictionary of arrays, raw exports come back as memory maps
+    if fileName.endswith(".npz"):
+        with np.load(fileName) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+        return json.loads(str(arrays.pop("header"))), arrays
+    with open(fileName) as headerFile:
+        header = json.load(headerFile)
+    dataName = os.path.join(os.path.dirname(os.path.abspath(fileName)), header["data"])
+    arrays = {name: np.memmap(dataName, dtype=np.dtype(layout["dtype"]), mode=mmapMode, offset=layout["offset"],
+                              shape=tuple(layout["shape"])) if np.prod(layout["shape"]) else
+              np.empty(layout["shape"], dtype=np.dtype(layout["dtype"]))
+              for name, layout in header["arrays"].items()}
+    return header, arrays
@@ -0,0 +1,285 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from equations import bindEquation
+from integrators import DIVERGED, STOPPED, integrateDormandPrince, parametricSystem
+from orbits import classifyOrbit
+from profiling import profiler
+from solvers import SolveCancelled
+
+ESCAPED = -1
+UNDECIDED = -2
+CONVERGED = -3
+# Chunks handed to each worker, enough that a slow chunk does not leave the other workers idle
+chunksPerWorker = 4
+# Spawned workers take a while to start, one pool is kept for later fate maps and only replaced to grow it
+workerPool = None
+workerPoolSize = 0
+workerPoolLock = threading.Lock()
+# End states still moving when the span ran out are followed once more to find the attracting cycles they lie on,
+# giving up after this many that were not on one
+maxCycleSearches = 16
+# Points measured against a path at a time, to bound the (points, segments) distance arrays
+distanceChunk = 1024
+
+
+class FateMap:
+    def __init__(self, labels, attractors, cycles, counts, extent):
+        # labels[row, column] is an index into the attractors followed by the cycles, ESCAPED or UNDECIDED, row 0 is
+        # ymin. cycles are the (2, n) paths of the closed orbits
+        self.labels = labels
+        self.attractors = attractors
+        self.cycles = cycles
+        self.counts = counts
+        self.extent = extent
+
+
+def pixelSeeds(xmin, xmax, ymin, ymax, resolution):
+    x = xmin + (np.arange(resolution) + 0.5) / resolution * (xmax - xmin)
+    y = ymin + (np.arange(resolution) + 0.5) / resolution * (ymax - ymin)
+    X, Y = np.meshgrid(x, y)
+    return np.vstack((X.ravel(), Y.ravel()))
+
+
+def escapeBounds(xmin, xmax, ymin, ymax, margin=1.0):
+    xmargin = (xmax - xmin) * margin
+    ymargin = (ymax - ymin) * margin
+    return xmin - xmargin, xmax + xmargin, ymin - ymargin, ymax + ymargin
+
+
+def integrateFates(system, seeds, seedPixels, span, window, resolution, speedTolerance):
+    # Returns one fate per seed: CONVERGED, ESCAPED, UNDECIDED, or the pixel whose fate it shares.
+    # Seeds stop once they come to rest, leave the escape bounds, or enter a pixel whose own seed already
+    # has a fate, so most of the grid only integrates until it meets an earlier trajectory
+    xmin, xmax, ymin, ymax = window
+    xlow, xhigh, ylow, yhigh = escapeBounds(xmin, xmax, ymin, ymax)
+    fates = np.full(seeds.shape[1], UNDECIDED)
+    known = np.zeros(resolution * resolution, dtype=bool)
+
+    def stop(indices, times, states):
+        velocity = system(times, states)
+        resting = np.hypot(velocity[0], velocity[1]) < speedTolerance
+        escaped = ~resting & ((states[0] < xlow) | (states[0] > xhigh) | (states[1] < ylow) | (states[1] > yhigh))
+        columns = np.floor((states[0] - xmin) / (xmax - xmin) * resolution)
+        rows = np.floor((states[1] - ymin) / (ymax - ymin) * resolution)
+        inWindow = (columns >= 0) & (columns < resolution) & (rows >= 0) & (rows < resolution)
+        pixels = np.where(inWindow, rows * resolution + columns, 0).astype(int)
+        arrived = ~resting & ~escaped & inWindow & known[pixels] & (pixels != seedPixels[indices])
+        fates[indices[resting]] = CONVERGED
+        fates[indices[escaped]] = ESCAPED
+        fates[indices[arrived]] = pixels[arrived]
+        stopped = resting | escaped | arrived
+        known[seedPixels[indices[stopped]]] = True
+        return stopped
+
+    result = integrateDormandPrince(system, seeds, 0, span, stopFunction=stop, record=False)
+    fates[result.status == DIVERGED] = ESCAPED
+    return fates, result.finalStates
+
+
+def integrateFateChunk(xEquationString, yEquationString, parameters, seeds, seedPixels, span, window, resolution,
+                       speedTolerance):
+    # Runs in worker processes, which compile their own copies of the equations
+    system = parametricSystem(bindEquation(xEquationString, parameters), bindEquation(yEquationString, parameters))
+    return integrateFates(system, seeds, seedPixels, span, window, resolution, speedTolerance)
+
+
+def clusterAttractors(points, radius):
+    if len(points) == 0:
+        return np.empty((0, 2)), np.empty(0, dtype=int)
+    cells, cellLabels = np.unique(np.round(points / radius).astype(np.int64), axis=0, return_inverse=True)
+    cellLabels = cellLabels.ravel()
+    cellCounts = np.bincount(cellLabels, minlength=len(cells))
+    cellCenters = np.zeros((len(cells), 2))
+    np.add.at(cellCenters, cellLabels, points)
+    cellCenters /= cellCounts[:, None]
+
+    # Neighbouring cells that hold the same attractor are merged, most populated first
+    attractors = []
+    attractorCounts = []
+    cellAttractor = np.empty(len(cells), dtype=int)
+    for cell in np.argsort(-cellCounts, kind="stable"):
+        if attractors:
+            distances = np.hypot(*(np.array(attractors) - cellCenters[cell]).T)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= 2 * radius:
+                cellAttractor[cell] = nearest
+                attractorCounts[nearest] += cellCounts[cell]
+                continue
+        cellAttractor[cell] = len(attractors)
+        attractors.append(cellCenters[cell])
+        attractorCounts.append(cellCounts[cell])
+    return np.array(attractors), cellAttractor[cellLabels]
+
+
+def segmentDistances(points, path):
+    # (points, segments) distances from points (2, n) to the segments of path (2, m)
+    if path.shape[1] < 2:
+        path = np.hstack((path, path))
+    starts = path[:, :-1]
+    steps = np.diff(path, axis=1)
+    lengths = np.maximum(np.sum(steps ** 2, axis=0), 1e-300)
+    offsets = points[:, :, None] - starts[:, None, :]
+    along = np.clip(np.einsum("knm,km->nm", offsets, steps) / lengths, 0, 1)
+    return np.hypot(*(offsets - along * steps[:, None, :]))
+
+
+def pathDistances(points, path):
+    distances = np.empty(points.shape[1])
+    for start in range(0, points.shape[1], distanceChunk):
+        distances[start:start + distanceChunk] = segmentDistances(points[:, start:start + distanceChunk], path).min(1)
+    return distances
+
+
+def closedOrbit(system, state, span, tolerance):
+    # Follows an end state until it comes back within tolerance of where it started, after having been further than
+    # twice that away. Returns the times and path (2, n) of that period, or None when it did not come back in span
+    previous = state
+    left = False
+
+    def stop(indices, times, states):
+        nonlocal previous, left
+        current = states[:, 0]
+        closed = left and segmentDistances(state[:, None], np.column_stack((previous, current)))[0, 0] <= tolerance
+        left = left or np.hypot(*(current - state)) > 2 * tolerance
+        previous = current
+        return np.array([closed])
+
+    result = integrateDormandPrince(system, state, 0, span, rtol=1e-6, atol=1e-6 * tolerance, stopFunction=stop)
+    if result.status[0] != STOPPED:
+        return None
+    return result.trajectory(0)
+
+
+def attracting(system, times, path, scale):
+    # In the plane a cycle's nontrivial Floquet multiplier is exp of the divergence integrated over a period. Closed
+    # orbits of a family, like those around a center, have a multiplier of one and attract nothing
+    step = 1e-6 * scale
+    divergence = ((system(times, path + [[step], [0]])[0] - system(times, path - [[step], [0]])[0]) +
+                  (system(times, path + [[0], [step]])[1] - system(times, path - [[0], [step]])[1])) / (2 * step)
+    multiplier = np.exp(np.sum((divergence[1:] + divergence[:-1]) / 2 * np.diff(times)))
+    return classifyOrbit(multiplier) == "stable limit cycle"
+
+
+def findCycles(system, points, span, scale, tolerance):
+    # Groups end states (2, n) by the attracting cycle they lie on. Returns the cycles' paths and one cycle index per
+    # point, -1 for points on none
+    labels = np.full(points.shape[1], -1)
+    cycles = []
+    remaining = np.arange(points.shape[1])
+    failures = 0
+    while len(remaining) > 0 and failures < maxCycleSearches:
+        state = points[:, remaining[0]]
+        orbit = closedOrbit(system, state, span, tolerance)
+        if orbit is None:
+            failures += 1
+            remaining = remaining[np.hypot(*(points[:, remaining] - state[:, None])) > tolerance]
+            continue
+        times, path = orbit
+        near = pathDistances(points[:, remaining], path) <= tolerance
+        near[0] = True
+        if attracting(system, times, path, scale):
+            labels[remaining[near]] = len(cycles)
+            cycles.append(path)
+            profiler.count("fateCycles")
+        else:
+            failures += 1
+        remaining = remaining[~near]
+    return cycles, labels
+
+
+def canUseProcesses(*equations):
+    return all(getattr(equation, "equationString", None) is not None for equation in equations)
+
+
+def fateWorkers(workers):
+    global workerPool, workerPoolSize
+    with workerPoolLock:
+        if workerPool is None or workerPoolSize < workers:
+            if workerPool is not None:
+                workerPool.shutdown(wait=False)
+            # Spawned workers stay clear of the threads the GUI process already runs
+            workerPool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            workerPoolSize = workers
+        return workerPool
+
+
+def discardFateWorkers(pool):
+    # A worker that died takes the pool down with it, the next fate map starts a new one
+    global workerPool
+    with workerPoolLock:
+        if workerPool is pool:
+            workerPool = None
+
+
+def resolveFates(fates):
+    # Follow "same fate as pixel p" links until every pixel points at a final label
+    labels = fates.copy()
+    linked = labels >= 0
+    while linked.any():
+        labels[linked] = labels[labels[linked]]
+        linked = labels >= 0
+    return labels
+
+
+def computeFateMap(xEquation, yEquation, xmin, xmax, ymin, ymax, resolution=200, span=100, workers=None,
+                   isCancelled=None):
+    seeds = pixelSeeds(xmin, xmax, ymin, ymax, resolution)
+    window = (xmin, xmax, ymin, ymax)
+    scale = max(xmax - xmin, ymax - ymin)
+    speedTolerance = 1e-4 * scale
+    workers = min(workers or os.cpu_count() or 1, seeds.shape[1])
+    if not canUseProcesses(xEquation, yEquation):
+        workers = 1
+    # Interleaved chunks each cover the whole window, so their trajectories keep meeting known pixels. Known pixels
+    # are not shared between chunks, a single process takes the whole grid at once
+    chunkCount = min(chunksPerWorker * workers, seeds.shape[1]) if workers > 1 else 1
+    chunks = [np.arange(index, seeds.shape[1], chunkCount) for index in range(chunkCount)]
+    fates = np.empty(seeds.shape[1], dtype=int)
+    finalStates = np.empty_like(seeds)
+    system = parametricSystem(xEquation, yEquation)
+    profiler.count("fateSeeds", seeds.shape[1])
+
+    with profiler.span("fateMap"):
+        if workers > 1:
+            parameters = dict(getattr(xEquation, "parameters", ()) + getattr(yEquation, "parameters", ()))
+            executor = fateWorkers(workers)
+            try:
+                futures = [executor.submit(integrateFateChunk, xEquation.equationString, yEquation.equationString,
+                                           parameters, seeds[:, chunk], chunk, span, window, resolution,
+                                           speedTolerance) for chunk in chunks]
+                for chunk, future in zip(chunks, futures):
+                    if isCancelled is not None and isCancelled():
+                        for pending in futures:
+                            pending.cancel()
+                        raise SolveCancelled()
+                    fates[chunk], finalStates[:, chunk] = future.result()
+            except BrokenProcessPool:
+                discardFateWorkers(executor)
+                raise
+        else:
+            for chunk in chunks:
+                if isCancelled is not None and isCancelled():
+                    raise SolveCancelled()
+                fates[chunk], finalStates[:, chunk] = integrateFates(system, seeds[:, chunk], chunk, span, window,
+                                                                     resolution, speedTolerance)
+
+        converged = fates == CONVERGED
+        attractors, attractorLabels = clusterAttractors(finalStates[:, converged].T, 1e-2 * scale)
+        moving = np.flatnonzero((fates == UNDECIDED) & np.isfinite(finalStates).all(axis=0))
+        cycles, cycleLabels = findCycles(system, finalStates[:, moving], span, scale, 1e-2 * scale)
+
+    # Attractor and cycle indices stay below zero until the links are resolved so they are not mistaken for pixels
+    fates[converged] = -4 - attractorLabels
+    onCycle = cycleLabels >= 0
+    fates[moving[onCycle]] = -4 - len(attractors) - cycleLabels[onCycle]
+    labels = resolveFates(fates)
+    attractorPixels = labels <= -4
+    labels[attractorPixels] = -4 - labels[attractorPixels]
+    counts = np.bincount(labels[labels >= 0], minlength=len(attractors) + len(cycles))
+    return FateMap(labels.reshape(resolution, resolution), attractors, cycles, counts, window)
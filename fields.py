@@ -0,0 +1,175 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from equations import systemKernel
+from profiling import profiler
+
+fieldColor = 'deepskyblue'
+standardQuiverStyle = {"headlength": 0, "headwidth": 1}
+parametricQuiverStyle = {"headwidth": 5}
+standardTitle = "Slope Field Generator"
+parametricTitle = "Vector Field Generator"
+
+
+class TileCache:
+    # Square blocks of equation values on power-of-two lattices, keyed by equation, lattice levels and tile position
+    def __init__(self, tileSize=32, maxTiles=4096):
+        self.tileSize = tileSize
+        self.maxTiles = maxTiles
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+
+    def items(self):
+        with self.lock:
+            return list(self.tiles.items())
+
+    def lookup(self, key):
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            return tile
+
+    def store(self, key, tile):
+        with self.lock:
+            self.tiles[key] = tile
+            while len(self.tiles) > self.maxTiles:
+                self.tiles.popitem(last=False)
+
+    def fromFinerLevel(self, equation, xLevel, yLevel, column, row):
+        # Every other point of the four tiles one level down is exactly this tile, so zooming out can reuse them
+        quarters = [self.lookup((equation, xLevel - 1, yLevel - 1, 2 * column + columnOffset, 2 * row + rowOffset))
+                    for rowOffset in (0, 1) for columnOffset in (0, 1)]
+        if any(quarter is None for quarter in quarters):
+            return None
+        return np.block([[quarters[0], quarters[1]], [quarters[2], quarters[3]]])[::2, ::2]
+
+    def sample(self, equation, levels, indices):
+        return self.sampleEquations((equation,), levels, indices)[0]
+
+    def sampleSystem(self, xEquation, yEquation, levels, indices):
+        return self.sampleEquations((xEquation, yEquation), levels, indices)
+
+    def cachedTile(self, equation, xLevel, yLevel, column, row):
+        key = (equation, xLevel, yLevel, column, row)
+        tile = self.lookup(key)
+        if tile is None:
+            tile = self.fromFinerLevel(equation, xLevel, yLevel, column, row)
+            if tile is not None:
+                self.store(key, tile)
+        return tile
+
+    def sampleEquations(self, equations, levels, indices):
+        # One array per equation. A tile missing for any of them is evaluated for all, so a parametric pair goes
+        # through its fused kernel together
+        xLevel, yLevel = levels
+        xIndices, yIndices = indices
+        size = self.tileSize
+        values = [np.empty((len(yIndices), len(xIndices))) for _ in equations]
+        missing = []
+        rows = range(yIndices[0] // size, yIndices[-1] // size + 1)
+        columns = range(xIndices[0] // size, xIndices[-1] // size + 1)
+        for row in rows:
+            for column in columns:
+                tiles = [self.cachedTile(equation, xLevel, yLevel, column, row) for equation in equations]
+                if any(tile is None for tile in tiles):
+                    missing.append((column, row))
+                else:
+                    for equationValues, tile in zip(values, tiles):
+                        self.paste(equationValues, indices, column, row, tile)
+        profiler.count("tileHits", len(rows) * len(columns) - len(missing))
+
+        if missing:
+            # All newly exposed tiles go through the vectorized equations in one call
+            missingColumns, missingRows = np.array(missing).T
+            offsets = np.arange(size)
+            X = ((missingColumns[:, None] * size + offsets) * 2.0 ** xLevel)[:, None, :]
+            Y = ((missingRows[:, None] * size + offsets) * 2.0 ** yLevel)[:, :, None]
+            kernel = systemKernel(*equations) if len(equations) == 2 else None
+            with np.errstate(all="ignore"):
+                if kernel is not None:
+                    equationTiles = kernel(X, Y)
+                else:
+                    equationTiles = [np.array(np.broadcast_to(equation(X, Y), (len(missing), size, size)), dtype=float)
+                                     for equation in equations]
+            profiler.count("tilesSampled", len(missing))
+            profiler.count("rhsEvaluations", len(equations) * len(missing) * size * size)
+            for equation, equationValues, tiles in zip(equations, values, equationTiles):
+                for (column, row), tile in zip(missing, tiles):
+                    self.store((equation, xLevel, yLevel, column, row), tile)
+                    self.paste(equationValues, indices, column, row, tile)
+        return values
+
+    def paste(self, values, indices, column, row, tile):
+        xIndices, yIndices = indices
+        size = self.tileSize
+        xStart = max(column * size, xIndices[0])
+        xEnd = min(column * size + size, xIndices[-1] + 1)
+        yStart = max(row * size, yIndices[0])
+        yEnd = min(row * size + size, yIndices[-1] + 1)
+        values[yStart - yIndices[0]:yEnd - yIndices[0], xStart - xIndices[0]:xEnd - xIndices[0]] = \
+            tile[yStart - row * size:yEnd - row * size, xStart - column * size:xEnd - column * size]
+
+
+fieldTiles = TileCache()
+
+
+def fieldLattice(xmin, xmax, ymin, ymax, density, refinement=1):
+    # Power-of-two spacings keep a panned or zoomed window on the same points as the cached tiles. The spacing is
+    # rounded down, so there are always at least density * 20 arrows per axis and at most twice as many, the count
+    # doubling and halving in steps while zooming.
+    # refinement must be a power of two, the coarse lattice is then every refinement-th point of the fine one.
+    # Refinements below one give coarser lattices
+    count = max(int(density * 20), 2)
+    levels = []
+    indices = []
+    for low, high in ((xmin, xmax), (ymin, ymax)):
+        level = int(np.floor(np.log2((high - low) / (count - 1)))) - int(np.round(np.log2(refinement)))
+        spacing = 2.0 ** level
+        levels.append(level)
+        indices.append(np.arange(np.ceil(low / spacing), np.floor(high / spacing) + 1).astype(np.int64))
+    return tuple(levels), tuple(indices)
+
+
+def latticeGrid(levels, indices):
+    return np.meshgrid(indices[0] * 2.0 ** levels[0], indices[1] * 2.0 ** levels[1])
+
+
+def quiverScale(lineLength):
+    return 50 / lineLength
+
+
+def standardArrows(X, Y, slopes, ratio):
+    U = (1 / (1 + slopes ** 2) ** 0.5) * np.ones(X.shape) * ratio
+    V = (1 / (1 + slopes ** 2) ** 0.5) * slopes
+    return X, Y, U, V
+
+
+def parametricArrows(X, Y, xValues, yValues, ratio):
+    return X, Y, xValues * ratio, yValues
+
+
+def sampleStandardField(equation, xmin, xmax, ymin, ymax, density):
+    levels, indices = fieldLattice(xmin, xmax, ymin, ymax, density)
+    X, Y = latticeGrid(levels, indices)
+    ratio = (ymax - ymin) / (xmax - xmin)
+
+    with profiler.span("sampleField"):
+        slopes = fieldTiles.sample(equation, levels, indices)
+    return standardArrows(X, Y, slopes, ratio)
+
+
+def sampleParametricField(xEquation, yEquation, xmin, xmax, ymin, ymax, density):
+    levels, indices = fieldLattice(xmin, xmax, ymin, ymax, density)
+    X, Y = latticeGrid(levels, indices)
+    ratio = (ymax - ymin) / (xmax - xmin)
+
+    with profiler.span("sampleField"):
+        xValues, yValues = fieldTiles.sampleSystem(xEquation, yEquation, levels, indices)
+    return parametricArrows(X, Y, xValues, yValues, ratio)
@@ -0,0 +1,138 @@
+import numpy as np
+
+from fields import fieldLattice, fieldTiles
+from profiling import profiler
+from solvers import SolveCancelled
+
+arrowRenderer = "Arrows"
+fieldRenderers = (arrowRenderer, "Heatmap", "Line Integral Convolution", "Streaks")
+convolutionSteps = 10
+streakSpacing = 10
+streakSteps = 14
+# The canvas is about 600 pixels across, streamline textures finer than this are resampled away when drawn
+textureLimit = 700
+
+
+class FieldTexture:
+    def __init__(self, scalar, shading, shadingMode, diverging, extent):
+        # scalar is in [0, 1] and picks the colour, shading darkens it ("multiply") or draws glyphs over white ("glyph")
+        self.scalar = scalar
+        self.shading = shading
+        self.shadingMode = shadingMode
+        self.diverging = diverging
+        self.extent = extent
+
+
+def pixelExtent(indices, xSpacing, ySpacing):
+    # Each sample is the centre of one image pixel
+    return ((indices[0][0] - 0.5) * xSpacing, (indices[0][-1] + 0.5) * xSpacing,
+            (indices[1][0] - 0.5) * ySpacing, (indices[1][-1] + 0.5) * ySpacing)
+
+
+def checkCancelled(isCancelled):
+    if isCancelled is not None and isCancelled():
+        raise SolveCancelled()
+
+
+def pixelDirections(xValues, yValues, xSpacing, ySpacing):
+    # Unit steps in grid cells, zero where the field vanishes or is undefined
+    with np.errstate(all="ignore"):
+        xPixels = xValues / xSpacing
+        yPixels = yValues / ySpacing
+        length = np.hypot(xPixels, yPixels)
+        valid = np.isfinite(length) & (length > 0)
+        length = np.where(valid, length, 1)
+        return (np.where(valid, xPixels / length, 0).astype(np.float32),
+                np.where(valid, yPixels / length, 0).astype(np.float32))
+
+
+def gridLookup(values, x, y):
+    rows, columns = values.shape
+    return values[np.clip(np.rint(y).astype(np.intp), 0, rows - 1), np.clip(np.rint(x).astype(np.intp), 0, columns - 1)]
+
+
+def clampedPixels(x, y, rows, columns):
+    # Positions stay clamped to the grid, so the flat pixel index needs no bounds mask
+    np.clip(x, 0, columns - 1, out=x)
+    np.clip(y, 0, rows - 1, out=y)
+    return (y + 0.5).astype(np.int32) * columns + (x + 0.5).astype(np.int32)
+
+
+def stretch(values):
+    # Percentiles of a strided subset are plenty for a colour range and much cheaper on large grids
+    low, high = np.nanpercentile(values.ravel()[::max(1, values.size // 100000)], (1, 99))
+    if not high > low:
+        return np.full(values.shape, 0.5)
+    return np.clip((values - low) / (high - low), 0, 1)
+
+
+def lineIntegralConvolution(xDirections, yDirections, steps, isCancelled=None):
+    # Every pixel walks its streamline both ways at once, averaging the white noise it passes over
+    rows, columns = xDirections.shape
+    noise = np.random.default_rng(0).random(rows * columns, dtype=np.float32)
+    xDirections = xDirections.ravel()
+    yDirections = yDirections.ravel()
+    total = noise.copy()
+    for direction in (1, -1):
+        y, x = np.mgrid[0:rows, 0:columns].astype(np.float32).reshape(2, -1)
+        pixels = np.arange(rows * columns, dtype=np.int32)
+        for _ in range(steps):
+            checkCancelled(isCancelled)
+            if direction > 0:
+                x += xDirections[pixels]
+                y += yDirections[pixels]
+            else:
+                x -= xDirections[pixels]
+                y -= yDirections[pixels]
+            pixels = clampedPixels(x, y, rows, columns)
+            total += noise[pixels]
+    return stretch(total.reshape(rows, columns))
+
+
+def streakGlyphs(xDirections, yDirections, spacing, steps, isCancelled=None):
+    # Short streaks from a jittered sparse grid, brightening towards their heads so the direction reads
+    rows, columns = xDirections.shape
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[spacing / 2:rows:spacing, spacing / 2:columns:spacing].reshape(2, -1).astype(np.float32)
+    x += rng.uniform(-spacing / 2, spacing / 2, x.shape).astype(np.float32)
+    y += rng.uniform(-spacing / 2, spacing / 2, y.shape).astype(np.float32)
+    image = np.zeros(rows * columns)
+    for step in range(steps):
+        checkCancelled(isCancelled)
+        inside = (x > -0.5) & (x < columns - 0.5) & (y > -0.5) & (y < rows - 0.5)
+        pixels = np.rint(y[inside]).astype(np.intp) * columns + np.rint(x[inside]).astype(np.intp)
+        image += np.bincount(pixels, minlength=rows * columns) * ((step + 1) / steps)
+        xStep = gridLookup(xDirections, x, y)
+        y += gridLookup(yDirections, x, y)
+        x += xStep
+    return np.clip(image.reshape(rows, columns), 0, 1)
+
+
+def computeFieldTexture(renderer, isStandard, xEquation, yEquation, xmin, xmax, ymin, ymax, density, isCancelled=None):
+    levels, indices = fieldLattice(xmin, xmax, ymin, ymax, density)
+    count = max(len(axisIndices) for axisIndices in indices)
+    if renderer != "Heatmap" and count > textureLimit:
+        levels, indices = fieldLattice(xmin, xmax, ymin, ymax, density, 0.5 ** np.ceil(np.log2(count / textureLimit)))
+    xSpacing, ySpacing = 2.0 ** levels[0], 2.0 ** levels[1]
+
+    with profiler.span("fieldTexture", renderer=renderer):
+        if isStandard:
+            yValues = fieldTiles.sample(yEquation, levels, indices)
+            xValues = np.ones_like(yValues)
+            with np.errstate(invalid="ignore"):
+                scalar = 0.5 + np.arctan(yValues) / np.pi
+        else:
+            xValues, yValues = fieldTiles.sampleSystem(xEquation, yEquation, levels, indices)
+            with np.errstate(all="ignore"):
+                scalar = stretch(np.log1p(np.hypot(xValues, yValues)))
+        checkCancelled(isCancelled)
+
+        if renderer == "Heatmap":
+            return FieldTexture(scalar, None, None, isStandard, pixelExtent(indices, xSpacing, ySpacing))
+        extent = pixelExtent(indices, xSpacing, ySpacing)
+        xDirections, yDirections = pixelDirections(xValues, yValues, xSpacing, ySpacing)
+        if renderer == "Line Integral Convolution":
+            shading = lineIntegralConvolution(xDirections, yDirections, convolutionSteps, isCancelled)
+            return FieldTexture(scalar, shading, "multiply", isStandard, extent)
+        shading = streakGlyphs(xDirections, yDirections, streakSpacing, streakSteps, isCancelled)
+        return FieldTexture(scalar, shading, "glyph", isStandard, extent)
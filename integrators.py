@@ -0,0 +1,233 @@
+import numpy as np
+
+from equations import systemKernel
+from profiling import profiler
+
+RUNNING = 0
+FINISHED = 1
+LEFT_WINDOW = 2
+DIVERGED = 3
+STOPPED = 4
+MAX_STEPS = 5
+
+# Dormand-Prince 5(4) tableau
+dpC = np.array([0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1])
+dpA = [
+    [],
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+dpB = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0])
+dpE = dpB - np.array([5179 / 57600, 0, 7571 / 16695, 393 / 640, -92097 / 339200, 187 / 2100, 1 / 40])
+
+
+def parametricSystem(xEquation, yEquation):
+    # Systems return a new (2, ...) array, or fill out when the caller keeps a buffer for the derivatives
+    kernel = systemKernel(xEquation, yEquation)
+    if kernel is not None:
+        def system(t, states, out=None):
+            return kernel(states[0], states[1], out)
+        return system
+
+    def system(t, states, out=None):
+        x, y = states
+        if out is None:
+            return np.array(np.broadcast_arrays(xEquation(x, y), yEquation(x, y)), dtype=float)
+        out[0] = xEquation(x, y)
+        out[1] = yEquation(x, y)
+        return out
+    return system
+
+
+def standardSystem(equation):
+    # dy/dx = f(x, y) integrated with x itself as the independent variable
+    def system(t, states, out=None):
+        x, y = states
+        if out is None:
+            return np.array(np.broadcast_arrays(np.ones_like(x), equation(x, y)), dtype=float)
+        out[0] = 1.0
+        out[1] = equation(x, y)
+        return out
+    return system
+
+
+class BatchResult:
+    def __init__(self, seedCount, recordIndex, recordTimes, recordStates, finalTimes, finalStates, status):
+        order = np.argsort(recordIndex, kind="stable")
+        self.seedIndex = recordIndex[order]
+        self.times = recordTimes[order]
+        self.states = recordStates[:, order]
+        self.offsets = np.searchsorted(self.seedIndex, np.arange(seedCount + 1))
+        self.finalTimes = finalTimes
+        self.finalStates = finalStates
+        self.status = status
+
+    def __len__(self):
+        return len(self.status)
+
+    def trajectory(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.times[start:end], self.states[:, start:end]
+
+    def segments(self, xmin, xmax, ymin, ymax):
+        # One (n, 2) array per seed with NaN rows where the trajectory is outside the window
+        points = self.states.T.copy()
+        outside = ~((xmin < points[:, 0]) & (points[:, 0] < xmax) & (ymin < points[:, 1]) & (points[:, 1] < ymax))
+        points[outside] = np.nan
+        profiler.count("pointsKept", len(points) - np.count_nonzero(outside))
+        profiler.count("pointsDiscarded", np.count_nonzero(outside))
+        return np.split(points, self.offsets[1:-1])
+
+
+class BatchRecorder:
+    def __init__(self, record):
+        self.record = record
+        self.indices = []
+        self.times = []
+        self.states = []
+
+    def add(self, indices, times, states):
+        if self.record:
+            self.indices.append(indices)
+            self.times.append(np.broadcast_to(times, indices.shape).copy())
+            self.states.append(states.copy())
+
+    def result(self, seedCount, finalTimes, finalStates, status):
+        if self.indices:
+            indices = np.concatenate(self.indices)
+            times = np.concatenate(self.times)
+            states = np.hstack(self.states)
+        else:
+            indices = np.empty(0, dtype=int)
+            times = np.empty(0)
+            states = np.empty((2, 0))
+        return BatchResult(seedCount, indices, times, states, finalTimes, finalStates, status)
+
+
+def updateStatus(status, indices, states, bounds, stopFunction, times):
+    active = np.ones(len(indices), dtype=bool)
+    diverged = ~np.isfinite(states).all(axis=0)
+    status[indices[diverged]] = DIVERGED
+    active &= ~diverged
+    if bounds is not None:
+        xmin, xmax, ymin, ymax = bounds
+        outside = active & ((states[0] < xmin) | (states[0] > xmax) | (states[1] < ymin) | (states[1] > ymax))
+        status[indices[outside]] = LEFT_WINDOW
+        active &= ~outside
+    if stopFunction is not None and active.any():
+        stop = np.zeros(len(indices), dtype=bool)
+        stop[active] = stopFunction(indices[active], times[active] if np.ndim(times) else times, states[:, active])
+        status[indices[stop]] = STOPPED
+        active &= ~stop
+    return active
+
+
+def integrateRK4(system, seeds, t0, tend, steps, bounds=None, stopFunction=None, record=True):
+    states = np.array(seeds, dtype=float).reshape(2, -1).copy()
+    seedCount = states.shape[1]
+    status = np.zeros(seedCount, dtype=int)
+    times = np.full(seedCount, float(t0))
+    h = (tend - t0) / steps
+    recorder = BatchRecorder(record)
+
+    indices = np.arange(seedCount)
+    recorder.add(indices, t0, states)
+    indices = indices[updateStatus(status, indices, states, bounds, stopFunction, t0)]
+    for step in range(steps):
+        if len(indices) == 0:
+            break
+        t = t0 + step * h
+        y = states[:, indices]
+        k1 = system(t, y)
+        k2 = system(t + h / 2, y + h / 2 * k1)
+        k3 = system(t + h / 2, y + h / 2 * k2)
+        k4 = system(t + h, y + h * k3)
+        y = y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        states[:, indices] = y
+        times[indices] = t + h
+        profiler.count("rhsEvaluations", 4 * len(indices))
+        profiler.count("solverSteps", len(indices))
+        recorder.add(indices, t + h, y)
+        indices = indices[updateStatus(status, indices, y, bounds, stopFunction, t + h)]
+
+    status[indices] = FINISHED
+    return recorder.result(seedCount, times, states, status)
+
+
+def integrateDormandPrince(system, seeds, t0, tend, rtol=1e-3, atol=1e-6, bounds=None, stopFunction=None,
+                           maxSteps=10000, record=True):
+    states = np.array(seeds, dtype=float).reshape(2, -1).copy()
+    seedCount = states.shape[1]
+    status = np.zeros(seedCount, dtype=int)
+    times = np.full(seedCount, float(t0))
+    span = float(tend - t0)
+    direction = 1.0 if span >= 0 else -1.0
+    recorder = BatchRecorder(record)
+
+    indices = np.arange(seedCount)
+    recorder.add(indices, t0, states)
+    indices = indices[updateStatus(status, indices, states, bounds, stopFunction, t0)]
+    if span == 0 or len(indices) == 0:
+        status[indices] = FINISHED
+        return recorder.result(seedCount, times, states, status)
+
+    y = states[:, indices]
+    k1All = np.zeros_like(states)
+    k1All[:, indices] = system(times[indices], y)
+    scale = atol + rtol * np.abs(y)
+    d0 = np.sqrt(np.mean((y / scale) ** 2, axis=0))
+    d1 = np.sqrt(np.mean((k1All[:, indices] / scale) ** 2, axis=0))
+    steps = np.full(seedCount, abs(span), dtype=float)
+    steps[indices] = np.where((d0 < 1e-5) | (d1 < 1e-5), 1e-6, 0.01 * d0 / np.maximum(d1, 1e-300))
+    steps = np.minimum(steps, abs(span))
+
+    for iteration in range(maxSteps):
+        if len(indices) == 0:
+            break
+        t = times[indices]
+        y = states[:, indices]
+        h = np.minimum(steps[indices], np.abs(tend - t)) * direction
+
+        k = [k1All[:, indices]]
+        for stage in range(1, 7):
+            increment = sum(coefficient * k[j] for j, coefficient in enumerate(dpA[stage]) if coefficient != 0)
+            k.append(system(t + dpC[stage] * h, y + h * increment))
+        yNew = y + h * sum(coefficient * k[j] for j, coefficient in enumerate(dpB) if coefficient != 0)
+        errorEstimate = h * sum(coefficient * k[j] for j, coefficient in enumerate(dpE) if coefficient != 0)
+
+        scale = atol + rtol * np.maximum(np.abs(y), np.abs(yNew))
+        errorNorm = np.sqrt(np.mean((errorEstimate / scale) ** 2, axis=0))
+        errorNorm = np.where(np.isfinite(errorNorm), errorNorm, np.inf)
+        accepted = errorNorm <= 1
+        factor = np.clip(0.9 * np.maximum(errorNorm, 1e-10) ** -0.2, 0.2, 5.0)
+        steps[indices] = np.abs(h) * np.where(accepted, factor, np.minimum(factor, 1.0))
+
+        acceptedIndices = indices[accepted]
+        profiler.count("rhsEvaluations", 6 * len(indices))
+        profiler.count("solverSteps", len(acceptedIndices))
+        profiler.count("rejectedSteps", len(indices) - len(acceptedIndices))
+        tAccepted = t[accepted] + h[accepted]
+        yAccepted = yNew[:, accepted]
+        states[:, acceptedIndices] = yAccepted
+        times[acceptedIndices] = tAccepted
+        k1All[:, acceptedIndices] = k[6][:, accepted]
+        recorder.add(acceptedIndices, tAccepted, yAccepted)
+
+        keep = np.ones(len(indices), dtype=bool)
+        finished = (tend - tAccepted) * direction <= 0
+        status[acceptedIndices[finished]] = FINISHED
+        keep[np.flatnonzero(accepted)[finished]] = False
+        stillActive = updateStatus(status, acceptedIndices[~finished], yAccepted[:, ~finished], bounds, stopFunction,
+                                   tAccepted[~finished])
+        keep[np.flatnonzero(accepted)[~finished][~stillActive]] = False
+        stalled = steps[indices] < 1e-12 * max(1.0, abs(tend))
+        status[indices[stalled & keep]] = DIVERGED
+        keep &= ~stalled
+        indices = indices[keep]
+
+    status[indices] = MAX_STEPS
+    return recorder.result(seedCount, times, states, status)
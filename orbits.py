@@ -0,0 +1,231 @@
+import numpy as np
+
+from integrators import parametricSystem
+from profiling import profiler
+from solvers import (EvaluationBudgetExceeded, adaptiveSamples, budgeted, cancellable, explicitEvaluationBudget,
+                     parametricJacobian, parametricPlane, pixelSizeFor, windowEvent)
+
+# Returns to the section followed before giving up, and the total time they may take
+maxReturns = 60
+orbitTimeLimit = 2000.0
+# Later returns may take this many times longer than the previous one, slower ones are spiralling into a point
+returnSlowdown = 4.0
+# Time a seed gets to come back to its own section before the section moves to where the trajectory went
+settleSpan = 100.0
+# Relative to the window size, returns this close to the previous one have closed the orbit
+returnTolerance = 1e-7
+orbitTolerance = 1e-9
+shootingIterations = 12
+shootingAttempts = 3
+# Multipliers this close to one are closed orbits of a family, like those around a center
+neutralTolerance = 1e-3
+# Trajectories are followed a full window width beyond each edge before they count as escaped
+escapeMargin = 1.0
+orbitKinds = ("stable limit cycle", "unstable limit cycle", "closed orbit")
+
+
+class PeriodicOrbit:
+    def __init__(self, kind, times, states, period, multiplier, crossings, crossingTimes, section):
+        # kind is one of orbitKinds or None when no orbit was found, times and states are one period of the refined
+        # cycle. crossings are the Poincaré section points (2, n) the seed's trajectory went through at crossingTimes,
+        # negative when it was followed backwards, and section is the (point, normal) of the line they lie on
+        self.kind = kind
+        self.times = times
+        self.states = states
+        self.period = period
+        self.multiplier = multiplier
+        self.crossings = crossings
+        self.crossingTimes = crossingTimes
+        self.section = section
+
+    @property
+    def found(self):
+        return self.kind is not None
+
+    def description(self):
+        if not self.found:
+            return "no periodic orbit"
+        return "T = {:.6g}, multiplier {:.3g}, {}".format(self.period, self.multiplier, self.kind)
+
+
+def classifyOrbit(multiplier):
+    if abs(multiplier - 1) <= neutralTolerance:
+        return "closed orbit"
+    return "stable limit cycle" if multiplier < 1 else "unstable limit cycle"
+
+
+def nextReturn(function, start, section, span, bounds, scale, divergence=None):
+    # Follows the flow from a point on the section until it crosses the section again in the same direction. With a
+    # divergence the state carries its integral as a third component, which gives the orbit's multiplier. Returns the
+    # solution, or None when the evaluation budget ran out
+    from scipy.integrate import solve_ivp
+
+    point, normal = section
+
+    def crossSection(t, state):
+        # The start lies on the section, it counts as the first crossing so the second one is the return
+        if t == 0:
+            return 0.0
+        return np.dot(state[:2] - point, normal)
+    crossSection.terminal = 2
+    crossSection.direction = 1
+
+    state0 = start
+    system = function
+    if divergence is not None:
+        state0 = np.append(start, 0.0)
+
+        def system(t, state):
+            return np.append(function(t, state[:2]), divergence(t, state[:2]))
+    try:
+        with profiler.span("solve_ivp"):
+            solution = solve_ivp(budgeted(system, explicitEvaluationBudget), (0.0, span), state0,
+                                 rtol=orbitTolerance, atol=orbitTolerance * scale, dense_output=divergence is not None,
+                                 events=(crossSection, windowEvent(parametricPlane, bounds, escapeMargin)))
+    except EvaluationBudgetExceeded:
+        profiler.count("explicitBudgetExceeded")
+        return None
+    profiler.count("rhsEvaluations", solution.nfev)
+    profiler.count("solverSteps", len(solution.t) - 1)
+    return solution
+
+
+def returned(solution):
+    return solution is not None and solution.status == 1 and len(solution.t_events[0]) == 2
+
+
+def flowSection(function, point):
+    # The line through point across the flow there, None where the flow stops
+    with np.errstate(all="ignore"):
+        velocity = np.asarray(function(0.0, point), dtype=float)
+        speed = np.hypot(velocity[0], velocity[1])
+    if not np.isfinite(speed) or speed == 0:
+        return None
+    return point, velocity / speed
+
+
+def shootOrbit(returnPosition, s0, f0, s1, f1, tolerance):
+    # Secant iterations on F(s) = P(s) - s, P being the return map along the section. Unstable cycles are fixed
+    # points of P just as well, so they are found even though forward returns move away from them
+    for iteration in range(shootingIterations):
+        if f1 == f0:
+            return None
+        s0, f0, s1 = s1, f1, s1 - f1 * (s1 - s0) / (f1 - f0)
+        returnedPosition = returnPosition(s1)
+        if returnedPosition is None:
+            return None
+        f1 = returnedPosition - s1
+        profiler.count("shootingIterations")
+        if abs(f1) <= tolerance:
+            return s1
+    return None
+
+
+def sectionReturns(function, seed, bounds, scale):
+    # Returns to a section across the flow, stopping as soon as they have converged or as soon as three of them let
+    # the shooting method close the orbit exactly. A seed that does not come back within settleSpan is still on its
+    # way to wherever it ends up, the section then moves to where it got to.
+    # Returns (section, fixed point or None, crossings, crossing times)
+    section = flowSection(function, seed)
+    if section is None:
+        return None, None, [seed], [0.0]
+    crossings = [seed]
+    crossingTimes = [0.0]
+    solution = nextReturn(function, seed, section, settleSpan, bounds, scale)
+    if not returned(solution):
+        if solution is None or solution.status != 0:
+            return section, None, crossings, crossingTimes
+        seed = solution.y[:, -1]
+        section = flowSection(function, seed)
+        if section is None:
+            return None, None, crossings, crossingTimes
+        crossings = [seed]
+        crossingTimes = [solution.t[-1]]
+        solution = nextReturn(function, seed, section, orbitTimeLimit - crossingTimes[0], bounds, scale)
+
+    normal = section[1]
+    tangent = np.array([-normal[1], normal[0]])
+    tolerance = returnTolerance * scale
+
+    def returnPosition(position):
+        returnSolution = nextReturn(function, seed + position * tangent, section, orbitTimeLimit, bounds, scale)
+        if not returned(returnSolution):
+            return None
+        return np.dot(returnSolution.y_events[0][1] - seed, tangent)
+
+    # Positions along the section, s is the point seed + s * tangent
+    positions = [0.0]
+    attempts = 0
+    for index in range(maxReturns):
+        if not returned(solution):
+            break
+        returnTime = solution.t_events[0][1]
+        crossings.append(solution.y_events[0][1])
+        crossingTimes.append(crossingTimes[-1] + returnTime)
+        positions.append(np.dot(crossings[-1] - seed, tangent))
+        profiler.count("sectionReturns")
+        if abs(positions[-1] - positions[-2]) <= tolerance:
+            return section, seed + positions[-1] * tangent, crossings, crossingTimes
+        if len(positions) >= 3 and attempts < shootingAttempts:
+            attempts += 1
+            position = shootOrbit(returnPosition, positions[-3], positions[-2] - positions[-3], positions[-2],
+                                  positions[-1] - positions[-2], tolerance)
+            if position is not None:
+                return section, seed + position * tangent, crossings, crossingTimes
+        span = min(returnSlowdown * returnTime, orbitTimeLimit - crossingTimes[-1])
+        if span <= 0:
+            break
+        solution = nextReturn(function, crossings[-1], section, span, bounds, scale)
+    return section, None, crossings, crossingTimes
+
+
+def searchOrbit(function, divergence, seed, bounds, scale):
+    # Returns (times, states, period, multiplier, section, crossings, crossing times) of the orbit the flow of
+    # function settles onto, times is None when there is none
+    section, fixedPoint, crossings, crossingTimes = sectionReturns(function, seed, bounds, scale)
+    notFound = (None, None, None, None, section, crossings, crossingTimes)
+    if fixedPoint is None:
+        return notFound
+    # One more period from the fixed point, with the divergence integrated alongside. In the plane the nontrivial
+    # Floquet multiplier is exp of the divergence integral over a period
+    solution = nextReturn(function, fixedPoint, section, orbitTimeLimit, bounds, scale, divergence)
+    if not returned(solution):
+        return notFound
+    times, states = adaptiveSamples(solution, parametricPlane, pixelSizeFor(bounds, 600))
+    states = np.asarray(states)[:2]
+    # A cycle smaller than a couple of pixels is the trajectory settling onto an equilibrium the section runs through
+    extent = np.ptp(states, axis=1) / pixelSizeFor(bounds, 600)
+    if not np.all(np.isfinite(extent)) or extent.max() < 2:
+        return notFound
+    return (times, states, solution.t_events[0][1], float(np.exp(solution.y_events[0][1][2])), section, crossings,
+            crossingTimes)
+
+
+def findPeriodicOrbit(xEquation, yEquation, xinit, yinit, xmin, xmax, ymin, ymax, isCancelled=None):
+    # Searches forwards in time for the orbit the seed settles onto, then backwards, where unstable cycles become
+    # stable ones. Backward results are turned around, so times, crossings and multipliers always read forwards
+    function = cancellable(parametricSystem(xEquation, yEquation), isCancelled)
+    jacobian = parametricJacobian(xEquation, yEquation, function)
+    bounds = (xmin, xmax, ymin, ymax)
+    scale = max(xmax - xmin, ymax - ymin)
+    seed = np.array([xinit, yinit], dtype=float)
+    with profiler.span("periodicOrbit"):
+        for direction in (1.0, -1.0):
+            def system(t, state):
+                return direction * np.asarray(function(t, state), dtype=float)
+
+            def divergence(t, state):
+                return direction * np.trace(jacobian(t, state))
+            times, states, period, multiplier, section, crossings, crossingTimes = searchOrbit(system, divergence,
+                                                                                               seed, bounds, scale)
+            if direction == 1.0:
+                forwardCrossings = (np.array(crossings).T, np.array(crossingTimes), section)
+            if times is None:
+                continue
+            if direction < 0:
+                times, states, multiplier = period - times[::-1], states[:, ::-1], 1 / multiplier
+                section = (section[0], -section[1])
+            profiler.count("periodicOrbits")
+            return PeriodicOrbit(classifyOrbit(multiplier), times, states, period, multiplier,
+                                 np.array(crossings).T, direction * np.array(crossingTimes), section)
+    return PeriodicOrbit(None, None, None, None, None, *forwardCrossings)
@@ -0,0 +1,117 @@
+import numpy as np
+
+from profiling import profiler
+
+particleRenderer = "Particles"
+particleCount = 10000
+trailFade = 0.94
+stepPixels = 1.5
+maxStepPixels = 4.0
+
+
+class ParticleFlow:
+    # Every buffer is allocated here, a frame only writes into them, the system included
+    def __init__(self, width, height, count=particleCount, seed=0):
+        self.width = width
+        self.height = height
+        self.count = count
+        self.rng = np.random.default_rng(seed)
+        self.system = None
+        self.window = None
+
+        self.scale = np.empty((2, 1))
+        self.states = np.empty((2, count))
+        self.midpoints = np.empty((2, count))
+        self.velocity = np.empty((2, count))
+        self.randoms = np.empty((2, count))
+        self.lengths = np.empty(count)
+        self.ages = np.zeros(count, dtype=np.int32)
+        self.lifetimes = self.rng.integers(40, 160, count).astype(np.int32)
+        self.respawn = np.empty(count, dtype=bool)
+        self.scratch = np.empty(count, dtype=bool)
+        self.positions = np.empty(count)
+        self.columns = np.empty(count, dtype=np.intp)
+        self.rows = np.empty(count, dtype=np.intp)
+        # Row 0 is the bottom of the window, matching an image drawn with origin="lower"
+        self.trails = np.zeros((height, width), dtype=np.float32)
+        self.flatTrails = self.trails.reshape(-1)
+
+    def setSystem(self, system, window):
+        # A new system keeps the particles where they are, a new window starts them over
+        self.system = system
+        if window != self.window:
+            self.window = window
+            self.trails.fill(0)
+            self.respawn.fill(True)
+            self.respawnParticles()
+
+    def respawnParticles(self):
+        xmin, xmax, ymin, ymax = self.window
+        self.rng.random(out=self.randoms)
+        self.randoms[0] *= xmax - xmin
+        self.randoms[0] += xmin
+        self.randoms[1] *= ymax - ymin
+        self.randoms[1] += ymin
+        np.copyto(self.states, self.randoms, where=self.respawn)
+        np.copyto(self.ages, 0, where=self.respawn)
+
+    def advance(self, velocity, fraction):
+        # Scales pixel velocities into a step where the average particle moves stepPixels, keeping relative
+        # speeds, and caps single steps so a few very fast particles cannot streak across the window
+        np.hypot(velocity[0], velocity[1], out=self.lengths)
+        np.nan_to_num(self.lengths, copy=False, nan=0.0, posinf=0.0)
+        meanLength = self.lengths.mean()
+        if meanLength <= 0:
+            velocity.fill(0)
+            return
+        velocity *= stepPixels * fraction / meanLength
+        self.lengths *= stepPixels * fraction / meanLength
+        np.maximum(self.lengths, maxStepPixels * fraction, out=self.lengths)
+        np.divide(maxStepPixels * fraction, self.lengths, out=self.lengths)
+        velocity *= self.lengths
+
+    def step(self):
+        xmin, xmax, ymin, ymax = self.window
+        # One pixel of the trail image in data units, per axis
+        self.scale[0] = (xmax - xmin) / self.width
+        self.scale[1] = (ymax - ymin) / self.height
+
+        with np.errstate(all="ignore"):
+            # Midpoint rule in pixel space, so both axes move at the same on-screen speed
+            velocity = self.system(0.0, self.states, self.velocity)
+            velocity /= self.scale
+            self.advance(velocity, 0.5)
+            np.multiply(velocity, self.scale, out=self.midpoints)
+            self.midpoints += self.states
+            velocity = self.system(0.0, self.midpoints, self.velocity)
+            velocity /= self.scale
+            self.advance(velocity, 1.0)
+            velocity *= self.scale
+            self.states += velocity
+
+        self.ages += 1
+        np.greater(self.ages, self.lifetimes, out=self.respawn)
+        for values, low, high in ((self.states[0], xmin, xmax), (self.states[1], ymin, ymax)):
+            np.less(values, low, out=self.scratch)
+            self.respawn |= self.scratch
+            np.greater_equal(values, high, out=self.scratch)
+            self.respawn |= self.scratch
+            np.isnan(values, out=self.scratch)
+            self.respawn |= self.scratch
+        self.respawnParticles()
+
+        np.subtract(self.states[0], xmin, out=self.positions)
+        self.positions *= self.width / (xmax - xmin)
+        np.copyto(self.columns, self.positions, casting="unsafe")
+        np.subtract(self.states[1], ymin, out=self.positions)
+        self.positions *= self.height / (ymax - ymin)
+        np.copyto(self.rows, self.positions, casting="unsafe")
+        np.clip(self.columns, 0, self.width - 1, out=self.columns)
+        np.clip(self.rows, 0, self.height - 1, out=self.rows)
+        self.rows *= self.width
+        self.rows += self.columns
+
+        self.trails *= trailFade
+        self.flatTrails[self.rows] = 1.0
+        profiler.count("particleFrames")
+        return self.trails
@@ -0,0 +1,104 @@
+import numpy as np
+
+from integrators import integrateDormandPrince
+from solvers import SolveCancelled
+
+seedingModes = ("Grid", "Random", "Even")
+
+
+class CoverageGrid:
+    def __init__(self, xmin, xmax, ymin, ymax, cells):
+        self.xmin = xmin
+        self.xmax = xmax
+        self.ymin = ymin
+        self.ymax = ymax
+        self.cells = cells
+        self.owner = np.full((cells, cells), -1)
+
+    def cellIndices(self, states):
+        column = ((states[0] - self.xmin) / (self.xmax - self.xmin) * self.cells).astype(int)
+        row = ((states[1] - self.ymin) / (self.ymax - self.ymin) * self.cells).astype(int)
+        return np.clip(row, 0, self.cells - 1), np.clip(column, 0, self.cells - 1)
+
+    def cellCenters(self, rows, columns):
+        x = self.xmin + (columns + 0.5) / self.cells * (self.xmax - self.xmin)
+        y = self.ymin + (rows + 0.5) / self.cells * (self.ymax - self.ymin)
+        return np.vstack((x, y))
+
+    def markSegments(self, segments, owner=-2):
+        for segment in segments:
+            finite = segment[np.isfinite(segment).all(axis=1)]
+            if len(finite) > 0:
+                self.owner[self.cellIndices(finite.T)] = owner
+
+    def stopFunction(self, owners, isCancelled=None):
+        # A trajectory stops once it enters a cell that another trajectory already passed through
+        def stop(indices, times, states):
+            if isCancelled is not None and isCancelled():
+                raise SolveCancelled()
+            cells = self.cellIndices(states)
+            current = self.owner[cells]
+            ids = owners[indices]
+            covered = (current != -1) & (current != ids)
+            self.owner[cells[0][~covered], cells[1][~covered]] = ids[~covered]
+            return covered
+        return stop
+
+
+def gridSeeds(xmin, xmax, ymin, ymax, seedsPerAxis):
+    x = xmin + (np.arange(seedsPerAxis) + 0.5) / seedsPerAxis * (xmax - xmin)
+    y = ymin + (np.arange(seedsPerAxis) + 0.5) / seedsPerAxis * (ymax - ymin)
+    X, Y = np.meshgrid(x, y)
+    return np.vstack((X.ravel(), Y.ravel()))
+
+
+def randomSeeds(xmin, xmax, ymin, ymax, seedsPerAxis, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+    count = seedsPerAxis * seedsPerAxis
+    return np.vstack((rng.uniform(xmin, xmax, count), rng.uniform(ymin, ymax, count)))
+
+
+def evenSeeds(coverage, stride, offset):
+    rows, columns = np.nonzero(coverage.owner == -1)
+    keep = (rows % stride == offset) & (columns % stride == offset)
+    return coverage.cellCenters(rows[keep], columns[keep])
+
+
+def integrateSeeds(system, seeds, owners, coverage, bounds, forwardSpan, backwardSpan, isCancelled):
+    stop = coverage.stopFunction(owners, isCancelled)
+    forward = integrateDormandPrince(system, seeds, 0, forwardSpan, bounds=bounds, stopFunction=stop)
+    backward = integrateDormandPrince(system, seeds, 0, backwardSpan, bounds=bounds, stopFunction=stop)
+    xmin, xmax, ymin, ymax = bounds
+    segments = []
+    for forwardSegment, backwardSegment in zip(forward.segments(xmin, xmax, ymin, ymax),
+                                               backward.segments(xmin, xmax, ymin, ymax)):
+        segment = np.vstack((backwardSegment[::-1], forwardSegment[1:]))
+        if np.isfinite(segment).all(axis=1).sum() > 1:
+            segments.append(segment)
+    return segments
+
+
+def computePortrait(system, xmin, xmax, ymin, ymax, forwardSpan, backwardSpan, seeding="Grid", density=1,
+                    existingSegments=(), rounds=3, isCancelled=None):
+    bounds = (xmin, xmax, ymin, ymax)
+    seedsPerAxis = max(2, int(density * 8))
+    stride = 3
+    coverage = CoverageGrid(xmin, xmax, ymin, ymax, seedsPerAxis * stride)
+    coverage.markSegments(existingSegments)
+
+    segments = []
+    nextOwner = 0
+    seedRounds = rounds if seeding == "Even" else 1
+    for seedRound in range(seedRounds):
+        if seeding == "Grid":
+            seeds = gridSeeds(xmin, xmax, ymin, ymax, seedsPerAxis)
+        elif seeding == "Random":
+            seeds = randomSeeds(xmin, xmax, ymin, ymax, seedsPerAxis)
+        else:
+            seeds = evenSeeds(coverage, stride, (1, 0, 2)[seedRound % 3])
+        if seeds.shape[1] == 0:
+            break
+        owners = np.arange(nextOwner, nextOwner + seeds.shape[1])
+        nextOwner += seeds.shape[1]
+        segments += integrateSeeds(system, seeds, owners, coverage, bounds, forwardSpan, backwardSpan, isCancelled)
+    return segments
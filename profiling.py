@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class Profiler:
+    # Counters and timers stay untouched while disabled, so the hooks in the hot paths cost one attribute check
+    def __init__(self, enabled=False, maxEvents=200000):
+        self.enabled = enabled
+        self.maxEvents = maxEvents
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.events = []
+        self.droppedEvents = 0
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.timers = {}
+            self.events = []
+            self.droppedEvents = 0
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return nullcontext()
+        return self.timedSpan(name, args)
+
+    @contextmanager
+    def timedSpan(self, name, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addSpan(name, start, time.perf_counter(), args)
+
+    def addSpan(self, name, start, end, args=None):
+        duration = end - start
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += duration
+            timer[2] = max(timer[2], duration)
+            timer[3] = duration
+            if len(self.events) < self.maxEvents:
+                self.events.append({"name": name, "ph": "X", "ts": (start - self.origin) * 1e6, "dur": duration * 1e6,
+                                    "pid": os.getpid(), "tid": threading.get_ident(), "args": args or {}})
+            else:
+                self.droppedEvents += 1
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {name: {"count": count, "totalMs": total * 1000, "meanMs": total / count * 1000,
+                             "maxMs": longest * 1000, "lastMs": last * 1000}
+                      for name, (count, total, longest, last) in self.timers.items()}
+        return counters, timers
+
+    def summary(self):
+        counters, timers = self.snapshot()
+        parts = ["{} {:,}".format(name, int(value)) for name, value in sorted(counters.items())]
+        parts += ["{} {:.1f} ms (mean {:.1f}, n {})".format(name, timer["lastMs"], timer["meanMs"], timer["count"])
+                  for name, timer in sorted(timers.items())]
+        return parts
+
+    def chromeTrace(self):
+        counters, timers = self.snapshot()
+        with self.lock:
+            events = list(self.events)
+        now = (time.perf_counter() - self.origin) * 1e6
+        events += [{"name": name, "ph": "C", "ts": now, "pid": os.getpid(), "args": {"value": value}}
+                   for name, value in counters.items()]
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"counters": counters, "timers": timers, "droppedEvents": self.droppedEvents}}
+
+    def exportTrace(self, fileName):
+        with open(fileName, "w") as traceFile:
+            json.dump(self.chromeTrace(), traceFile)
+
+
+profiler = Profiler(enabled=bool(os.environ.get("FIELD_PROFILE")))
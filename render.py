@@ -0,0 +1,344 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import matplotlib
+import matplotlib.colors as mcolors
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+from equations import bindEquation
+from exports import exportData
+from fields import (fieldColor, parametricQuiverStyle, parametricTitle, quiverScale, sampleParametricField,
+                    sampleStandardField, standardQuiverStyle, standardTitle)
+from integrators import parametricSystem, standardSystem
+from portraits import computePortrait, seedingModes
+from solvers import SolveCancelled, TrajectoryCache, clipToWindow, solveParametric, solveStandard, standardSegment
+from sweeps import sequenceJobs
+
+jobDefaults = {
+    "mode": "standard",
+    "window": [-10, 10, -10, 10],
+    "tmax": 10,
+    "density": 1,
+    "lineLength": 1,
+    "seeds": [],
+    "portrait": None,
+    "parameters": {},
+    "dpi": 100,
+    "data": None,
+    "sideGraphs": True,
+}
+# Frames handed to a worker at a time, small enough for steady progress
+sequenceChunk = 8
+# Each worker process keeps its trajectories between tasks, later frames of a sweep reuse what earlier ones solved
+workerCache = None
+
+
+def loadJobs(fileName):
+    with open(fileName) as jobFile:
+        jobs = json.load(jobFile)
+    if isinstance(jobs, dict):
+        jobs = jobs.get("jobs", [jobs])
+    baseDirectory = os.path.dirname(os.path.abspath(fileName))
+    for job in jobs:
+        for key in ("output", "data"):
+            if job.get(key) is not None and not os.path.isabs(job[key]):
+                job[key] = os.path.join(baseDirectory, job[key])
+    return jobs
+
+
+def completeJob(job):
+    job = dict(jobDefaults, **job)
+    if "output" not in job:
+        raise ValueError("Job is missing an output file")
+    if job["mode"] not in ("standard", "parametric"):
+        raise ValueError("Unknown mode: " + str(job["mode"]))
+    if job["mode"] == "standard" and "equation" not in job:
+        raise ValueError("Standard jobs need an equation")
+    if job["mode"] == "parametric" and ("xEquation" not in job or "yEquation" not in job):
+        raise ValueError("Parametric jobs need an xEquation and a yEquation")
+    if job["portrait"] is not None and job["portrait"] not in seedingModes:
+        raise ValueError("Unknown portrait seeding: " + str(job["portrait"]))
+    xmin, xmax, ymin, ymax = job["window"]
+    if xmin >= xmax or ymin >= ymax:
+        raise ValueError("Window minimums must be below their maximums")
+    return job
+
+
+def sideGraphName(output, variable):
+    root, extension = os.path.splitext(output)
+    return root + "_" + variable + "_graph" + extension
+
+
+def expectedOutputs(job):
+    # Files only a finished job leaves behind, exports write their header or archive last
+    outputs = [job["output"]]
+    if job["mode"] == "parametric" and job["sideGraphs"]:
+        outputs += [sideGraphName(job["output"], "x"), sideGraphName(job["output"], "y")]
+    if job["data"] is not None:
+        outputs.append(job["data"])
+    return outputs
+
+
+def saveFigure(figure, output):
+    # Written under a temporary name first, so an interrupted render never leaves a file that looks finished
+    partial = output + ".partial"
+    figure.savefig(partial, format=os.path.splitext(output)[1][1:] or None)
+    os.replace(partial, output)
+
+
+def newFigure(width, height, dpi):
+    figure = Figure(figsize=(width, height), dpi=dpi)
+    FigureCanvasAgg(figure)
+    return figure, figure.add_subplot(111)
+
+
+def renderStandard(job, cache=None):
+    equation = bindEquation(job["equation"], job["parameters"])
+    xmin, xmax, ymin, ymax = job["window"]
+    figure, axes = newFigure(6, 6, job["dpi"])
+
+    X, Y, U, V = sampleStandardField(equation, xmin, xmax, ymin, ymax, job["density"])
+    axes.quiver(X, Y, U, V, color=fieldColor, scale=quiverScale(job["lineLength"]), **standardQuiverStyle)
+    axes.update_datalim([(xmin, ymin), (xmax, ymax)])
+    axes.autoscale_view()
+    axes.set_title(standardTitle)
+    axes.set_xlabel("x")
+    axes.set_ylabel("y")
+
+    colors = list(mcolors.TABLEAU_COLORS.keys())
+    segments = [standardSegment(solveStandard(equation, xinit, yinit, xmin, xmax, ymin, ymax, cache), xmin, xmax, ymin,
+                                ymax)
+                for xinit, yinit in job["seeds"]]
+    axes.add_collection(LineCollection(segments, colors=[colors[i % len(colors)] for i in range(len(segments))],
+                                       linewidths=matplotlib.rcParams["lines.linewidth"]), autolim=False)
+    if job["portrait"] is not None:
+        portrait = computePortrait(standardSystem(equation), xmin, xmax, ymin, ymax, xmax - xmin, xmin - xmax,
+                                   job["portrait"], job["density"], segments)
+        axes.add_collection(LineCollection(portrait, colors='tab:blue', linewidths=0.8), autolim=False)
+
+    saveFigure(figure, job["output"])
+    outputs = [job["output"]]
+    if job["data"] is not None:
+        outputs += exportData(job["data"], True, None, equation, job["seeds"], xmin, xmax, ymin, ymax, job["tmax"],
+                              job["density"], cache)
+    return outputs
+
+
+def renderParametric(job, cache=None):
+    xEquation = bindEquation(job["xEquation"], job["parameters"])
+    yEquation = bindEquation(job["yEquation"], job["parameters"])
+    xmin, xmax, ymin, ymax = job["window"]
+    figure, axes = newFigure(6, 6, job["dpi"])
+    xFigure, xAxes = newFigure(3.5, 2.95, job["dpi"])
+    yFigure, yAxes = newFigure(3.5, 2.95, job["dpi"])
+
+    X, Y, U, V = sampleParametricField(xEquation, yEquation, xmin, xmax, ymin, ymax, job["density"])
+    axes.quiver(X, Y, U, V, color=fieldColor, scale=quiverScale(job["lineLength"]), **parametricQuiverStyle)
+    axes.update_datalim([(xmin, ymin), (xmax, ymax)])
+    axes.autoscale_view()
+    axes.set_title(parametricTitle)
+    axes.set_xlabel("x")
+    axes.set_ylabel("y")
+    xAxes.set_xlabel("t")
+    xAxes.set_ylabel("x")
+    yAxes.set_xlabel("t")
+    yAxes.set_ylabel("y")
+
+    colors = list(mcolors.TABLEAU_COLORS.keys())
+    segments = []
+    for index, (xinit, yinit) in enumerate(job["seeds"]):
+        times, values = solveParametric(xEquation, yEquation, xinit, yinit, job["tmax"], xmin, xmax, ymin, ymax,
+                                        cache)
+        color = colors[index % len(colors)]
+        segments.append(clipToWindow(values[0], values[1], xmin, xmax, ymin, ymax))
+        xAxes.plot(times, values[0], color=color)
+        yAxes.plot(times, values[1], color=color)
+    axes.add_collection(LineCollection(segments, colors=[colors[i % len(colors)] for i in range(len(segments))],
+                                       linewidths=matplotlib.rcParams["lines.linewidth"]), autolim=False)
+    if job["portrait"] is not None:
+        portrait = computePortrait(parametricSystem(xEquation, yEquation), xmin, xmax, ymin, ymax, job["tmax"],
+                                   -job["tmax"], job["portrait"], job["density"], segments)
+        axes.add_collection(LineCollection(portrait, colors='tab:blue', linewidths=0.8), autolim=False)
+
+    saveFigure(figure, job["output"])
+    outputs = [job["output"]]
+    if job["sideGraphs"]:
+        outputs += [sideGraphName(job["output"], "x"), sideGraphName(job["output"], "y")]
+        saveFigure(xFigure, outputs[1])
+        saveFigure(yFigure, outputs[2])
+    if job["data"] is not None:
+        outputs += exportData(job["data"], False, xEquation, yEquation, job["seeds"], xmin, xmax, ymin, ymax,
+                              job["tmax"], job["density"], cache)
+    return outputs
+
+
+def renderJob(job, cache=None):
+    job = completeJob(job)
+    for output in (job["output"], job["data"]):
+        directory = os.path.dirname(output) if output is not None else ""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    if job["mode"] == "standard":
+        return renderStandard(job, cache)
+    return renderParametric(job, cache)
+
+
+def renderJobs(jobs, workers=None):
+    # Yields (job, output files, error) in job order
+    if len(jobs) == 1 or workers == 1:
+        for job in jobs:
+            try:
+                yield job, renderJob(job), None
+            except Exception as err:
+                yield job, [], err
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(renderJob, job) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                yield job, future.result(), None
+            except Exception as err:
+                yield job, [], err
+
+
+def renderFrames(jobs):
+    # Runs in worker processes, errors travel back as text
+    global workerCache
+    if workerCache is None:
+        workerCache = TrajectoryCache()
+    results = []
+    for job in jobs:
+        try:
+            results.append((renderJob(job, workerCache), None))
+        except Exception as err:
+            results.append(([], str(err)))
+    return results
+
+
+def sharedWorkKey(job):
+    return (job["mode"], job.get("equation"), job.get("xEquation"), job.get("yEquation"),
+            json.dumps(job["parameters"], sort_keys=True), json.dumps(job["window"]))
+
+
+def sequenceTasks(jobs):
+    # Frames with the same equations and window share their trajectories. They go out longest tmax first, so the
+    # frames after the first one in a worker only cut cached trajectories short
+    groups = {}
+    for job in jobs:
+        groups.setdefault(sharedWorkKey(job), []).append(job)
+    tasks = []
+    for group in groups.values():
+        group.sort(key=lambda job: -job["tmax"])
+        tasks += [group[start:start + sequenceChunk] for start in range(0, len(group), sequenceChunk)]
+    return tasks
+
+
+def renderSequence(sequence, workers=None, overwrite=False, isCancelled=None):
+    # Yields (job, output files, error, skipped) as frames finish. Frames whose files all exist are skipped unless
+    # overwrite is set, so rendering an interrupted sequence again picks up where it stopped
+    jobs = [completeJob(job) for job in sequenceJobs(sequence)]
+    pending = []
+    for job in jobs:
+        if not overwrite and all(os.path.exists(output) for output in expectedOutputs(job)):
+            yield job, expectedOutputs(job), None, True
+        else:
+            pending.append(job)
+    tasks = sequenceTasks(pending)
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    if workers <= 1:
+        cache = TrajectoryCache()
+        for task in tasks:
+            for job in task:
+                if isCancelled is not None and isCancelled():
+                    raise SolveCancelled()
+                try:
+                    yield job, renderJob(job, cache), None, False
+                except Exception as err:
+                    yield job, [], err, False
+        return
+
+    # Spawned workers stay clear of the threads a calling GUI process already runs
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(renderFrames, task): task for task in tasks}
+        remaining = set(futures)
+        while remaining:
+            done, remaining = wait(remaining, timeout=0.2, return_when=FIRST_COMPLETED)
+            if isCancelled is not None and isCancelled():
+                for future in remaining:
+                    future.cancel()
+                raise SolveCancelled()
+            for future in done:
+                for job, (outputs, error) in zip(futures[future], future.result()):
+                    yield job, outputs, error, False
+
+
+class SequenceExport:
+    def __init__(self, outputs, failures, skipped):
+        # failures are (output, error message) for frames that could not be rendered, skipped counts frames whose
+        # files already existed
+        self.outputs = outputs
+        self.failures = failures
+        self.skipped = skipped
+
+
+def exportSequence(sequence, workers=None, progress=None, isCancelled=None):
+    # renderSequence for callers that only want the files, progress(done, total) is called after every frame
+    outputs = []
+    failures = []
+    skippedFrames = 0
+    total = int(sequence["frames"])
+    for done, (job, files, error, skipped) in enumerate(renderSequence(sequence, workers, isCancelled=isCancelled),
+                                                        1):
+        if error is not None:
+            failures.append((job["output"], str(error)))
+        skippedFrames += skipped
+        outputs += files
+        if progress is not None:
+            progress(done, total)
+    return SequenceExport(outputs, failures, skippedFrames)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render slope and vector fields from a JSON job file without a display.")
+    parser.add_argument("jobFile", help="JSON file holding one job, a list of jobs or {\"jobs\": [...]}. Jobs with "
+                                        "\"frames\" are sequences, see sweeps.sequenceJobs")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--overwrite", action="store_true", help="render sequence frames again even if they exist")
+    arguments = parser.parse_args(argv)
+
+    jobs = loadJobs(arguments.jobFile)
+    failures = 0
+    for job, outputs, error in renderJobs([job for job in jobs if "frames" not in job], arguments.workers):
+        if error is not None:
+            failures += 1
+            print(str(job.get("output")) + ": " + str(error), file=sys.stderr)
+        else:
+            for output in outputs:
+                print(output)
+
+    for sequence in (job for job in jobs if "frames" in job):
+        total = int(sequence["frames"])
+        try:
+            for done, (job, outputs, error, skipped) in enumerate(
+                    renderSequence(sequence, arguments.workers, arguments.overwrite), 1):
+                if error is not None:
+                    failures += 1
+                    print(job["output"] + ": " + str(error), file=sys.stderr)
+                else:
+                    print("[{}/{}] {}{}".format(done, total, job["output"], " (exists)" if skipped else ""), flush=True)
+        except ValueError as err:
+            failures += 1
+            print(str(sequence.get("output")) + ": " + str(err), file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from equations import partialDerivative
+from integrators import parametricSystem
+from profiling import profiler
+
+# Seeds whose Jacobian predicts more explicit steps than this start straight away with LSODA
+stiffStepLimit = 2000
+explicitEvaluationBudget = 30000
+stiffEvaluationBudget = 200000
+
+
+class SolveCancelled(Exception):
+    pass
+
+
+class EvaluationBudgetExceeded(Exception):
+    pass
+
+
+class TrajectoryBranch:
+    def __init__(self, times, states, failed, leftWindow, pixelSize):
+        self.times = times
+        self.states = states
+        self.failed = failed
+        self.leftWindow = leftWindow
+        self.pixelSize = pixelSize
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.states.nbytes
+
+
+class TrajectoryCache:
+    def __init__(self, maxBytes=64 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.totalBytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            branch = self.entries.get(key)
+            if branch is not None:
+                self.entries.move_to_end(key)
+            return branch
+
+    def put(self, key, branch):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.totalBytes -= previous.nbytes
+            self.entries[key] = branch
+            self.totalBytes += branch.nbytes
+            while self.totalBytes > self.maxBytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.totalBytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.totalBytes = 0
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+
+def cancellable(function, isCancelled):
+    if isCancelled is None:
+        return function
+
+    def cancellableFunction(t, state):
+        if isCancelled():
+            raise SolveCancelled()
+        return function(t, state)
+    return cancellableFunction
+
+
+def budgeted(function, budget):
+    evaluations = [0]
+
+    def budgetedFunction(t, state):
+        evaluations[0] += 1
+        if evaluations[0] > budget:
+            raise EvaluationBudgetExceeded()
+        return function(t, state)
+    return budgetedFunction
+
+
+def finiteDifferenceJacobian(function):
+    def jacobian(t, state):
+        state = np.asarray(state, dtype=float)
+        steps = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(state))
+        # Every perturbed state goes through the vectorized equations in a single call
+        perturbed = state[:, None] + np.diag(steps)
+        base = np.broadcast_to(np.asarray(function(t, state), dtype=float), state.shape)
+        values = np.broadcast_to(np.asarray(function(t, perturbed), dtype=float), perturbed.shape)
+        return (values - base[:, None]) / steps
+    return jacobian
+
+
+def standardJacobian(equation, function):
+    # Both state components follow dy/dx = f(x, y), so the Jacobian is diagonal
+    slope = partialDerivative(equation, "y")
+    if slope is None:
+        return finiteDifferenceJacobian(function)
+
+    def jacobian(t, state):
+        return np.diag(np.broadcast_to(np.asarray(slope(t, state), dtype=float), (len(state),)))
+    return jacobian
+
+
+def parametricJacobian(xEquation, yEquation, function):
+    partials = [partialDerivative(equation, variable) for equation in (xEquation, yEquation) for variable in "xy"]
+    if any(partial is None for partial in partials):
+        return finiteDifferenceJacobian(function)
+
+    def jacobian(t, state):
+        return np.array([float(partial(state[0], state[1])) for partial in partials]).reshape(2, 2)
+    return jacobian
+
+
+def explicitStepEstimate(jacobian, t0, state0, span):
+    # RK45 is only stable while h * -Re(lambda) stays below about 3.3
+    try:
+        eigenvalues = np.linalg.eigvals(jacobian(t0, np.asarray(state0, dtype=float)))
+    except (ValueError, ArithmeticError, np.linalg.LinAlgError):
+        return 0.0
+    decay = np.max(-eigenvalues.real)
+    if not np.isfinite(decay) or decay <= 0:
+        return 0.0
+    return decay * abs(span) / 3.3
+
+
+def standardPlane(times, states):
+    return times, states[1]
+
+
+def parametricPlane(times, states):
+    return states[0], states[1]
+
+
+def windowMargins(bounds, margin):
+    xmin, xmax, ymin, ymax = bounds
+    xmargin = (xmax - xmin) * margin
+    ymargin = (ymax - ymin) * margin
+    return xmin - xmargin, xmax + xmargin, ymin - ymargin, ymax + ymargin
+
+
+def windowDistance(plane, times, states, bounds, margin):
+    xlow, xhigh, ylow, yhigh = windowMargins(bounds, margin)
+    px, py = plane(times, states)
+    return np.minimum(np.minimum(px - xlow, xhigh - px), np.minimum(py - ylow, yhigh - py))
+
+
+def windowEvent(plane, bounds, margin):
+    def leaveWindow(t, state):
+        return windowDistance(plane, t, state, bounds, margin)
+    leaveWindow.terminal = True
+    leaveWindow.direction = -1
+    return leaveWindow
+
+
+def pixelSizeFor(bounds, resolution):
+    xmin, xmax, ymin, ymax = bounds
+    return np.array([(xmax - xmin) / resolution, (ymax - ymin) / resolution])
+
+
+def adaptiveSamples(solution, plane, pixelSize, maxPixels=8, tolerancePixels=0.25, maxSubdivisions=256):
+    # Subdivide each solver step by its on-screen length and by how far its midpoint bows away from the chord
+    steps = solution.t
+    if solution.sol is None or len(steps) < 2:
+        return steps, solution.y
+    starts, ends = steps[:-1], steps[1:]
+    startX, startY = plane(starts, solution.sol(starts))
+    endX, endY = plane(ends, solution.sol(ends))
+    midX, midY = plane((starts + ends) / 2, solution.sol((starts + ends) / 2))
+
+    length = np.hypot((endX - startX) / pixelSize[0], (endY - startY) / pixelSize[1])
+    deviation = np.hypot((midX - (startX + endX) / 2) / pixelSize[0], (midY - (startY + endY) / 2) / pixelSize[1])
+    counts = np.maximum(np.ceil(length / maxPixels), np.ceil(np.sqrt(deviation / tolerancePixels)))
+    counts = np.clip(np.nan_to_num(counts, nan=1, posinf=maxSubdivisions), 1, maxSubdivisions).astype(int)
+
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    times = np.repeat(starts, counts) + np.repeat((ends - starts) / counts, counts) * offsets
+    times = np.append(times, steps[-1])
+    return times, solution.sol(times)
+
+
+def integrateBranch(function, t0, state0, tend, plane, bounds, margin, resolution, jacobian=None):
+    from scipy.integrate import solve_ivp
+
+    events = windowEvent(plane, bounds, margin)
+    solution = None
+    stiff = jacobian is not None and explicitStepEstimate(jacobian, t0, state0, tend - t0) > stiffStepLimit
+    if not stiff:
+        try:
+            with profiler.span("solve_ivp"):
+                solution = solve_ivp(budgeted(function, explicitEvaluationBudget), (t0, tend), state0,
+                                     dense_output=True, events=events)
+        except EvaluationBudgetExceeded:
+            profiler.count("explicitBudgetExceeded")
+    if solution is None:
+        # Stiff or too slow with RK45, LSODA with the Jacobian gets a bounded budget of its own
+        profiler.count("stiffSolves")
+        try:
+            with profiler.span("solve_ivp stiff"):
+                solution = solve_ivp(budgeted(function, stiffEvaluationBudget), (t0, tend), state0, method="LSODA",
+                                     jac=jacobian, dense_output=True, events=events)
+        except EvaluationBudgetExceeded:
+            profiler.count("stiffBudgetExceeded")
+            return TrajectoryBranch(np.array([float(t0)]), np.array(state0, dtype=float).reshape(-1, 1), True,
+                                    False, pixelSizeFor(bounds, resolution))
+    with profiler.span("adaptiveSamples"):
+        times, states = adaptiveSamples(solution, plane, pixelSizeFor(bounds, resolution))
+    profiler.count("rhsEvaluations", solution.nfev)
+    profiler.count("solverSteps", len(solution.t) - 1)
+    profiler.count("samplesEmitted", len(times))
+    return TrajectoryBranch(times, np.asarray(states).reshape(len(state0), -1), solution.status < 0,
+                            solution.status == 1, pixelSizeFor(bounds, resolution))
+
+
+def cachedBranch(cache, key, function, t0, state0, tend, plane, bounds, margin=0.05, resolution=600, jacobian=None):
+    span = abs(tend - t0)
+    branch = cache.get(key) if cache is not None else None
+    pixelSize = pixelSizeFor(bounds, resolution)
+    # Zooming far into a cached branch would leave it too coarsely sampled, solve it again instead
+    if branch is not None and len(branch.times) > 1 and span > 0 and np.all(branch.pixelSize <= 2 * pixelSize):
+        covered = abs(branch.times[-1] - t0)
+        endDistance = windowDistance(plane, branch.times[-1], branch.states[:, -1], bounds, margin)
+        complete = covered >= span * (1 - 1e-12) or branch.failed
+        if complete or (branch.leftWindow and endDistance <= 1e-9 * np.max(pixelSize)):
+            profiler.count("cacheHits")
+            keep = np.abs(branch.times - t0) <= span
+            return TrajectoryBranch(branch.times[keep], branch.states[:, keep], branch.failed, branch.leftWindow,
+                                    branch.pixelSize)
+        profiler.count("cacheExtensions")
+        extension = integrateBranch(function, branch.times[-1], branch.states[:, -1], tend, plane, bounds, margin,
+                                    resolution, jacobian)
+        branch = TrajectoryBranch(np.concatenate((branch.times, extension.times[1:])),
+                                  np.hstack((branch.states, extension.states[:, 1:])), extension.failed,
+                                  extension.leftWindow, np.maximum(branch.pixelSize, extension.pixelSize))
+        cache.put(key, branch)
+        return branch
+
+    branch = integrateBranch(function, t0, state0, tend, plane, bounds, margin, resolution, jacobian)
+    if cache is not None:
+        cache.put(key, branch)
+    return branch
+
+
+def solveStandard(equation, xinit, yinit, xmin, xmax, ymin, ymax, cache=None, isCancelled=None):
+    function = cancellable(equation, isCancelled)
+    jacobian = standardJacobian(equation, function)
+    bounds = (xmin, xmax, ymin, ymax)
+    branches = []
+    for direction, xend in ((-1, xmin), (1, xmax)):
+        key = (equation, (xinit, yinit), "standard", direction)
+        branch = cachedBranch(cache, key, function, xinit, (xinit, yinit), xend, standardPlane, bounds,
+                              jacobian=jacobian)
+        if branch.states.shape[1] > 0:
+            branches.append((branch.times, branch.states[1]))
+        else:
+            branches.append((np.empty(0), np.empty(0)))
+    return branches
+
+
+def solveParametric(xEquation, yEquation, xinit, yinit, tmax, xmin, xmax, ymin, ymax, cache=None,
+                    isCancelled=None):
+    function = cancellable(parametricSystem(xEquation, yEquation), isCancelled)
+    jacobian = parametricJacobian(xEquation, yEquation, function)
+    key = ((xEquation, yEquation), (xinit, yinit), "parametric")
+    branch = cachedBranch(cache, key, function, 0, (xinit, yinit), tmax, parametricPlane, (xmin, xmax, ymin, ymax),
+                          jacobian=jacobian)
+    return branch.times, branch.states
+
+
+def clipToWindow(xvals, yvals, xmin, xmax, ymin, ymax):
+    segment = np.column_stack((xvals, yvals)).astype(float)
+    outside = ~((xmin < segment[:, 0]) & (segment[:, 0] < xmax) & (ymin < segment[:, 1]) & (segment[:, 1] < ymax))
+    segment[outside] = np.nan
+    profiler.count("pointsKept", len(segment) - np.count_nonzero(outside))
+    profiler.count("pointsDiscarded", np.count_nonzero(outside))
+    return segment
+
+
+def standardSegment(solution, xmin, xmax, ymin, ymax):
+    (leftX, leftY), (rightX, rightY) = solution
+    # Both branches start at the seed, so they join into one curve
+    xvals = np.concatenate((leftX[::-1], rightX[1:] if len(leftX) else rightX))
+    yvals = np.concatenate((leftY[::-1], rightY[1:] if len(leftY) else rightY))
+    return clipToWindow(xvals, yvals, xmin, xmax, ymin, ymax)
@@ -0,0 +1,53 @@
+from fields import sampleParametricField, sampleStandardField
+from solvers import solveParametric, solveStandard
+
+# Frames of a tmax sweep exported from the GUI
+sequenceFrames = 100
+
+
+def computeFrame(isStandard, xEquation, yEquation, points, xmin, xmax, ymin, ymax, tmax, density, cache=None,
+                 isCancelled=None):
+    # Everything one parameter value needs on screen, the field arrays and one solution per seed
+    if isStandard:
+        field = sampleStandardField(yEquation, xmin, xmax, ymin, ymax, density)
+        solutions = [solveStandard(yEquation, xinit, yinit, xmin, xmax, ymin, ymax, cache, isCancelled)
+                     for xinit, yinit in points]
+    else:
+        field = sampleParametricField(xEquation, yEquation, xmin, xmax, ymin, ymax, density)
+        solutions = [solveParametric(xEquation, yEquation, xinit, yinit, tmax, xmin, xmax, ymin, ymax, cache,
+                                     isCancelled)
+                     for xinit, yinit in points]
+    return field, solutions
+
+
+def interpolate(start, end, fraction):
+    if isinstance(start, (list, tuple)):
+        return [interpolate(first, last, fraction) for first, last in zip(start, end)]
+    return start + (end - start) * fraction
+
+
+def sequenceJobs(sequence):
+    # One render job per frame. Every "sweep" entry goes linearly from its first to its second value, parameters
+    # sweep as {"parameters": {name: [first, last]}}, and "{frame}" in the output names numbers the files
+    frames = int(sequence.get("frames", 0))
+    if frames < 1:
+        raise ValueError("Sequences need at least one frame")
+    if "{frame" not in sequence.get("output", ""):
+        raise ValueError("Sequence outputs need a {frame} field, such as frames/frame_{frame:04d}.png")
+    sweep = sequence.get("sweep", {})
+    base = {key: value for key, value in sequence.items() if key not in ("frames", "sweep")}
+    base.setdefault("sideGraphs", False)
+    jobs = []
+    for frame in range(frames):
+        fraction = frame / (frames - 1) if frames > 1 else 0.0
+        job = dict(base, frame=frame, output=base["output"].format(frame=frame))
+        if base.get("data") is not None:
+            job["data"] = base["data"].format(frame=frame)
+        for key, values in sweep.items():
+            if key != "parameters":
+                job[key] = interpolate(values[0], values[1], fraction)
+        job["parameters"] = dict(base.get("parameters", {}),
+                                 **{name: interpolate(first, last, fraction)
+                                    for name, (first, last) in sweep.get("parameters", {}).items()})
+        jobs.append(job)
+    return jobs
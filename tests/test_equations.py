@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from equations import EquationError, compileEquation, systemKernel
+
+
+def separateValues(xEquation, yEquation, x, y):
+    return np.array([np.broadcast_to(xEquation(x, y), np.shape(x)), np.broadcast_to(yEquation(x, y), np.shape(x))])
+
+
+@pytest.mark.parametrize("xString, yString", [("x*1e309", "y"), ("x*(1e309-1e309)", "y+2"), ("1e309", "-1e309*y"),
+                                               ("x-xy", "-y+xy"), ("sin(x)^2+cos(y)", "x^2-3")])
+def testKernelMatchesEquations(xString, yString):
+    xEquation = compileEquation(xString)
+    yEquation = compileEquation(yString)
+    kernel = systemKernel(xEquation, yEquation)
+    assert kernel is not None
+    x = np.linspace(-2, 2, 7)
+    y = np.linspace(1, 3, 7)
+    with np.errstate(all="ignore"):
+        np.testing.assert_array_equal(kernel(x, y), separateValues(xEquation, yEquation, x, y))
+        np.testing.assert_array_equal(kernel(1.5, -0.5), separateValues(xEquation, yEquation, 1.5, -0.5))
+
+
+def testUnfoldableConstantFallsBack():
+    assert systemKernel(compileEquation("1/0*x"), compileEquation("y")) is None
+
+
+def testImplicitProductsOfXAndY():
+    assert compileEquation("xyx")(2.0, 3.0) == 12.0
+
+
+@pytest.mark.parametrize("equationString, prefix", [("tx", "t"), ("Px", "P"), ("ax", "a"), ("sinx", "sin")])
+def testOtherLongNamesAreRejected(equationString, prefix):
+    with pytest.raises(EquationError, match="missing an operator or parentheses after " + prefix + r"\?"):
+        compileEquation(equationString)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from equations import compileEquation
+from fatemaps import computeFateMap
+
+
+def testLimitCycleGetsOneLabel():
+    # Van der Pol, every seed ends up on the one limit cycle around the unstable origin
+    fateMap = computeFateMap(compileEquation("y"), compileEquation("(1-x^2)*y-x"), -4, 4, -4, 4, resolution=30,
+                             workers=1)
+    assert len(fateMap.attractors) == 0
+    assert len(fateMap.cycles) == 1
+    assert np.all(fateMap.labels == 0)
+    assert np.ptp(fateMap.cycles[0][0]) > 3.5
+
+
+def testFixedPointInsideLimitCycle():
+    # The origin attracts the disc r < 1, the cycle at r = 2 everything else
+    fateMap = computeFateMap(compileEquation("-y-x*(x^2+y^2-1)*(x^2+y^2-4)"),
+                             compileEquation("x-y*(x^2+y^2-1)*(x^2+y^2-4)"), -3, 3, -3, 3, resolution=30, workers=1)
+    assert len(fateMap.attractors) == 1
+    assert len(fateMap.cycles) == 1
+    np.testing.assert_allclose(np.hypot(*fateMap.cycles[0]), 2, atol=0.05)
+    x = np.linspace(-3, 3, 61)[1::2]
+    radii = np.hypot(*np.meshgrid(x, x))
+    assert np.all(fateMap.labels[radii < 0.9] == 0)
+    assert np.all(fateMap.labels[radii > 1.1] == 1)
+
+
+def testCenterIsNotACycle():
+    fateMap = computeFateMap(compileEquation("y"), compileEquation("-x"), -2, 2, -2, 2, resolution=20, workers=1)
+    assert len(fateMap.cycles) == 0
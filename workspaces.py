@@ -0,0 +1,98 @@
+import hashlib
+import json
+
+import numpy as np
+
+from solvers import TrajectoryBranch
+
+workspaceVersion = 1
+workspaceFilter = "Field Generator workspace (*.fgw)"
+workspaceExtension = ".fgw"
+
+
+def equationHash(equation):
+    # Computed arrays are keyed by what the equation is, its string and bound parameters, never by the function
+    # object, so a reopened session can tell which of them still belong to its equations
+    identity = [getattr(equation, "equationString", None),
+                [[name, float(value)] for name, value in getattr(equation, "parameters", ())]]
+    return hashlib.sha256(json.dumps(identity).encode()).hexdigest()[:16]
+
+
+def branchRecords(equations, trajectoryCache):
+    # Cache keys are (equation, seed, "standard", direction) or ((xEquation, yEquation), seed, "parametric")
+    records = []
+    times = []
+    states = []
+    for key, branch in trajectoryCache.items():
+        keyEquations = key[0] if key[2] == "parametric" else (key[0],)
+        if any(equation not in equations for equation in keyEquations):
+            continue
+        records.append({"kind": key[2], "equations": [equationHash(equation) for equation in keyEquations],
+                        "seed": list(key[1]), "direction": key[3] if key[2] == "standard" else None,
+                        "failed": bool(branch.failed), "leftWindow": bool(branch.leftWindow),
+                        "pixelSize": branch.pixelSize.tolist(), "length": len(branch.times)})
+        times.append(branch.times)
+        states.append(branch.states)
+    return records, np.concatenate(times) if times else np.empty(0), np.hstack(states) if states else np.empty((2, 0))
+
+
+def tileRecords(equations, tileCache):
+    # Tile keys are (equation, xLevel, yLevel, column, row)
+    records = []
+    tiles = []
+    for key, tile in tileCache.items():
+        if key[0] not in equations:
+            continue
+        records.append([equationHash(key[0])] + [int(value) for value in key[1:]])
+        tiles.append(tile)
+    return records, np.stack(tiles) if tiles else np.empty((0, tileCache.tileSize, tileCache.tileSize))
+
+
+def saveWorkspace(fileName, state, equations, trajectoryCache, tileCache):
+    # state is the JSON part of the session, equations are the functions whose computed arrays are kept
+    branches, branchTimes, branchStates = branchRecords(equations, trajectoryCache)
+    tiles, tileValues = tileRecords(equations, tileCache)
+    header = {"version": workspaceVersion, "state": state, "branches": branches, "tiles": tiles}
+    with open(fileName, "wb") as workspaceFile:
+        np.savez_compressed(workspaceFile, header=np.array(json.dumps(header)), branchTimes=branchTimes,
+                            branchStates=branchStates, tileValues=tileValues)
+
+
+def loadWorkspace(fileName):
+    with np.load(fileName) as archive:
+        header = json.loads(str(archive["header"]))
+        if header.get("version", 0) > workspaceVersion:
+            raise ValueError("The workspace was saved by a newer version (" + str(header["version"]) + ")")
+        results = {name: archive[name] for name in ("branchTimes", "branchStates", "tileValues")}
+    results["branches"] = header["branches"]
+    results["tiles"] = header["tiles"]
+    return header["state"], results
+
+
+def restoreResults(results, equations, trajectoryCache, tileCache):
+    # Only arrays whose equation hashes match the reopened equations go back into the caches, everything else is
+    # left for the solvers to compute again. Returns how many branches and tiles were restored
+    functions = {equationHash(equation): equation for equation in equations}
+    restoredBranches = 0
+    start = 0
+    for record in results["branches"]:
+        end = start + record["length"]
+        if all(hashValue in functions for hashValue in record["equations"]):
+            keyEquations = tuple(functions[hashValue] for hashValue in record["equations"])
+            seed = tuple(record["seed"])
+            if record["kind"] == "parametric":
+                key = (keyEquations, seed, "parametric")
+            else:
+                key = (keyEquations[0], seed, "standard", record["direction"])
+            trajectoryCache.put(key, TrajectoryBranch(results["branchTimes"][start:end],
+                                                      results["branchStates"][:, start:end], record["failed"],
+                                                      record["leftWindow"], np.array(record["pixelSize"])))
+            restoredBranches += 1
+        start = end
+
+    restoredTiles = 0
+    for (tileHash, xLevel, yLevel, column, row), tile in zip(results["tiles"], results["tileValues"]):
+        if tileHash in functions:
+            tileCache.store((functions[tileHash], xLevel, yLevel, column, row), tile)
+            restoredTiles += 1
+    return restoredBranches, restoredTiles